@@ -4,6 +4,7 @@ import os
 import discord
 import auth
 import commands
+from dicelang import parsing
 
 class Atropos(discord.Client):
   def __init__(self, *args, **kwargs):
@@ -16,6 +17,7 @@ class Atropos(discord.Client):
     if not os.path.isdir(config_dir_path):
       os.mkdir(config_dir_path)
     
+    print(parsing.startup_report())
     print('Atropos initialized.')
 
   async def on_ready(self):
@@ -45,7 +47,7 @@ class Atropos(discord.Client):
     return msg.author.id == self.user.id
   
   async def on_message(self, msg):
-    if self.is_our_message(msg):
+    if self.is_our_message(msg) or not commands.might_be_command(msg.content):
       return
     
     # Process the message to generate a command object.
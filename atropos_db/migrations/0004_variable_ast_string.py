@@ -0,0 +1,18 @@
+# Generated by Django 3.1.12 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atropos_db', '0003_auto_20200424_2258'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='variable',
+            name='ast_string',
+            field=models.TextField(default=''),
+        ),
+    ]
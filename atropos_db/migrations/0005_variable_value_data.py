@@ -0,0 +1,256 @@
+# Generated by Django 3.1.12 on 2026-10-18 21:40
+
+import ast
+import math
+import struct
+
+from django.db import migrations, models
+
+# A frozen copy of the parts of version 2 of the dicelang.codec format that
+# this migration reads and writes, so that it keeps its meaning as the codec
+# changes. Values holding functions or aliases are not converted here: they
+# are left in the older format, which DataStore converts when it loads them.
+VERSION = 2
+DOUBLE = struct.Struct('<d')
+COMPLEX = struct.Struct('<dd')
+NEW_CODE = ord('+')
+SAME_CODE = ord('=')
+
+
+class Unconvertible(Exception):
+    pass
+
+
+class Undefined(object):
+    def __repr__(self):
+        return 'Undefined'
+
+Undefined = Undefined()
+
+
+class StoredFunction(object):
+    '''A function read from the codec format, written back as it was before.'''
+    def __init__(self, src, closed):
+        self.src = src
+        self.closed = closed if closed else [{}]
+
+    def __repr__(self):
+        src = self.src.replace('\n', '\f')
+        return f'Function({src!r}, closed_vars={self.closed!r})'
+
+
+class StoredAlias(object):
+    def __init__(self, function):
+        self.function = function
+
+    def __repr__(self):
+        return f'Alias({self.function!r})'
+
+
+def literal(node):
+    '''The value of the expression written by the repr of a stored value, if
+    it holds neither a function nor an alias.'''
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name):
+        names = {'Undefined': Undefined, 'inf': math.inf, 'nan': math.nan}
+        if node.id in names:
+            return names[node.id]
+    elif isinstance(node, ast.List):
+        return [literal(item) for item in node.elts]
+    elif isinstance(node, ast.Tuple):
+        return tuple(literal(item) for item in node.elts)
+    elif isinstance(node, ast.Dict):
+        return {literal(key): literal(item)
+            for key, item in zip(node.keys, node.values)}
+    elif isinstance(node, ast.UnaryOp):
+        operand = literal(node.operand)
+        if isinstance(node.op, ast.USub):
+            return -operand
+        if isinstance(node.op, ast.UAdd):
+            return +operand
+    elif isinstance(node, ast.BinOp):
+        # Complex numbers are written as sums, like `(1-2j)`.
+        left, right = literal(node.left), literal(node.right)
+        if isinstance(node.op, ast.Add):
+            return left + right
+        if isinstance(node.op, ast.Sub):
+            return left - right
+    raise Unconvertible()
+
+
+def write_size(out, n):
+    while n > 0x7f:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def read_size(data, pos):
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def write_string(out, text):
+    raw = text.encode('utf-8', 'surrogatepass')
+    write_size(out, len(raw))
+    out += raw
+
+
+def read_string(data, pos):
+    size, pos = read_size(data, pos)
+    end = pos + size
+    return str(data[pos:end], 'utf-8', 'surrogatepass'), end
+
+
+def write_value(out, value):
+    if value is Undefined:
+        out += b'U'
+    elif isinstance(value, bool):
+        out += b'T' if value else b'F'
+    elif isinstance(value, int):
+        if -(1 << 63) <= value < (1 << 63):
+            out += b'i'
+            write_size(out, value << 1 if value >= 0 else (-value << 1) - 1)
+        else:
+            raw = value.to_bytes(
+                (value.bit_length() + 8) // 8, 'little', signed=True)
+            out += b'I'
+            write_size(out, len(raw))
+            out += raw
+    elif isinstance(value, float):
+        out += b'd' + DOUBLE.pack(value)
+    elif isinstance(value, complex):
+        out += b'c' + COMPLEX.pack(value.real, value.imag)
+    elif isinstance(value, str):
+        out += b's'
+        write_string(out, value)
+    elif isinstance(value, (list, tuple)):
+        out += b'l' if isinstance(value, list) else b't'
+        write_size(out, len(value))
+        for item in value:
+            write_value(out, item)
+    elif isinstance(value, dict):
+        out += b'm'
+        write_size(out, len(value))
+        for key, item in value.items():
+            write_value(out, key)
+            write_value(out, item)
+    else:
+        raise Unconvertible()
+
+
+def read_value(data, pos):
+    tag = chr(data[pos])
+    pos += 1
+    if tag in 'UTF':
+        return {'U': Undefined, 'T': True, 'F': False}[tag], pos
+    if tag == 'i':
+        n, pos = read_size(data, pos)
+        return (n >> 1 if not n & 1 else -((n + 1) >> 1)), pos
+    if tag == 'I':
+        size, pos = read_size(data, pos)
+        end = pos + size
+        return int.from_bytes(data[pos:end], 'little', signed=True), end
+    if tag == 'd':
+        return DOUBLE.unpack_from(data, pos)[0], pos + DOUBLE.size
+    if tag == 'c':
+        real, imag = COMPLEX.unpack_from(data, pos)
+        return complex(real, imag), pos + COMPLEX.size
+    if tag == 's':
+        return read_string(data, pos)
+    if tag in 'lt':
+        size, pos = read_size(data, pos)
+        items = [ ]
+        for i in range(size):
+            item, pos = read_value(data, pos)
+            items.append(item)
+        return (items if tag == 'l' else tuple(items)), pos
+    if tag == 'p':
+        code = chr(data[pos])
+        size, pos = read_size(data, pos + 1)
+        end = pos + size * struct.calcsize(f'<{code}')
+        items = list(struct.unpack(f'<{size}{code}', data[pos:end]))
+        return items, end
+    if tag == 'm':
+        size, pos = read_size(data, pos)
+        out = { }
+        for i in range(size):
+            key, pos = read_value(data, pos)
+            out[key], pos = read_value(data, pos)
+        return out, pos
+    if tag == 'f':
+        src, pos = read_string(data, pos)
+        size, pos = read_size(data, pos)
+        for i in range(size):
+            param, pos = read_string(data, pos)
+        closed, pos = read_value(data, pos)
+        # The parse tree is skipped; the function is parsed from its source.
+        if data[pos] == NEW_CODE:
+            size, pos = read_size(data, pos + 1)
+            pos += size
+        elif data[pos] == SAME_CODE:
+            index, pos = read_size(data, pos + 1)
+        else:
+            raise Unconvertible()
+        return StoredFunction(src, closed), pos
+    if tag == 'a':
+        function, pos = read_value(data, pos)
+        return StoredAlias(function), pos
+    raise Unconvertible()
+
+
+def encode_values(apps, schema_editor):
+    '''Store each value that holds no functions in the codec format. Other
+    values are left in their current format.'''
+    Variable = apps.get_model('atropos_db', 'Variable')
+    for variable in Variable.objects.filter(value_data=b'').iterator():
+        try:
+            value = literal(ast.parse(variable.value_string, mode='eval').body)
+            data = bytearray([VERSION, 0])
+            write_value(data, value)
+        except (Unconvertible, SyntaxError, TypeError, ValueError):
+            continue
+        Variable.objects.filter(pk=variable.pk).update(value_data=bytes(data),
+            value_string='', ast_string='')
+
+
+def decode_values(apps, schema_editor):
+    '''Store each encoded value in the format from before the codec.'''
+    Variable = apps.get_model('atropos_db', 'Variable')
+    for variable in Variable.objects.exclude(value_data=b'').iterator():
+        data = bytes(variable.value_data)
+        try:
+            if data[0] != VERSION:
+                raise Unconvertible()
+            pos = 2
+            if data[1] & 1:
+                grammar, pos = read_string(data, pos)
+            value, pos = read_value(data, pos)
+        except Unconvertible:
+            raise Unconvertible(
+                f'Cannot convert variable {variable.name!r} back.') from None
+        Variable.objects.filter(pk=variable.pk).update(value_string=repr(value),
+            ast_string='', value_data=b'')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atropos_db', '0004_variable_ast_string'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='variable',
+            name='value_data',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.RunPython(encode_values, decode_values),
+    ]
@@ -1,4 +1,4 @@
-from django.db.models import CharField, IntegerField, TextField
+from django.db.models import BinaryField, CharField, IntegerField, TextField
 from django.db import models
 
 
@@ -17,7 +17,13 @@ class Variable(models.Model):
     ]
     var_type = CharField(max_length=7, choices=VARIABLE_TYPES, default=SERVER)
 
+    # The value encoded by dicelang.codec. Values it cannot encode, and rows
+    # not yet converted, leave it empty and use the fields below instead.
+    value_data = BinaryField(default=b'')
     value_string = TextField()
+    # JSON holding the compiled trees of any functions in `value_string`,
+    # so they can be loaded without reparsing. See dicelang.datastore.
+    ast_string = TextField(default='')
     name = CharField(max_length=2000)
 
     class Meta:
@@ -0,0 +1,8 @@
+export DICELANG_CORE_EDITORS="/home/$USER/.atropos-vars/editors"
+export DJANGO_ALLOW_ASYNC_UNSAFE="true"
+
+source env/bin/activate
+python3 -m dicelang.benchmarks.engines
+python3 -m dicelang.benchmarks.dice
+python3 -m dicelang.benchmarks.lists
+python3 -m dicelang.benchmarks.codec
@@ -1,7 +1,5 @@
-import re
 import enum
 import traceback
-import lark
 import discord
 from lark import UnexpectedToken
 from lark import UnexpectedCharacters
@@ -14,61 +12,9 @@ import helptext
 from dicelang import interpreter
 from dicelang.exceptions import DicelangError
 from result_file import ResultFile
-
-syntax = r'''
-  start: "+" ("atropos")? command
-  command: roll -> command_roll
-         | view -> command_view
-         | help -> command_help
-  
-  roll: "old" /(.|\n)+/  -> roll_code
-      | "roll" /(.|\n)+/ -> roll_lit
-      | "roll"            -> roll_help
-  
-  view: "view"    "all"   ("vars")?                  -> view_all
-      | "view" (( "global" ("vars")?) | "globals"  ) -> view_public
-      | "view" (( "our"    ("vars")?) | "shareds"  ) -> view_shared
-      | "view" (( "my"     ("vars")?) | "privates" ) -> view_private
-      | "view" (( "core"   ("vars")?) | "library"  ) -> view_core
-      | "view" (( "builtin"("vars")?) | "builtins" ) -> view_builtins
-      | "view" (/\w+/)?                              -> view_help
-  
-  help: "help" /\b\w+\b/+ -> help_topic
-      | "help"            -> help_help
-  
-  %import common.WS
-  %ignore WS
-'''
-
-class CommandType:
-  error = 'error'
-  roll_code = 'roll_code'
-  roll_lit  = 'roll_lit'
-  roll_help = 'roll_help'
-  view_all  = 'view_all'
-  view_public = 'view_public'
-  view_shared = 'view_shared'
-  view_private = 'view_private'
-  view_core = 'view_core'
-  view_help = 'view_help'
-  view_builtins = 'view_builtins'
-  help_topic = 'help_topic'
-  help_help = 'help_help'
-  
-  pass_by = ['start', 'command_roll', 'command_view', 'command_help']
-  views = [
-    view_public, view_private,
-    view_core,   view_shared,
-    view_help,   view_all,
-    view_builtins,
-  ]
-  
-  no_args = views + [help_help] + [roll_help]
-  rolls = [roll_code, roll_lit]
-  helps = [help_help, help_topic]
-  
-  all_rolls = [roll_code, roll_lit, roll_help]
-  
+from recognizer import CommandType
+from recognizer import Recognizer
+from recognizer import might_be_command
 
 class Builder(object):
   def __init__(self, dicelang_interpreter, helptext_engine):
@@ -122,12 +68,16 @@ class Builder(object):
     return {'action' : action, 'result' : result, 'help' : False}
       
   
-  def dice_reply(self, code, msg):
+  def dice_reply(self, code, msg, odds=False):
     server_id = self.get_server_id(msg)
     act, res = '', ''
     error = True
     try:
-      res, act = self.dicelang.execute(code, msg.author.id, server_id)
+      if odds:
+        dist = self.dicelang.odds(code, msg.author.id, server_id)
+        res, act = dist.table(), dist.summary()
+      else:
+        res, act = self.dicelang.execute(code, msg.author.id, server_id)
     except (UnexpectedCharacters, UnexpectedToken, UnexpectedInput) as e:
       res = e.get_context(code, max(15, len(code) // 10))
       act = 'Syntax Error'
@@ -172,17 +122,11 @@ class Builder(object):
 
 
 class Command(object):
-  pkw = {'start':'start', 'parser':'earley', 'lexer':'dynamic_complete'}
-  parser = lark.Lark(syntax, **pkw)
+  recognizer = Recognizer()
   builder = Builder(interpreter.Interpreter(), helptext.HelpText())
   
   def __init__(self, message):
-    parser_output = self.parse(message.content)
-    if parser_output['error']:
-      self.type = CommandType.error
-      self.kwargs = {}
-    else:
-      self.type, self.kwargs = self.visit(parser_output['tree'])
+    self.type, self.kwargs = Command.recognizer.recognize(message.content)
     self.originator = message
     self.stashed = None
   
@@ -204,37 +148,6 @@ class Command(object):
       pass
     return 'Atropos'
     
-  def parse(self, message_text):
-    '''Parses the text to decide whether it is a valid command.'''
-    try:
-      tree_or_error = self.__class__.parser.parse(message_text)
-    except (UnexpectedCharacters, UnexpectedToken, UnexpectedInput) as e:
-      tree_or_error = e.get_context(message_text, 20)
-      error = True
-    except Exception as e:
-      tree_or_error = e
-      error = True
-    else:
-      error = False
-    return {'error' : error, 'tree' : tree_or_error}
-
-  def visit(self, tree):
-    '''Retrieves the command's parameters from the parse tree.'''
-    if tree.data in CommandType.pass_by:
-      out = self.visit(tree.children[0])
-    elif tree.data in CommandType.no_args:
-      out = tree.data, {}
-    elif tree.data == CommandType.roll_code:
-      out = tree.data, {'value': tree.children[0].value}
-    elif tree.data == CommandType.roll_lit:
-      out = tree.data, {'value': tree.children[0].value, 'option': 'literate'}
-    elif tree.data == CommandType.help_topic:
-      option = tree.children[1].value if len(tree.children) > 1 else ''
-      out = tree.data, {'value': tree.children[0].value, 'option': option}
-    else:
-      out = tree.data, {'value': f'UNIMPLEMENTED: {tree.data}'}
-    return out
-
   async def send_reply_as(self, client):
     '''Called from the bot's event handlers. Accepts the object representing
     the bot's client instance, and sends a reply to the correctly-parsed
@@ -338,6 +251,17 @@ class Command(object):
       desc = f'```{self.originator.content}```'
       reply = self.pack_embed(client, title, desc, **self.stashed)
     
+    elif self.type == CommandType.roll_odds:
+      self.stashed = Command.builder.dice_reply(
+        self.kwargs['value'],
+        self.originator,
+        odds=True)
+      
+      titletype = 'Error' if self.stashed['error'] else 'Odds'
+      title = f'{titletype} for {username}'
+      desc = f'```{self.originator.content}```'
+      reply = self.pack_embed(client, title, desc, **self.stashed)
+    
     elif self.type == CommandType.roll_help:
       reply = {'content' : 'See `+atropos help quickstart` for more info.'}
     
@@ -0,0 +1,127 @@
+'''Static analysis of dicelang syntax trees.'''
+
+from lark import Tree
+
+from dicelang import builtin
+from dicelang import optimizer
+from dicelang import parsing
+
+# The storage mode read by each kind of identifier. A scoped name that is
+# neither builtin nor local is looked up among the server's variables.
+modes = {
+  'private_identifier' : 'private',
+  'server_identifier'  : 'server',
+  'global_identifier'  : 'global',
+  'core_identifier'    : 'core',
+  'scoped_identifier'  : 'server',
+}
+
+# Rules whose first identifier is only ever written or deleted, never read
+# from storage first.
+written = {'identifier_set', 'identifier_deletable', 'alias', 'for_loop'}
+
+# Rules in which only the first identifier names a variable. Those after it
+# are attribute names or the local name bound by the import.
+imports = {
+  'standard_import', 'standard_getattr_import', 'as_import',
+  'as_getattr_import'
+}
+
+# Rules that build a list of a range of numbers, and whether the list
+# includes its end.
+ranges = {
+  'range_list'          : False,
+  'range_list_stepped'  : False,
+  'closed_list'         : True,
+  'closed_list_stepped' : True,
+}
+
+# Rules that only read one of their operands, given by its index, without
+# keeping or changing it. A range literal there can be read as a lazy
+# `range` instead of being built as a list.
+readers = {
+  'for_loop'    : 1,
+  'length'      : 0,
+  'sum_or_join' : 0,
+  'minimum'     : 0,
+  'maximum'     : 0,
+  'present'     : 1,
+  'absent'      : 1,
+  'sliced'      : 0,
+}
+
+# Reductions of a list that can be accumulated one element at a time, from
+# the results of the rules that produce a list one element at a time; see
+# `reductions`.
+reductions = {'sum_or_join', 'length', 'minimum', 'maximum', 'stats'}
+loops = {'for_loop', 'repetition'}
+
+def unwrap(tree):
+  '''The first rule at or below `tree` that does more than pass its only
+  child along.'''
+  while tree.data in optimizer.passthrough and len(tree.children) == 1:
+    tree = tree.children[0]
+  return tree
+
+def range_literal(tree):
+  '''The range literal that `tree` is, or None if it is something else.'''
+  tree = unwrap(tree)
+  return tree if tree.data in ranges else None
+
+def reduced_loop(tree):
+  '''The loop or repetition that `tree`, the operand of a reduction, is, or
+  None if it is something else.'''
+  tree = unwrap(tree)
+  return tree if tree.data in loops else None
+
+def stored_names(tree):
+  '''The set of `(mode, name)` pairs of every stored variable that executing
+  `tree` could read, including from inside the functions it defines. The
+  set may include names that turn out to be local when the tree is run, but
+  never misses a variable that would be read from storage.'''
+  names = set()
+  stack = [tree]
+  while stack:
+    node = stack.pop()
+    rule = node.data
+    if rule in modes:
+      name = node.children[-1].value
+      if rule != 'scoped_identifier' or name not in builtin.variables:
+        names.add((modes[rule], name))
+      continue
+
+    children = [c for c in node.children if isinstance(c, Tree)]
+    if rule in written:
+      children = children[1:]
+    elif rule in imports:
+      children = children[:1]
+    elif rule == 'getattr':
+      children = children[:1]
+    elif rule == 'identifier_subscript' or rule == 'constant':
+      children = [ ]
+    stack.extend(children)
+  return names
+
+# The free names of each function body already analyzed.
+closures = parsing.TreeMemo()
+
+def free_names(code, params=()):
+  '''The names that the body `code` of a function with the parameters
+  `params` could read from the scopes it closes over, in sorted order. These
+  are the scoped names in the body, anywhere, that are not builtin and not
+  one of its own parameters or `this`, which the call binds first.'''
+  names = closures.get(code)
+  if names is None:
+    bound = set(params) | {'this'}
+    found = set()
+    stack = [code]
+    while stack:
+      node = stack.pop()
+      if node.data == 'scoped_identifier':
+        name = node.children[-1].value
+        if name not in builtin.variables and name not in bound:
+          found.add(name)
+        continue
+      stack.extend(c for c in node.children if isinstance(c, Tree))
+    names = closures.put(code, tuple(sorted(found)))
+  return names
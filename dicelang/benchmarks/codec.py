@@ -0,0 +1,74 @@
+'''Times storing and loading typical variables with `codec`, beside the
+`repr` and `eval` format it replaced, and compares the size of each. Run from
+the repository root with
+
+  python -m dicelang.benchmarks.codec [repeats]
+
+The old format is timed as `DataStore` used it: functions are written as
+their source with a table of their compiled trees, and read back through
+`eval` with that table.'''
+import sys
+import time
+import statistics
+
+from dicelang import codec
+from dicelang import datastore
+from dicelang.alias import Alias
+from dicelang.function import Function
+from dicelang.undefined import Undefined
+
+def library():
+  '''A dict of functions, some calling others, as core libraries hold.'''
+  double = Function('(x) -> x * 2')
+  apply = Function('(f, v) -> begin\n  f -: v\nend',
+    closed_vars=[{'double': double}])
+  roll = Function('(n, s) -> for i in [1 to n] do (1 d s) + double(i)',
+    closed_vars=[{'double': double}])
+  return {'double': double, 'apply': apply, 'roll': roll,
+    'three': Alias(Function('() -> 3'))}
+
+cases = {
+  'small int'   : lambda: 17,
+  'big int'     : lambda: 3 ** 500,
+  'float'       : lambda: 1 / 3,
+  'string'      : lambda: 'The quick brown fox.' * 10,
+  'int list'    : lambda: list(range(10000)),
+  'float list'  : lambda: [i / 7 for i in range(10000)],
+  'mixed dict'  : lambda: {
+    f'key{i}': [i, str(i), i / 2, (i, -i), Undefined] for i in range(500)},
+  'function'    : lambda: Function('(x, y) -> x d y + x'),
+  'library'     : library,
+}
+
+def time_call(function, repeats, *args):
+  samples = [ ]
+  for i in range(repeats):
+    start = time.perf_counter()
+    out = function(*args)
+    samples.append(time.perf_counter() - start)
+  return statistics.median(samples), out
+
+def legacy_encode(value):
+  return datastore.legacy_strings(value)
+
+def legacy_decode(strings):
+  return datastore.legacy_value(*strings)
+
+def legacy_size(strings):
+  return sum(len(s.encode('utf-8')) for s in strings)
+
+def main(repeats=20):
+  print(f'{"value":<12} {"encode":>10} {"before":>10} {"decode":>10}'
+    f' {"before":>10} {"size":>8} {"before":>8}')
+  for name, case in cases.items():
+    value = case()
+    encode, data = time_call(codec.encode, repeats, value)
+    old_encode, strings = time_call(legacy_encode, repeats, value)
+    decode, _ = time_call(codec.decode, repeats, data)
+    old_decode, _ = time_call(legacy_decode, repeats, strings)
+    print(f'{name:<12} {encode * 1e6:>8.1f}us {old_encode * 1e6:>8.1f}us'
+      f' {decode * 1e6:>8.1f}us {old_decode * 1e6:>8.1f}us'
+      f' {len(data):>8} {legacy_size(strings):>8}')
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,63 @@
+'''Compares rolling dice one at a time with rolling them with NumPy, and, for
+sums of whole pools, with drawing the sums from tables. The first draw from
+a table also builds it, so that time is shown apart. Run from the repository
+root with
+
+  python -m dicelang.benchmarks.dice [repeats]'''
+import sys
+import time
+import statistics
+
+from dicelang import governor
+from dicelang import sumtables
+from dicelang import util
+
+pools = [
+  (100, 6, None, 'all', True),
+  (1000, 6, 3, 'highest', True),
+  (100000, 20, 50, 'highest', True),
+  (100000, 20, 50, 'lowest', False),
+  (100000, 20, None, 'all', False),
+  (1000000, 6, None, 'all', True),
+  (1000000, 100, None, 'all', True),
+]
+
+def time_roll(roll, args, repeats):
+  samples = [ ]
+  for i in range(repeats):
+    start = time.perf_counter()
+    roll(*args, governor.Budget())
+    samples.append(time.perf_counter() - start)
+  return statistics.median(samples)
+
+def describe(dice, sides, count, mode, as_sum):
+  die = 'd' if as_sum else 'r'
+  keep = {'highest': f'h{count}', 'lowest': f'l{count}'}.get(mode, '')
+  return f'{dice}{die}{sides}{keep}'
+
+def table_roll(dice, sides, count, mode, as_sum, budget):
+  block = sumtables.block_size(dice, sides)
+  return util.table_roll(dice, sides, block, budget)
+
+def main(repeats=5):
+  print(f'{"pool":<16} {"scalar":>10} {"vector":>10} {"speedup":>8}'
+    f' {"build":>10} {"table":>10} {"speedup":>8}')
+  for args in pools:
+    scalar = time_roll(util.scalar_roll, args, repeats)
+    line = f'{describe(*args):<16} {scalar * 1000:>8.2f}ms'
+    if util.numpy is not None:
+      vector = time_roll(util.vector_roll, args, repeats)
+      line += f' {vector * 1000:>8.3f}ms {scalar / vector:>7.1f}x'
+    else:
+      line += f' {"-":>10} {"-":>8}'
+    dice, sides, count, mode, as_sum = args
+    if mode == 'all' and as_sum:
+      util.sum_tables.clear()
+      build = time_roll(table_roll, args, 1)
+      table = time_roll(table_roll, args, repeats)
+      line += f' {build * 1000:>8.2f}ms {table * 1000:>8.3f}ms'
+      line += f' {scalar / table:>7.1f}x'
+    print(line)
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:]])
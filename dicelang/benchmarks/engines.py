@@ -0,0 +1,67 @@
+'''Compares the execution engines of the Visitor on a few representative
+programs. Run from the repository root with
+
+  python -m dicelang.benchmarks.engines [repeats]
+
+Only the execution of already-parsed commands is timed; parsing and the
+storage of `_` by `Interpreter.execute` are left out so that the engines are
+measured on the same work. The one-time cost of compiling each program for
+an engine is reported separately.'''
+import sys
+import time
+import statistics
+
+from dicelang.interpreter import Interpreter
+from dicelang.ownership import ScopingData
+from dicelang.visitor import ENGINES
+
+user = 10
+server = 11
+
+programs = {
+  'arithmetic' : 'begin t = 0; for i in [0 to 20000] do t = t + i * 2 - 1; t end',
+  'while loop' : 'begin i = 0; while i < 20000 do i = i + 1; i end',
+  'recursion'  : ('begin f = (g, n) -> n if n < 2 else g(g, n - 1) + '
+                  'g(g, n - 2); f(f, 16) end'),
+  'apply'      : '((x) -> x * x + 1) -: [0 to 20000]',
+  'dice'       : '(3d6 + 2d8h1) ^ 5000',
+  'literals'   : '[[1, 2.5, "a", True], {"k": (1, 2)}, 3 ** 2] ^ 5000',
+}
+
+def time_engine(interpreter, tree, repeats):
+  visitor = interpreter.visitor
+  samples = [ ]
+  for i in range(repeats):
+    start = time.perf_counter()
+    visitor.walk(tree, ScopingData(user, server), True)
+    samples.append(time.perf_counter() - start)
+  return statistics.median(samples)
+
+def prepare(interpreter, tree):
+  '''Compile `tree` ahead of time for the interpreter's engine and return
+  how long that took.'''
+  visitor = interpreter.visitor
+  start = time.perf_counter()
+  if visitor.engine == 'closure':
+    visitor.compiler.compile(tree)
+  elif visitor.engine == 'vm':
+    visitor.machine.assemble(tree, in_function=False)
+  return time.perf_counter() - start
+
+def main(repeats=5):
+  interpreters = [Interpreter(engine=engine) for engine in ENGINES]
+  header = f'{"program":<12}'
+  for engine in ENGINES:
+    header += f' {engine:>10} {"compile":>9}'
+  print(header)
+  for name, text in programs.items():
+    tree = interpreters[0].parse_cache.parse(text)
+    line = f'{name:<12}'
+    for interpreter in interpreters:
+      compile_seconds = prepare(interpreter, tree)
+      seconds = time_engine(interpreter, tree, repeats)
+      line += f' {seconds * 1000:>8.2f}ms {compile_seconds * 1000:>7.3f}ms'
+    print(line)
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:]])
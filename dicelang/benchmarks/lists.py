@@ -0,0 +1,86 @@
+'''Times the list primitives of `util` on lists of a thousand to a million
+elements, to show how their cost grows with the length of the list. Each is
+timed beside the algorithm it replaced, until that would take too long. Run
+from the repository root with
+
+  python -m dicelang.benchmarks.lists [repeats]
+
+A primitive that takes linear time shows about the same time per element at
+every size.'''
+import sys
+import time
+import statistics
+
+from dicelang import util
+
+sizes = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+
+# Element operations beyond which the replaced algorithms are not timed.
+SLOW_WORK = 10 ** 10
+
+def rotated(items, turns):
+  '''Rotation as `util.shift` did it, one element at a time.'''
+  copy = items[:]
+  for i in range(turns):
+    copy.append(copy.pop(0))
+  return copy
+
+def spliced(items):
+  '''Flattening as `util.flatten` did it, splicing each sequence in place.'''
+  items = list(items)
+  for i, x in enumerate(items):
+    while i < len(items) and isinstance(items[i], (list, tuple)):
+      items[i:i+1] = items[i]
+  return items
+
+def deep(size):
+  '''A list nested `size` levels deep, with one element at each level.'''
+  out = [ ]
+  for i in range(size):
+    out = [i, out]
+  return out
+
+# Each case gives, for a size, the primitive and the replaced algorithm with
+# their arguments, and the element operations the replaced one does. None
+# stands for an algorithm that was already linear.
+cases = {
+  'rotate'       : lambda n: (
+    (util.shift, list(range(n)), n // 3, False),
+    (rotated, list(range(n)), n // 3), n * n // 3),
+  'flatten wide' : lambda n: (
+    (util.flatten, [[i] for i in range(n)]),
+    (spliced, [[i] for i in range(n)]), n * n),
+  'flatten deep' : lambda n: (
+    (util.flatten, deep(n)),
+    (spliced, deep(n)), n * n),
+  'repeat -10'   : lambda n: (
+    (util.iterable_repetition, list(range(n // 10)), -10), None, 0),
+}
+
+def time_call(call, repeats):
+  function, *args = call
+  samples = [ ]
+  for i in range(repeats):
+    start = time.perf_counter()
+    function(*args)
+    samples.append(time.perf_counter() - start)
+  return statistics.median(samples)
+
+def main(repeats=3):
+  print(f'{"primitive":<14} {"size":>8} {"time":>10} {"per element":>12}'
+    f' {"before":>10} {"speedup":>8}')
+  for name, case in cases.items():
+    for size in sizes:
+      now, before, work = case(size)
+      elapsed = time_call(now, repeats)
+      line = f'{name:<14} {size:>8} {elapsed * 1000:>8.2f}ms'
+      line += f' {elapsed / size * 1e9:>10.1f}ns'
+      if before is not None and work <= SLOW_WORK:
+        old = time_call(before, 1)
+        line += f' {old * 1000:>8.2f}ms {old / elapsed:>7.1f}x'
+      else:
+        line += f' {"-":>10} {"-":>8}'
+      print(line)
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,453 @@
+'''A compact binary encoding of dicelang values, for storing variables.
+
+`encode` turns a value into bytes and `decode` turns them back into an equal
+value. Every value the language produces can be encoded: booleans, integers
+of any size, floats (including `inf` and `nan`), complex numbers, strings,
+lists, tuples, dicts, `Undefined`, functions and aliases. Anything else
+raises CodecError, and is left to the `repr` format that came before.
+
+The first byte is the format version, and the second holds flags. Each value
+is a one-byte tag followed by its contents. Lengths and integers that fit in
+64 bits are varints, so that small numbers take a byte or two. A list of
+integers or floats of a single type is packed into a machine array of the
+narrowest type that holds them, and is read back in one step.
+
+Functions are stored with their parse trees, so that loading them parses
+nothing. Trees are only meaningful for the grammar that produced them, so
+the flags mark whether any were stored, and if so the grammar version
+follows. Each tree is preceded by its length in bytes, so that trees stored
+under another grammar can be skipped without reading them; the function is
+then parsed again from its source.'''
+
+import array
+import re
+import struct
+import sys
+
+from lark import Token
+from lark import Tree
+
+from dicelang import grammar
+from dicelang import optimizer
+from dicelang import parsing
+from dicelang.alias import Alias
+from dicelang.exceptions import CodecError
+from dicelang.function import Function
+from dicelang.undefined import Undefined
+
+VERSION = 2
+
+# Set in the flags when parse trees of functions follow.
+TREES = 1
+
+GRAMMAR = parsing.grammar_version('earley')
+
+# The names of the rules and terminals of the grammar, numbered in advance so
+# that trees refer to them by number alone. They change only with the grammar,
+# so GRAMMAR covers them too. Other names are numbered after these as they are
+# first written.
+SYMBOLS = sorted({rule or alias for rule, alias in re.findall(
+  r'^\s*[?!]*(\w+)(?:\.-?\d+)?\s*:|->\s*(\w+)', grammar.raw_text, re.M)})
+SYMBOL_NUMBERS = {name: i for i, name in enumerate(SYMBOLS)}
+
+# Lists of numbers shorter than this are written element by element.
+PACK_SIZE = 8
+
+# Array typecodes for packed integers, from the narrowest, with their bounds.
+INTEGER_ARRAYS = [
+  (code, -(1 << (8 * array.array(code).itemsize - 1)),
+    1 << (8 * array.array(code).itemsize - 1))
+  for code in ('b', 'h', 'i', 'q')
+]
+
+DOUBLE = struct.Struct('<d')
+COMPLEX = struct.Struct('<dd')
+SWAP = sys.byteorder != 'little'
+TOKEN = ord('k')
+NEW_CODE = ord('+')
+SAME_CODE = ord('=')
+
+def write_size(out, n):
+  '''Append a nonnegative integer as a varint.'''
+  while n > 0x7f:
+    out.append(n & 0x7f | 0x80)
+    n >>= 7
+  out.append(n)
+
+def read_size(data, pos):
+  '''Read a varint at `pos`, returning it and the position after it.'''
+  n = shift = 0
+  while True:
+    byte = data[pos]
+    pos += 1
+    n |= (byte & 0x7f) << shift
+    if byte < 0x80:
+      return n, pos
+    shift += 7
+
+def write_string(out, text):
+  raw = text.encode('utf-8', 'surrogatepass')
+  write_size(out, len(raw))
+  out += raw
+
+def read_string(data, pos):
+  size, pos = read_size(data, pos)
+  end = pos + size
+  return str(data[pos:end], 'utf-8', 'surrogatepass'), end
+
+
+class Encoder(object):
+  '''Writes one value. Rule and token names of parse trees not in SYMBOLS
+  are written once each and referred to by number after that, and so are the
+  bodies of functions, which are often held in several closures at once.'''
+
+  def __init__(self):
+    self.out = bytearray()
+    self.symbols = None
+    self.codes = { }
+    self.trees = False
+
+  def encode(self, value):
+    self.value(value)
+    header = bytearray([VERSION, TREES if self.trees else 0])
+    if self.trees:
+      write_string(header, GRAMMAR)
+    return bytes(header + self.out)
+
+  def value(self, value):
+    writer = self.writers.get(type(value))
+    if writer is not None:
+      writer(self, value)
+    elif value is Undefined:
+      self.out += b'U'
+    else:
+      for kind, writer in self.writers.items():
+        if isinstance(value, kind):
+          return writer(self, value)
+      raise CodecError(f'Cannot store a value of type {type(value).__name__}.')
+
+  def boolean(self, value):
+    self.out += b'T' if value else b'F'
+
+  def integer(self, value):
+    out = self.out
+    if -(1 << 63) <= value < (1 << 63):
+      out += b'i'
+      write_size(out, value << 1 if value >= 0 else (-value << 1) - 1)
+    else:
+      raw = value.to_bytes((value.bit_length() + 8) // 8, 'little', signed=True)
+      out += b'I'
+      write_size(out, len(raw))
+      out += raw
+
+  def real(self, value):
+    self.out += b'd'
+    self.out += DOUBLE.pack(value)
+
+  def complex(self, value):
+    self.out += b'c'
+    self.out += COMPLEX.pack(value.real, value.imag)
+
+  def string(self, value):
+    self.out += b's'
+    write_string(self.out, value)
+
+  def list(self, value):
+    if len(value) >= PACK_SIZE and self.packed(value):
+      return
+    self.out += b'l'
+    self.items(value)
+
+  def tuple(self, value):
+    self.out += b't'
+    self.items(value)
+
+  def items(self, value):
+    write_size(self.out, len(value))
+    for item in value:
+      self.value(item)
+
+  def dict(self, value):
+    self.out += b'm'
+    write_size(self.out, len(value))
+    for key, item in value.items():
+      self.value(key)
+      self.value(item)
+
+  def packed(self, value):
+    '''Write a list of integers or floats of one type as an array, if it is
+    one. Return whether it was written.'''
+    kinds = set(map(type, value))
+    if kinds == {float}:
+      code = 'd'
+    elif kinds == {int}:
+      low, high = min(value), max(value)
+      for code, least, bound in INTEGER_ARRAYS:
+        if least <= low and high < bound:
+          break
+      else:
+        return False
+    else:
+      return False
+    packed = array.array(code, value)
+    if SWAP:
+      packed.byteswap()
+    self.out += b'p'
+    self.out += code.encode('ascii')
+    write_size(self.out, len(value))
+    self.out += packed.tobytes()
+    return True
+
+  def function(self, value):
+    out = self.out
+    out += b'f'
+    write_string(out, value.src)
+    write_size(out, len(value.params))
+    for param in value.params:
+      write_string(out, param)
+    self.value(value.closed)
+    if not self.trees:
+      self.trees = True
+      self.symbols = dict(SYMBOL_NUMBERS)
+    index = self.codes.get(id(value.code))
+    if index is None:
+      self.codes[id(value.code)] = len(self.codes)
+      # The tree follows its length, so it is written on its own first.
+      self.out = bytearray()
+      self.tree(value.code)
+      tree, self.out = self.out, out
+      out.append(NEW_CODE)
+      write_size(out, len(tree))
+      out += tree
+    else:
+      out += b'='
+      write_size(out, index)
+
+  def alias(self, value):
+    self.out += b'a'
+    self.value(value.aliased)
+
+  def symbol(self, name):
+    index = self.symbols.get(name)
+    if index is None:
+      index = self.symbols[name] = len(self.symbols)
+      write_size(self.out, index)
+      write_string(self.out, name)
+    else:
+      write_size(self.out, index)
+
+  def tree(self, tree):
+    # Folded constants are stored as the subtree they were computed from,
+    # as `parsing.encode_tree` stores them.
+    if isinstance(tree, Tree) and tree.data == 'constant':
+      return self.tree(tree.children[1])
+    if isinstance(tree, Tree):
+      self.out += b'r'
+      self.symbol(tree.data)
+      write_size(self.out, len(tree.children))
+      for child in tree.children:
+        self.tree(child)
+    else:
+      self.out += b'k'
+      self.symbol(tree.type)
+      write_string(self.out, tree.value)
+
+# The writer of each type of value.
+Encoder.writers = {
+  bool     : Encoder.boolean,
+  int      : Encoder.integer,
+  float    : Encoder.real,
+  complex  : Encoder.complex,
+  str      : Encoder.string,
+  list     : Encoder.list,
+  tuple    : Encoder.tuple,
+  dict     : Encoder.dict,
+  Function : Encoder.function,
+  Alias    : Encoder.alias,
+}
+
+
+class Decoder(object):
+  '''Reads one value written by Encoder.'''
+
+  def __init__(self, data):
+    self.data = memoryview(data)
+    self.symbols = None
+    self.codes = [ ]
+
+  def decode(self):
+    data = self.data
+    if len(data) < 2 or data[0] != VERSION:
+      raise CodecError('Stored value has an unknown format.')
+    pos = 2
+    self.current = True
+    if data[1] & TREES:
+      grammar, pos = read_string(data, pos)
+      self.current = grammar == GRAMMAR
+    value, pos = self.value(pos)
+    if pos != len(data):
+      raise CodecError('Stored value has trailing data.')
+    return value
+
+  def value(self, pos):
+    try:
+      reader = self.readers[self.data[pos]]
+    except KeyError:
+      raise CodecError(f'Unknown tag in stored value: {self.data[pos]}.')
+    return reader(self, pos + 1)
+
+  def string(self, pos):
+    return read_string(self.data, pos)
+
+  def integer(self, pos):
+    n, pos = read_size(self.data, pos)
+    return (n >> 1 if not n & 1 else -((n + 1) >> 1)), pos
+
+  def big_integer(self, pos):
+    size, pos = read_size(self.data, pos)
+    end = pos + size
+    return int.from_bytes(self.data[pos:end], 'little', signed=True), end
+
+  def real(self, pos):
+    return DOUBLE.unpack_from(self.data, pos)[0], pos + DOUBLE.size
+
+  def complex(self, pos):
+    real, imag = COMPLEX.unpack_from(self.data, pos)
+    return complex(real, imag), pos + COMPLEX.size
+
+  def items(self, pos):
+    size, pos = read_size(self.data, pos)
+    out = [ ]
+    value = self.value
+    for i in range(size):
+      item, pos = value(pos)
+      out.append(item)
+    return out, pos
+
+  def list(self, pos):
+    return self.items(pos)
+
+  def tuple(self, pos):
+    items, pos = self.items(pos)
+    return tuple(items), pos
+
+  def dict(self, pos):
+    size, pos = read_size(self.data, pos)
+    out = { }
+    value = self.value
+    for i in range(size):
+      key, pos = value(pos)
+      item, pos = value(pos)
+      out[key] = item
+    return out, pos
+
+  def packed(self, pos):
+    code = chr(self.data[pos])
+    size, pos = read_size(self.data, pos + 1)
+    packed = array.array(code)
+    end = pos + size * packed.itemsize
+    packed.frombytes(self.data[pos:end])
+    if SWAP:
+      packed.byteswap()
+    return packed.tolist(), end
+
+  def function(self, pos):
+    src, pos = read_string(self.data, pos)
+    size, pos = read_size(self.data, pos)
+    params = [ ]
+    for i in range(size):
+      param, pos = read_string(self.data, pos)
+      params.append(param)
+    closed, pos = self.value(pos)
+    if self.symbols is None:
+      self.symbols = SYMBOLS[:]
+    tag = self.data[pos]
+    if tag == SAME_CODE:
+      index, pos = read_size(self.data, pos + 1)
+      code = self.codes[index]
+    elif tag == NEW_CODE:
+      size, pos = read_size(self.data, pos + 1)
+      end = pos + size
+      code = None
+      if self.current:
+        code, pos = self.tree(pos)
+        if pos != end:
+          raise CodecError('Stored parse tree is damaged.')
+        code = optimizer.fold(code)
+      self.codes.append(code)
+      pos = end
+    else:
+      raise CodecError(f'Unknown tag in stored value: {tag}.')
+    if code is not None:
+      out = Function.restored(code, params, src, closed)
+    else:
+      out = Function(src, closed_vars=closed)
+    return out, pos
+
+  def alias(self, pos):
+    function, pos = self.value(pos)
+    return Alias(function), pos
+
+  def symbol(self, pos):
+    index, pos = read_size(self.data, pos)
+    if index == len(self.symbols):
+      name, pos = read_string(self.data, pos)
+      self.symbols.append(name)
+    return self.symbols[index], pos
+
+  def tree(self, pos):
+    data = self.data
+    tag = data[pos]
+    # Symbol numbers, lengths and child counts almost always fit in a byte.
+    index = data[pos + 1]
+    if index < 0x80 and index < len(self.symbols):
+      name = self.symbols[index]
+      pos += 2
+    else:
+      name, pos = self.symbol(pos + 1)
+    size = data[pos]
+    if size < 0x80:
+      pos += 1
+    else:
+      size, pos = read_size(data, pos)
+    if tag == TOKEN:
+      end = pos + size
+      return Token(name, str(data[pos:end], 'utf-8', 'surrogatepass')), end
+    children = [ ]
+    tree = self.tree
+    for i in range(size):
+      child, pos = tree(pos)
+      children.append(child)
+    return Tree(name, children), pos
+
+# The reader of each tag.
+Decoder.readers = {
+  ord('U') : lambda self, pos: (Undefined, pos),
+  ord('T') : lambda self, pos: (True, pos),
+  ord('F') : lambda self, pos: (False, pos),
+  ord('i') : Decoder.integer,
+  ord('I') : Decoder.big_integer,
+  ord('d') : Decoder.real,
+  ord('c') : Decoder.complex,
+  ord('s') : Decoder.string,
+  ord('l') : Decoder.list,
+  ord('p') : Decoder.packed,
+  ord('t') : Decoder.tuple,
+  ord('m') : Decoder.dict,
+  ord('f') : Decoder.function,
+  ord('a') : Decoder.alias,
+}
+
+
+def encode(value):
+  '''The bytes that store `value`, or raise CodecError if it has a part of
+  a type that cannot be stored.'''
+  return Encoder().encode(value)
+
+def decode(data):
+  '''The value stored in `data` by `encode`, or raise CodecError if `data`
+  was not written by it.'''
+  try:
+    return Decoder(data).decode()
+  except (IndexError, ValueError, struct.error) as e:
+    raise CodecError(f'Stored value is damaged: {e}') from e
@@ -0,0 +1,681 @@
+import time
+
+from numbers import Number
+
+from dicelang import analysis
+from dicelang import distribution
+from dicelang import governor
+from dicelang import parsing
+from dicelang import plugins
+from dicelang import reductions
+from dicelang import util
+
+from dicelang.exceptions import BreakSignal
+from dicelang.exceptions import SkipSignal
+from dicelang.exceptions import ReturnSignal
+
+from dicelang.exceptions import BreakError
+from dicelang.exceptions import DoWhileLoopTimeout
+from dicelang.exceptions import OperationError
+from dicelang.exceptions import SkipError
+from dicelang.exceptions import WhileLoopTimeout
+
+from dicelang.function import Function
+from dicelang.alias import Alias
+from dicelang.undefined import Undefined
+
+from dicelang.identifier import Identifier
+
+class Compiler(object):
+  '''Translates a syntax tree into nested Python closures, once, so that
+  executing it again costs no dispatch on rule names and no re-reading of
+  literals. Each closure takes no arguments and returns the value of its
+  subtree, reading the scoping data, print queue and budget from the
+  Visitor it was compiled for, which is what lets the same compiled code be
+  shared between executions.
+
+  The closures reproduce the Visitor's handlers exactly, raising the same
+  signals and pushing and popping the same scopes. The one difference is
+  how work is charged to the budget: the walker charges each node as it
+  visits it, while compiled code is charged the weight of a tree when the
+  Visitor enters it, including at each function call, and the weight of a
+  loop's body at each iteration. Those are the only places where the amount
+  of work is not bounded by the size of the tree, apart from the operations
+  that charge for their own work.'''
+
+  # Rules that only ever wrap a single child. They compile to that child.
+  passthrough = {
+    'body', 'conditional', 'expression', 'import', 'deletable', 'assignment',
+    'subscript', 'if_expr', 'repeat', 'bool_or', 'bool_xor', 'bool_and',
+    'bool_not', 'comp', 'arithm', 'term', 'factor', 'power', 'reduction',
+    'die', 'primary', 'slice', 'keyword_expr', 'atom', 'priority',
+    'tuple_literal', 'identifier'
+  }
+
+  # Rules whose result is computed by a function of their evaluated children.
+  strict = {
+    'addition'         : util.addition,
+    'subtraction'      : util.subtraction,
+    'catenation'       : util.catenation,
+    'division'         : util.division,
+    'remainder'        : util.remainder,
+    'floor_division'   : util.floor_division,
+    'left_shift'       : util.shift,
+    'right_shift'      : lambda l, r: util.shift(l, r, left_shift=False),
+    'negation'         : util.negation,
+    'real_part_or_nop' : util.real_part_or_nop,
+    'logarithm'        : util.logarithm,
+    'sum_or_join'      : util.sum_or_join,
+    'length'           : util.length,
+    'selection'        : util.selection,
+    'minimum'          : lambda x: util.extremum(x, 'minimum'),
+    'maximum'          : lambda x: util.extremum(x, 'maximum'),
+    'flatten_or_abs'   : util.flatten_or_abs,
+    'stats'            : util.stats,
+    'sort'             : util.sort,
+    'shuffle'          : util.shuffle,
+  }
+
+  identifiers = {
+    'core_identifier', 'scoped_identifier', 'global_identifier',
+    'server_identifier', 'private_identifier'
+  }
+
+  signals = {
+    'break'  : BreakSignal,
+    'skip'   : SkipSignal,
+    'return' : ReturnSignal
+  }
+
+  def __init__(self, visitor):
+    self.visitor = visitor
+    self.compiled = parsing.TreeMemo()
+
+  def compile(self, tree):
+    '''Return the closure for `tree`, building it on first use. Calling it
+    charges the weight of the whole tree to the Visitor's budget.'''
+    closure = self.compiled.get(tree)
+    if closure is None:
+      closure = self.compiled.put(tree, self.entry(tree, self.build(tree)))
+    return closure
+
+  def entry(self, tree, closure):
+    visitor = self.visitor
+    weight = governor.weight(tree)
+    def entered():
+      visitor.budget.spend(weight)
+      return closure()
+    return entered
+
+  def build(self, tree):
+    '''Dispatch on the rule name of `tree` to the method that compiles it.'''
+    rule = tree.data
+    children = tree.children
+    if rule in Compiler.passthrough:
+      return self.build(children[0])
+    if rule in analysis.reductions and analysis.reduced_loop(children[0]):
+      return self.compile_reduction(rule, analysis.reduced_loop(children[0]))
+    if rule in Compiler.strict:
+      read = analysis.readers.get(rule)
+      return self.compile_strict(Compiler.strict[rule], children, read)
+    if rule in Compiler.identifiers:
+      return self.compile_identifier(rule, children)
+    if rule.endswith('_subscript'):
+      return self.compile_subscript(rule, children)
+    if 'vector_die' in rule or 'scalar_die' in rule:
+      return self.compile_dice(rule, children)
+    if rule.endswith('_slice'):
+      return self.compile_slice(rule, children)
+    if rule in ('break_expr', 'skip_expr', 'return_expr'):
+      return self.compile_signal(children, bare=False)
+    if rule in ('break_bare', 'skip_bare', 'return_bare'):
+      return self.compile_signal(children, bare=True)
+
+    method = getattr(self, f'compile_{rule}', None)
+    if method is None:
+      out = f'__UNIMPLEMENTED__: {rule}'
+      return lambda: out
+    return method(children)
+
+  def build_all(self, children, read=None):
+    '''Build each of `children`. The child at index `read`, if any, is an
+    operand that is only read, so a range literal there builds a lazy
+    `range` instead of a list.'''
+    return [self.build_read(c) if i == read else self.build(c)
+      for i, c in enumerate(children)]
+
+  def build_read(self, tree):
+    node = analysis.range_literal(tree)
+    if node is None:
+      return self.build(tree)
+    closed = analysis.ranges[node.data]
+    return self.compile_range_list(node.children, closed, lazy=True)
+
+  def resolve(self, operation):
+    '''Wrap `operation` so that an Alias it produces is called, as the
+    Visitor does for the result of every node. Only operations that can
+    produce an Alias need this.'''
+    visitor = self.visitor
+    def resolved():
+      out = operation()
+      if isinstance(out, Alias):
+        out = out(visitor)
+      return out
+    return resolved
+
+  def compile_strict(self, function, children, read=None):
+    operations = self.build_all(children, read)
+    if len(operations) == 1:
+      operand, = operations
+      return lambda: function(operand())
+    left, right = operations
+    return lambda: function(left(), right())
+
+  def compile_start(self, children):
+    statements = self.build_all(children)
+    def start():
+      for statement in statements:
+        out = statement()
+      return out
+    return start
+
+  def compile_block(self, children):
+    visitor = self.visitor
+    statements = self.build_all(children)
+    def block():
+      visitor.scoping_data.push_scope()
+      for statement in statements:
+        out = statement()
+      visitor.scoping_data.pop_scope()
+      return out
+    return block
+
+  compile_short_body = compile_block
+
+  def compile_function(self, children):
+    visitor = self.visitor
+    code = children[-1]
+    params = [c.value for c in children[:-1]]
+    names = analysis.free_names(code, params)
+    def function():
+      closed = visitor.scoping_data.calling_environment(names)
+      out = Function(code, param_names=params, closed_vars=closed)
+      out.visitor = visitor
+      return out
+    return function
+
+  def compile_alias(self, children):
+    make_alias = self.visitor.make_alias
+    identifier, aliased = self.build_all(children)
+    return lambda: make_alias(identifier(), aliased())
+
+  def compile_inspection(self, children):
+    identifier = self.build(children[1])
+    def inspection():
+      obj = identifier().get()
+      return obj.aliased if isinstance(obj, Alias) else obj
+    return inspection
+
+  def compile_reduction(self, rule, loop):
+    '''A reduction of a loop or repetition, whose results are accumulated as
+    they are produced instead of being collected in a list first.'''
+    accumulator = reductions.accumulators[rule]
+    if loop.data == 'for_loop':
+      produce = self.compile_for_loop(loop.children, accumulator)
+    else:
+      produce = self.compile_repetition(loop.children, accumulator)
+    return lambda: produce().value()
+
+  def compile_for_loop(self, children, accumulator=list):
+    visitor = self.visitor
+    weight = governor.weight(children[2])
+    iterator, iterable_of, body = self.build_all(
+      children, analysis.readers['for_loop'])
+    def for_loop():
+      name = iterator().name
+      iterable = iterable_of()
+      if isinstance(iterable, dict):
+        iterable = list(iterable.keys())
+
+      start = iterable[0] if len(iterable) else None
+      results = accumulator()
+      if start is not None:
+        visitor.scoping_data.push_scope()
+        budget = visitor.budget
+        for element in iterable:
+          budget.spend(weight)
+          try:
+            visitor.scoping_data.get_scope()[name] = element
+            results.append(body())
+          except BreakSignal as bs:
+            if bs.is_set:
+              results.append(bs.data)
+            break
+          except SkipSignal as ss:
+            if ss.is_set:
+              results.append(ss.data)
+            continue
+        visitor.scoping_data.pop_scope()
+      return results
+    return for_loop
+
+  def compile_while_loop(self, children):
+    visitor = self.visitor
+    weight = governor.weight(children[0]) + governor.weight(children[1])
+    condition, body = self.build_all(children)
+    def while_loop():
+      visitor.scoping_data.push_scope()
+      results = [ ]
+      budget = visitor.budget
+      timeout = time.time() + visitor.loop_timeout
+      while condition():
+        budget.spend(weight)
+        if budget.now > timeout:
+          raise WhileLoopTimeout(len(results))
+        try:
+          results.append(body())
+        except BreakSignal as bs:
+          if bs.is_set:
+            results.append(bs.data)
+          break
+        except SkipSignal as ss:
+          if ss.is_set:
+            results.append(ss.data)
+          continue
+      visitor.scoping_data.pop_scope()
+      return results
+    return while_loop
+
+  def compile_do_while_loop(self, children):
+    visitor = self.visitor
+    weight = governor.weight(children[0]) + governor.weight(children[1])
+    body, condition = self.build_all(children)
+    def do_while_loop():
+      visitor.scoping_data.push_scope()
+      results = [body()]
+      budget = visitor.budget
+      timeout = time.time() + visitor.loop_timeout
+      while condition():
+        budget.spend(weight)
+        if budget.now > timeout:
+          raise DoWhileLoopTimeout(len(results))
+        try:
+          results.append(body())
+        except BreakSignal as bs:
+          if bs.is_set:
+            results.append(bs.data)
+          break
+        except SkipSignal as ss:
+          if ss.is_set:
+            results.append(ss.data)
+          continue
+      visitor.scoping_data.pop_scope()
+      return results
+    return do_while_loop
+
+  def compile_if(self, children):
+    visitor = self.visitor
+    condition, body = self.build_all(children)
+    def if_():
+      result = Undefined
+      visitor.scoping_data.push_scope()
+      if condition():
+        result = body()
+      visitor.scoping_data.pop_scope()
+      return result
+    return if_
+
+  def compile_if_else(self, children):
+    visitor = self.visitor
+    condition, body, orelse = self.build_all(children)
+    def if_else():
+      visitor.scoping_data.push_scope()
+      out = body() if condition() else orelse()
+      visitor.scoping_data.pop_scope()
+      return out
+    return if_else
+
+  def compile_standard_import(self, children):
+    standard_import = self.visitor.standard_import
+    identifier = self.build(children[1])
+    return lambda: standard_import(identifier())
+
+  def compile_standard_getattr_import(self, children):
+    standard_getattr_import = self.visitor.standard_getattr_import
+    identifiers = self.build_all(children[1:])
+    return lambda: standard_getattr_import([i() for i in identifiers])
+
+  def compile_as_import(self, children):
+    as_import = self.visitor.as_import
+    importable, alias = self.build_all(children[1:])
+    return lambda: as_import(importable(), alias())
+
+  def compile_as_getattr_import(self, children):
+    as_getattr_import = self.visitor.as_getattr_import
+    identifiers = self.build_all(children[1:])
+    return lambda: as_getattr_import([i() for i in identifiers])
+
+  def compile_deletion(self, children):
+    deletables = self.build_all(children)
+    def deletion():
+      out = tuple([d() for d in deletables])
+      return out[0] if len(out) == 1 else out
+    return deletion
+
+  def compile_identifier_deletable(self, children):
+    identifier = self.build(children[0])
+    return self.resolve(lambda: identifier().drop())
+
+  def compile_subscript_deletable(self, children):
+    delete_subscript = self.visitor.delete_subscript
+    identifier, chain = self.build_all(children)
+    return self.resolve(lambda: delete_subscript(identifier(), chain()))
+
+  def compile_identifier_set(self, children):
+    identifier, value = self.build_all(children)
+    return lambda: identifier().put(value())
+
+  def compile_subscript_set(self, children):
+    set_subscript = self.visitor.set_subscript
+    identifier, chain, value = self.build_all(children)
+    return lambda: set_subscript(identifier(), chain(), value())
+
+  def compile_subscript_chain(self, children):
+    subscripts = self.build_all(children)
+    return lambda: [s() for s in subscripts]
+
+  def compile_subscript(self, rule, children):
+    if rule == 'identifier_subscript':
+      name = children[0].children[-1].value
+      return lambda: name
+    operand = self.build(children[0])
+    def subscript():
+      ss = operand()
+      if isinstance(ss, Function):
+        error = f'Functions cannot be used as keys or indices. ({ss!r})'
+        raise OperationError(error)
+      return ss
+    return subscript
+
+  def compile_inline_if(self, children):
+    body, condition, orelse = self.build_all(children)
+    return lambda: body() if condition() else orelse()
+
+  def compile_inline_if_binary(self, children):
+    condition, orelse = self.build_all(children)
+    return lambda: condition() or orelse()
+
+  def compile_repetition(self, children, accumulator=list):
+    visitor = self.visitor
+    weight = governor.weight(children[0])
+    body, times_of = self.build_all(children)
+    def repetition():
+      out = accumulator()
+      budget = visitor.budget
+      for time in range(times_of()):
+        budget.spend(weight)
+        out.append(body())
+      return out
+    return repetition
+
+  def compile_odds(self, children):
+    exact = distribution.exact(children[0])
+    if exact is not None:
+      return exact.probabilities
+    visitor = self.visitor
+    weight = governor.weight(children[0])
+    operand = self.build(children[0])
+    def odds():
+      outcomes = [ ]
+      budget = visitor.budget
+      for i in range(distribution.SAMPLES):
+        budget.spend(weight)
+        outcomes.append(operand())
+      return distribution.estimate(outcomes).probabilities()
+    return odds
+
+  def compile_logical_or(self, children):
+    left, right = self.build_all(children)
+    return lambda: left() or right()
+
+  def compile_logical_xor(self, children):
+    left_of, right_of = self.build_all(children)
+    def logical_xor():
+      left, right = left_of(), right_of()
+      return (left or right) and not (left and right)
+    return logical_xor
+
+  def compile_logical_and(self, children):
+    left, right = self.build_all(children)
+    return lambda: left() and right()
+
+  def compile_logical_not(self, children):
+    operand = self.build(children[-1])
+    return lambda: not operand()
+
+  def compile_comp_math(self, children):
+    operations = self.build_all(children)
+    compare = util.chained_comparison
+    return lambda: compare([o() for o in operations])
+
+  compile_comp_obj = compile_comp_math
+
+  def compile_math_comp(self, children):
+    op = children[0].value
+    return lambda: op
+
+  def compile_obj_comp(self, children):
+    op = 'is' if len(children) == 1 else 'is not'
+    return lambda: op
+
+  def compile_present(self, children):
+    element, container = self.build_all(children, analysis.readers['present'])
+    return lambda: element() in container()
+
+  def compile_absent(self, children):
+    element, container = self.build_all(children, analysis.readers['absent'])
+    return lambda: not element() in container()
+
+  def compile_multiplication(self, children):
+    visitor = self.visitor
+    left, right = self.build_all(children)
+    def multiplication():
+      l, r = left(), right()
+      return util.multiplication(l, r, visitor.budget)
+    return multiplication
+
+  def compile_exponent(self, children):
+    visitor = self.visitor
+    mantissa, exponent = self.build_all(children)
+    def power():
+      m, e = mantissa(), exponent()
+      return util.exponent(m, e, visitor.budget)
+    return power
+
+  def compile_dice(self, rule, children):
+    visitor = self.visitor
+    result_type, _, keep_mode = rule.split('_')
+    as_sum = result_type == 'scalar'
+    operations = self.build_all(children[::2])
+    def dice():
+      operands = [o() for o in operations]
+      dice, sides = operands[:2]
+      count = operands[2] if len(operands) > 2 else None
+      return util.roll(
+        dice, sides, count, keep_mode, as_sum, visitor.budget)
+    return dice
+
+  def compile_typeof(self, children):
+    operand = self.build(children[1])
+    return lambda: util.typeof(operand())
+
+  def compile_function_call(self, children):
+    visitor = self.visitor
+    callee, *arguments = self.build_all(children)
+    def function_call():
+      function_or_other = callee()
+      args = [a() for a in arguments]
+      if isinstance(function_or_other, Function):
+        try:
+          out = function_or_other(visitor, *args)
+        except ReturnSignal as rs:
+          out = rs.data
+        except BreakSignal as bs:
+          raise BreakError()
+        except SkipSignal as ss:
+          raise SkipError(ss.msg)
+      elif isinstance(function_or_other, Number):
+        out = tuple([function_or_other * x for x in args])
+        out = out[0] if len(out) == 1 else out
+      else:
+        cls_name = function_or_other.__class__.__name__
+        e = f'Cannot call object of type {cls_name} as '
+        e += 'function nor multiply it as a coefficient.'
+        raise OperationError(e)
+      return out
+    return self.resolve(function_call)
+
+  def compile_getattr(self, children):
+    obj_of = self.build(children[0])
+    name = children[1].children[-1].value
+    def getattr_():
+      obj = obj_of()
+      out = obj[name]
+      if isinstance(out, Function):
+        out.this = obj
+      return out
+    return self.resolve(getattr_)
+
+  def compile_apply(self, children):
+    visitor = self.visitor
+    function_of, iterable_of = self.build_all(children)
+    def apply():
+      function, iterable = function_of(), iterable_of()
+      return [function(visitor, x) for x in iterable]
+    return apply
+
+  def compile_match(self, children):
+    text, pattern = self.build_all(children[0::2])
+    return lambda: util.match(text(), pattern())
+
+  def compile_search(self, children):
+    text, pattern = self.build_all(children[0::2])
+    return lambda: util.search(text(), pattern())
+
+  def compile_plugin_call(self, children):
+    plugin_alias, argument = self.build_all(children)
+    def plugin_call():
+      alias, arg = plugin_alias(), argument()
+      return plugins.lookup(alias)(arg)
+    return plugin_call
+
+  def compile_slice(self, rule, children):
+    operations = self.build_all(children)
+    return lambda: util.make_slice(rule, [o() for o in operations])
+
+  def compile_sliced(self, children):
+    read = analysis.readers['sliced']
+    iterable, key_index_slice = self.build_all(children, read)
+    if analysis.range_literal(children[read]) is not None:
+      return self.resolve(lambda: util.sliced(iterable(), key_index_slice()))
+    return self.resolve(lambda: iterable()[key_index_slice()])
+
+  def compile_printline(self, children, trailer='\n'):
+    visitor = self.visitor
+    operand = self.build(children[1])
+    def print_():
+      value = operand()
+      visitor.print_queue.append(visitor.scoping_data.user, str(value) + trailer)
+      return value
+    return print_
+
+  def compile_printword(self, children):
+    return self.compile_printline(children, trailer=' ')
+
+  def compile_signal(self, children, bare):
+    signal = Compiler.signals[children[0].value]
+    if bare:
+      def raise_bare():
+        raise signal(None)
+      return raise_bare
+    operand = self.build(children[1])
+    def raise_signal():
+      raise signal(operand())
+    return raise_signal
+
+  def compile_constant(self, children):
+    value = children[0].value
+    return lambda: value
+
+  def compile_number_literal(self, children):
+    value = self.visitor.handle_number_literal(children)
+    return lambda: value
+
+  def compile_boolean_literal(self, children):
+    value = self.visitor.handle_boolean_literal(children)
+    return lambda: value
+
+  def compile_string_literal(self, children):
+    value = self.visitor.handle_string_literal(children)
+    return lambda: value
+
+  def compile_undefined_literal(self, children):
+    return lambda: Undefined
+
+  def compile_populated_list(self, children):
+    elements = self.build_all(children)
+    return lambda: [e() for e in elements]
+
+  def compile_empty_list(self, children):
+    return lambda: [ ]
+
+  def compile_range_list(self, children, closed=False, lazy=False):
+    visitor = self.visitor
+    operations = self.build_all(children)
+    make_range = util.lazy_range if lazy else util.range_list
+    def range_list():
+      operands = [o() for o in operations]
+      return make_range(closed, *operands, budget=visitor.budget)
+    return range_list
+
+  compile_range_list_stepped = compile_range_list
+
+  def compile_closed_list(self, children):
+    return self.compile_range_list(children, closed=True)
+
+  compile_closed_list_stepped = compile_closed_list
+
+  def compile_mono_tuple(self, children):
+    elements = self.build_all(children)
+    return lambda: tuple([e() for e in elements])
+
+  compile_multi_tuple = compile_empty_tuple = compile_mono_tuple
+
+  def compile_populated_dict(self, children):
+    pairs = [self.build_all(c.children) for c in children]
+    def populated_dict():
+      out = { }
+      for key, value in pairs:
+        k, v = key(), value()
+        out[k] = v
+      return out
+    return populated_dict
+
+  def compile_empty_dict(self, children):
+    return lambda: { }
+
+  def compile_identifier(self, rule, children):
+    visitor = self.visitor
+    mode, _ = rule.split('_')
+    name = children[-1].value
+    def identifier():
+      return Identifier(
+        name,
+        visitor.scoping_data,
+        mode,
+        visitor.variable_data)
+    return identifier
+
+  def compile_identifier_get(self, children):
+    identifier = self.build(children[0])
+    return self.resolve(lambda: identifier().get())
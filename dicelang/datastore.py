@@ -1,15 +1,22 @@
 import os
-import copy
+import atexit
+import json
+import sys
 import threading
 import time
 from collections.abc import Iterable
 from collections import defaultdict
+from collections import OrderedDict
 
 os.environ['DJANGO_SETTINGS_MODULE'] = 'db_config.settings'
 import django
 django.setup()
 from atropos_db.models import Variable
+from django.db import connection
+from django.db import transaction
+from django.db.models import Q
 from asgiref.sync import sync_to_async
+from lark import Tree
 
 # The following imports are not used by name in this file, but are
 # necessary for enabling `eval` to work correctly. Do not let
@@ -19,93 +26,409 @@ from dicelang.function  import Function
 from dicelang.alias import Alias
 from dicelang.float_special import inf
 from dicelang.float_special import nan
+from dicelang import codec
+from dicelang import eviction
+from dicelang import parsing
+from dicelang.exceptions import CodecError
 
 VAR_MODES = ['private', 'server', 'core', 'global']
 
+# Write-behind: with a flush interval above zero, in milliseconds, puts and
+# drops only change the cache, and a background thread writes the latest
+# value of each changed variable to the database, all in one transaction,
+# once the interval has passed or as soon as `DICELANG_FLUSH_SIZE` variables
+# are waiting. Zero writes every change as it is made.
+FLUSH_INTERVAL = int(os.environ.get('DICELANG_FLUSH_INTERVAL', 0))
+FLUSH_SIZE = int(os.environ.get('DICELANG_FLUSH_SIZE', 500))
+
+# Memory given to cached values, as estimated by `footprint`, and how the
+# cache chooses which values to evict once it is full: "lru", "lfu" or
+# "tinylfu"; see `eviction`.
+CACHE_BYTES = int(os.environ.get('DICELANG_CACHE_BYTES', 256 << 20))
+CACHE_POLICY = os.environ.get('DICELANG_CACHE_POLICY', 'tinylfu')
+
+# The number of variables known not to exist that are remembered, so that
+# looking them up again does not query the database.
+MISS_CACHE_SIZE = int(os.environ.get('DICELANG_MISS_CACHE', 4096))
+
+# Stands for a dropped variable among the changes waiting to be written.
+DROPPED = object()
+
+# Version of the compiled function format kept in `Variable.ast_string`. The
+# trees are only meaningful for the grammar that produced them, so a change
+# to the grammar also makes stored trees stale.
+AST_VERSION = f'1/{parsing.grammar_version("earley")}'
+
+def compile_functions(value, table=None):
+  '''Build a `Function.Precompiled` table for every function reachable from
+  `value`, including functions held in closures and behind aliases.'''
+  table = {} if table is None else table
+  if isinstance(value, Function):
+    key = value.flat_source()
+    if key not in table:
+      table[key] = value.compiled()
+      for scope in value.closed:
+        compile_functions(scope, table)
+  elif isinstance(value, Alias):
+    compile_functions(value.aliased, table)
+  elif isinstance(value, dict):
+    for item in value.values():
+      compile_functions(item, table)
+  elif isinstance(value, (list, tuple)):
+    for item in value:
+      compile_functions(item, table)
+  return table
+
+def dump_compiled(value):
+  '''Serialize the compiled functions in `value`, or return an empty string
+  if there are none.'''
+  table = compile_functions(value)
+  if not table:
+    return ''
+  data = {'version': AST_VERSION, 'functions': table}
+  return json.dumps(data, separators=(',', ':'))
+
+def load_compiled(ast_string):
+  '''Deserialize a table written by `dump_compiled`. A missing or stale table
+  comes back empty, so that functions are rebuilt from their source.'''
+  try:
+    data = json.loads(ast_string)
+  except ValueError:
+    return {}
+  if data.get('version') != AST_VERSION:
+    return {}
+  return data['functions']
+
+def legacy_strings(value):
+  '''The `value_string` and `ast_string` that store `value` in the format
+  used before `codec`, for values it cannot encode.'''
+  with Function.SerializableRepr():
+    value_string = repr(value)
+  return value_string, dump_compiled(value)
+
+def legacy_value(value_string, ast_string=''):
+  '''The value stored by `legacy_strings`.'''
+  with Function.Precompiled(load_compiled(ast_string)):
+    return eval(value_string)
+
+def stored_fields(value):
+  '''The fields of a Variable row that store `value`: encoded by `codec` if
+  it can be, and in the older format if not.'''
+  try:
+    return {'value_data': codec.encode(value), 'value_string': '',
+      'ast_string': ''}
+  except CodecError:
+    value_string, ast_string = legacy_strings(value)
+    return {'value_data': b'', 'value_string': value_string,
+      'ast_string': ast_string}
+
+def footprint(value, seen=None):
+  '''The bytes taken by `value` and everything it holds. Containers and
+  functions whose ids are in `seen` are not counted again, so that storage
+  shared by several values is counted once across calls given one set.'''
+  seen = set() if seen is None else seen
+  total = 0
+  stack = [value]
+  while stack:
+    item = stack.pop()
+    if isinstance(item, (list, tuple, dict, Function, Alias, Tree)):
+      if id(item) in seen:
+        continue
+      seen.add(id(item))
+    total += sys.getsizeof(item)
+    if isinstance(item, dict):
+      stack.extend(item.keys())
+      stack.extend(item.values())
+    elif isinstance(item, (list, tuple)):
+      stack.extend(item)
+    elif isinstance(item, Function):
+      stack.append(item.src)
+      stack.append(item.code)
+      stack.extend(item.closed)
+    elif isinstance(item, Alias):
+      stack.append(item.aliased)
+    elif isinstance(item, Tree):
+      stack.extend(item.children)
+  return total
+
 class Cache(object):
-  def __init__(self, modes=VAR_MODES, prune_below=10):
-    '''Create a new Cache object. `prune_below` is the number of uses
-    which a variable must see to survive a cache cycle. Functions are
-    only required to meet half this value.'''
-    self.vars = {}
-    self.uses = {}
-    self.threshold = prune_below
+  def __init__(self, modes=VAR_MODES, max_bytes=CACHE_BYTES,
+      policy=CACHE_POLICY, pinned=('core',)):
+    '''Create a new Cache object, holding values up to about `max_bytes`, as
+    estimated by `footprint`. Past that, `policy` chooses which to evict:
+    "lru", "lfu" or "tinylfu", described in `eviction`. Variables of the
+    `pinned` modes are never evicted, and are not counted against
+    `max_bytes` -- `core` variables are usually large, often-used, and
+    well-curated, which makes them good candidates for remaining loaded. The
+    cache can be used from several threads at once.'''
+    if policy not in eviction.policies:
+      raise ValueError(f'Unknown cache policy: {policy!r}.')
+    self.max_bytes = max_bytes
+    self.policy_name = policy
+    self.policy = eviction.policies[policy](max_bytes)
+    self.pinned = set(pinned)
+    self.lock = threading.RLock()
+    # Each value with its size, keyed by `(mode, owner_id, key)`.
+    self.entries = {}
+    # The bytes of the values that can be evicted.
+    self.bytes = 0
+    self.counts = {}
     for mode in modes:
-      self.vars[mode] = {}
-      self.uses[mode] = {}
+      self.counts[mode] = {
+        'size': 0, 'bytes': 0, 'hits': 0, 'misses': 0, 'evictions': 0}
   
   def get(self, owner_id, key, mode):
-    try:
-      out = self.vars[mode][owner_id][key]
-      self.uses[mode][owner_id][key] += 1
-    except KeyError:
-      out = None
-    return out
+    entry_key = (mode, owner_id, key)
+    with self.lock:
+      entry = self.entries.get(entry_key)
+      counts = self.counts[mode]
+      if mode not in self.pinned:
+        self.policy.lookup(entry_key)
+      if entry is None:
+        counts['misses'] += 1
+        return None
+      counts['hits'] += 1
+      if mode not in self.pinned:
+        self.policy.hit(entry_key)
+      return entry[0]
+  
+  def contains(self, owner_id, key, mode):
+    '''Whether a variable is cached, without counting a use of it.'''
+    return (mode, owner_id, key) in self.entries
   
-  def put(self, owner_id, key, value, mode):
-    if owner_id not in self.vars[mode]:
-      self.vars[mode][owner_id] = {}
-      self.uses[mode][owner_id] = defaultdict(int)
-    self.vars[mode][owner_id][key] = value
-    self.uses[mode][owner_id][key] += 1
+  def peek(self, owner_id, key, mode):
+    '''The cached value of a variable, or None, without counting a use.'''
+    entry = self.entries.get((mode, owner_id, key))
+    return None if entry is None else entry[0]
+  
+  def put(self, owner_id, key, value, mode, uses=1):
+    '''Cache a value, evicting others as needed to make room. A value too
+    large to be cached at all is not, and replaces nothing.'''
+    entry_key = (mode, owner_id, key)
+    size = footprint(value)
+    pinned = mode in self.pinned
+    with self.lock:
+      if not pinned and size > self.max_bytes:
+        if entry_key in self.entries:
+          self._remove(entry_key)
+        return value
+      old = self.entries.get(entry_key)
+      self.entries[entry_key] = (value, size)
+      counts = self.counts[mode]
+      if old is None:
+        counts['size'] += 1
+        counts['bytes'] += size
+      else:
+        counts['bytes'] += size - old[1]
+      if pinned:
+        return value
+      
+      if old is None:
+        self.policy.add(entry_key, size, uses)
+        self.bytes += size
+      else:
+        self.policy.update(entry_key, size)
+        self.bytes += size - old[1]
+      while self.bytes > self.max_bytes:
+        victim = self.policy.victim()
+        if victim is None:
+          break
+        self._remove(victim)
+        self.counts[victim[0]]['evictions'] += 1
     return value
   
   def drop(self, owner_id, key, mode):
-    if owner_id in self.vars[mode] and key in self.vars[mode][owner_id]:
-      out = copy.copy(self.vars[mode][owner_id][key])
-      self._remove(mode, owner_id, key)
-    else:
-      out = None
-    return out
+    with self.lock:
+      entry = self.entries.get((mode, owner_id, key))
+      if entry is None:
+        return None
+      self._remove((mode, owner_id, key))
+      return entry[0]
   
-  def prune(self):
-    '''Don't prune `core` variables -- they're usually large, often-used, and
-    well-curated, which means they're good candidates for remaining loaded.'''
-    marked = [ ]
-    for mode in filter(lambda s: s != 'core', self.uses):
-      for owner in self.uses[mode]:
-        for key in self.uses[mode][owner]:
-          uses = self.uses[mode][owner][key]
-          is_function = isinstance(self.vars[mode][owner][key], Function)
-          function_sweep =     is_function and uses < self.threshold / 2
-          value_sweep    = not is_function and uses < self.threshold
-          if function_sweep or value_sweep:
-            marked.append((mode, owner, key))
-          else:
-            self.uses[mode][owner][key] = 0
-    
-    objects_pruned = 0
-    for item in marked:
-      objects_pruned += self._remove(*item)
-      print(f'prune {item} from cache')
-    return objects_pruned
+  def _remove(self, entry_key):
+    value, size = self.entries.pop(entry_key)
+    mode = entry_key[0]
+    self.counts[mode]['size'] -= 1
+    self.counts[mode]['bytes'] -= size
+    if mode not in self.pinned:
+      self.policy.remove(entry_key)
+      self.bytes -= size
   
-  def _remove(self, mode, owner, key):
-    del self.vars[mode][owner][key]
-    del self.uses[mode][owner][key]
-    return 1
+  def stats(self):
+    '''The number of cached values and the bytes they take, with the size,
+    resident bytes, hits, misses, hit rate and evictions of each mode under
+    `modes`. Values that share storage, such as an import and the variable
+    it was imported from, are counted once in `bytes`, and `shared_bytes` is
+    what they would take again if each held a copy of its own.'''
+    with self.lock:
+      entries = list(self.entries.values())
+      modes = {mode: dict(counts) for mode, counts in self.counts.items()}
+      evictable = self.bytes
+    for counts in modes.values():
+      lookups = counts['hits'] + counts['misses']
+      counts['hit_rate'] = counts['hits'] / lookups if lookups else 0.0
+    seen = set()
+    held = sum(footprint(value, seen) for value, size in entries)
+    separate = sum(size for value, size in entries)
+    return {
+      'size'            : len(entries),
+      'bytes'           : held,
+      'shared_bytes'    : separate - held,
+      'evictable_bytes' : evictable,
+      'max_bytes'       : self.max_bytes,
+      'policy'          : self.policy_name,
+      'modes'           : modes,
+    }
 
  
+class MissCache(object):
+  '''The `(mode, owner_tag, key)` of variables that were looked up in the
+  database and not found, up to `max_size` of them, forgetting the least
+  recently found first. A variable is forgotten once it is put.'''
+  def __init__(self, max_size=MISS_CACHE_SIZE):
+    self.max_size = max_size
+    self.keys = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+  
+  def __len__(self):
+    return len(self.keys)
+  
+  def __contains__(self, key):
+    return key in self.keys
+  
+  def known(self, key):
+    '''Whether the variable is known not to exist, counting the lookup.'''
+    if key in self.keys:
+      self.hits += 1
+      self.keys.move_to_end(key)
+      return True
+    self.misses += 1
+    return False
+  
+  def add(self, key):
+    if self.max_size <= 0:
+      return
+    self.keys[key] = None
+    self.keys.move_to_end(key)
+    while len(self.keys) > self.max_size:
+      self.keys.popitem(last=False)
+  
+  def discard(self, key):
+    self.keys.pop(key, None)
+  
+  def clear(self):
+    self.keys.clear()
+  
+  def hit_rate(self):
+    lookups = self.hits + self.misses
+    return self.hits / lookups if lookups else 0.0
+  
+  def stats(self):
+    return {
+      'size'     : len(self.keys),
+      'max_size' : self.max_size,
+      'hits'     : self.hits,
+      'misses'   : self.misses,
+      'hit_rate' : self.hit_rate(),
+    }
+
+
+class UnitOfWork(object):
+  '''Within this context, the puts and drops of a DataStore are gathered and
+  written together, in one transaction, when the context exits. If it exits
+  with an exception, or the changes cannot be written, none of them are,
+  and the cache is put back as it was. Contexts entered within it join it.
+  
+  With `discard` set, the changes are never written: the cache is put back
+  when the context exits, however it exits. Such a context is kept apart
+  from any it is within, whose changes it sees but leaves as they were.'''
+  def __init__(self, store, discard=False):
+    self.store = store
+    self.discard = discard
+    self.outermost = False
+  
+  def __enter__(self):
+    store = self.store
+    if self.discard:
+      self.outer = (store.changes, store.replaced)
+      store.changes = dict(store.changes or { })
+      store.replaced = { }
+    elif store.changes is None:
+      self.outermost = True
+      store.changes = { }
+      store.replaced = { }
+    return self
+  
+  def __exit__(self, kind, error, traceback):
+    store = self.store
+    if self.discard:
+      replaced = store.replaced
+      store.changes, store.replaced = self.outer
+      self.undo(replaced)
+      return
+    if not self.outermost:
+      return
+    changes, replaced = store.changes, store.replaced
+    store.changes = store.replaced = None
+    try:
+      if kind is None and changes:
+        store.commit(changes)
+    except Exception:
+      self.undo(replaced)
+      raise
+    if kind is not None:
+      self.undo(replaced)
+  
+  def undo(self, replaced):
+    for (owner_tag, key, mode), value in replaced.items():
+      if value is None:
+        self.store.cache.drop(owner_tag, key, mode)
+      else:
+        self.store.cache.put(owner_tag, key, value, mode, uses=0)
+
+
 class DataStore(object):
-  def __init__(self, cache_time=6*60*60):
-    self.cache = Cache()
-    
-    def pruning_task(cycle_time):
-      '''Automate the cache's pruning.'''
-      while True:
-        time.sleep(cycle_time)
-        pruned = self.cache.prune()
-        print(f'{pruned} objects pruned from cache')
-    
-    self.pruner = threading.Thread(
-      target=pruning_task,
-      args=(cache_time,),
-      daemon=True)
-    self.pruner.start()
-    print('Self-pruning datastore cache created.')
-    print(f'Culling time: {cache_time / 3600} hours.')
+  def __init__(self, cache_bytes=CACHE_BYTES, cache_policy=CACHE_POLICY,
+      flush_interval=FLUSH_INTERVAL, flush_size=FLUSH_SIZE,
+      miss_cache_size=MISS_CACHE_SIZE):
+    '''`cache_bytes` and `cache_policy` configure the Cache of values.
+    `flush_interval` and `flush_size` configure write-behind, as described
+    for FLUSH_INTERVAL. Changes waiting to be written are lost if the process
+    is killed, but are written by `close`, which is called at exit.
+    `miss_cache_size` bounds the MissCache of variables known not to exist.'''
+    self.cache = Cache(max_bytes=cache_bytes, policy=cache_policy)
+    self.absent = MissCache(miss_cache_size)
+    self.flush_interval = flush_interval / 1000
+    self.flush_size = flush_size
+    self.lock = threading.Lock()
+    self.waiting = threading.Condition(self.lock)
+    self.flush_lock = threading.Lock()
+    # Changes not yet written, and those being written, keyed by `(owner_tag,
+    # key, mode)`. Each is the new value, or DROPPED, with the time of the
+    # first change since the variable was last written.
+    self.dirty = { }
+    self.flushing = { }
+    self.closed = False
+    self.flushes = 0
+    self.written = 0
+    self.last_batch = self.max_batch = 0
+    self.last_lag = self.max_lag = 0.0
+    # The changes gathered by the current UnitOfWork, and the cached values
+    # they replaced, or None outside of one.
+    self.changes = None
+    self.replaced = None
+    self.flusher = None
+    if flush_interval > 0:
+      self.flusher = threading.Thread(target=self.flushing_task, daemon=True)
+      self.flusher.start()
+      atexit.register(self.close)
+    print(f'Datastore cache created: {cache_bytes / 2 ** 20:g} MiB, '
+      f'{cache_policy} eviction.')
   
   def view(self, mode, owner_id):
+    if self.flusher is not None:
+      self.flush()
     results = Variable.objects.filter(var_type=mode, owner_id=owner_id)
     names = [ ]
     for result in results:
@@ -118,38 +441,268 @@ class DataStore(object):
     Otherwise, no such variable exists, and we return None.'''
     out = self.cache.get(owner_tag, key, mode)
     if out is None:
+      out = self.unflushed(owner_tag, key, mode)
+      if out is DROPPED:
+        return None
+      if out is not None:
+        return self.cache.put(owner_tag, key, out, mode)
+      if self.absent.known((mode, owner_tag, key)):
+        return None
       try:
         s = Variable.objects.get(owner_id=owner_tag, var_type=mode, name=key)
-        out = eval(s.value_string)
+        out = self.evaluate(s)
         self.cache.put(owner_tag, key, out, mode)
+      except Variable.DoesNotExist:
+        self.absent.add((mode, owner_tag, key))
+        out = None
+      except CodecError:
+        # The variable exists, but what is stored cannot be read.
+        raise
       except Exception as e:
         out = None
     return out
 
+  def prefetch(self, keys):
+    '''Load every variable named by `keys`, a collection of `(owner_tag,
+    key, mode)` triples, that is not already cached, using a single query.
+    Prefetched variables are cached without counting a use, since they may
+    not be read at all. Variables that do not exist are skipped, and known
+    not to exist from then on. Return the number of variables loaded.'''
+    missing = defaultdict(list)
+    requested = { }
+    for owner_tag, key, mode in keys:
+      if (not self.cache.contains(owner_tag, key, mode)
+          and (mode, owner_tag, key) not in self.absent
+          and self.unflushed(owner_tag, key, mode) is None):
+        missing[(mode, owner_tag)].append(key)
+        requested[(mode, owner_tag, key)] = owner_tag
+    if not missing:
+      return 0
+    
+    query = Q()
+    for (mode, owner_tag), names in missing.items():
+      query |= Q(var_type=mode, owner_id=owner_tag, name__in=names)
+    # Anything that cannot be loaded here is left for `get` to report.
+    try:
+      variables = list(Variable.objects.filter(query))
+    except Exception as e:
+      return 0
+    loaded = 0
+    for variable in variables:
+      mode, key = variable.var_type, variable.name
+      owner_tag = requested.pop((mode, variable.owner_id, key), None)
+      if owner_tag is None:
+        continue
+      try:
+        value = self.evaluate(variable)
+      except Exception as e:
+        continue
+      self.cache.put(owner_tag, key, value, mode, uses=0)
+      loaded += 1
+    for absent in requested:
+      self.absent.add(absent)
+    return loaded
+
+  def evaluate(self, variable, upgrade=True):
+    '''Rebuild the value held by a Variable row. A row still in the format
+    from before `codec` is converted and saved when `upgrade` is set.'''
+    if variable.value_data:
+      return codec.decode(variable.value_data)
+    out = legacy_value(variable.value_string, variable.ast_string)
+    if upgrade:
+      fields = stored_fields(out)
+      if fields['value_data']:
+        Variable.objects.filter(pk=variable.pk).update(**fields)
+    return out
+
   def put(self, owner_tag, key, value, mode):
     '''Cache the updated value and create/update an entry in the
     database for the variable. Return the value that we stored, but
     don't ask for it from the DB to avoid long eval times.'''
-    self.cache.put(owner_tag, key, value, mode)
-    with Function.SerializableRepr():
-      mutating = {'value_string': repr(value)}
-    Variable.objects.update_or_create(
-      owner_id=owner_tag,
-      var_type=mode,
-      name=key,
-      defaults=mutating)
+    self.absent.discard((mode, owner_tag, key))
+    if self.changes is None and self.flusher is None:
+      self.cache.put(owner_tag, key, value, mode)
+      self.write(owner_tag, key, value, mode)
+    else:
+      self.defer(owner_tag, key, value, mode)
+      self.cache.put(owner_tag, key, value, mode)
     return value
     
   def drop(self, owner_tag, key, mode):
     '''Retrieve the value from the database, and then drop it
     from the table. Return the value we retrieved.'''
+    if self.changes is None and self.flusher is None:
+      self.cache.drop(owner_tag, key, mode)
+      try:
+        var = Variable.objects.get(owner_id=owner_tag, var_type=mode, name=key)
+        out = self.evaluate(var, upgrade=False)
+        var.delete()
+      except Variable.DoesNotExist:
+        out = None
+      return out
+    
+    # The latest value is the one waiting to be written, if any, and then
+    # the cached one, which is never older than the one in the database.
+    out = self.unflushed(owner_tag, key, mode)
+    if out is DROPPED:
+      return None
+    if out is None:
+      out = self.cache.peek(owner_tag, key, mode)
+    if out is None:
+      try:
+        var = Variable.objects.get(owner_id=owner_tag, var_type=mode, name=key)
+        out = self.evaluate(var, upgrade=False)
+      except Variable.DoesNotExist:
+        return None
+    self.defer(owner_tag, key, DROPPED, mode)
     self.cache.drop(owner_tag, key, mode)
-    try:
-      var = Variable.objects.get(owner_id=owner_tag, var_type=mode, name=key)
-      out = eval(var.value_string)
-      var.delete()
-    except Variable.DoesNotExist:
-      out = None
     return out
+  
+  def unit_of_work(self, discard=False):
+    '''A context in which changes are written together, or with `discard`
+    set, not at all; see UnitOfWork.'''
+    return UnitOfWork(self, discard)
+  
+  def write(self, owner_tag, key, value, mode):
+    '''Create or update the database entry for a variable.'''
+    Variable.objects.update_or_create(
+      owner_id=owner_tag,
+      var_type=mode,
+      name=key,
+      defaults=stored_fields(value))
+  
+  def unflushed(self, owner_tag, key, mode):
+    '''The value of a variable that was changed but not yet written, DROPPED
+    if it was dropped, or None if it has no change waiting.'''
+    if self.changes:
+      out = self.changes.get((owner_tag, key, mode))
+      if out is not None:
+        return out
+    if not (self.dirty or self.flushing):
+      return None
+    with self.lock:
+      entry = self.dirty.get((owner_tag, key, mode))
+      if entry is None:
+        entry = self.flushing.get((owner_tag, key, mode))
+    return None if entry is None else entry[0]
+  
+  def defer(self, owner_tag, key, value, mode):
+    '''Gather a change into the current unit of work, remembering the cached
+    value it replaces, or leave it to the flusher outside of one. Call
+    before changing the cache.'''
+    if self.changes is None:
+      self.mark(owner_tag, key, value, mode)
+      return
+    if (owner_tag, key, mode) not in self.replaced:
+      self.replaced[(owner_tag, key, mode)] = self.cache.peek(
+        owner_tag, key, mode)
+    self.changes[(owner_tag, key, mode)] = value
+  
+  def commit(self, changes):
+    '''Write `changes`, a dict of new values or DROPPED keyed by `(owner_tag,
+    key, mode)`, or leave them to the flusher.'''
+    if self.flusher is None:
+      self.write_batch(changes)
+    else:
+      for (owner_tag, key, mode), value in changes.items():
+        self.mark(owner_tag, key, value, mode)
+  
+  def write_batch(self, changes):
+    '''Write `changes`, as given to `commit`, in one transaction.'''
+    dropped = Q()
+    with transaction.atomic():
+      for (owner_tag, key, mode), value in changes.items():
+        if value is DROPPED:
+          dropped |= Q(owner_id=owner_tag, var_type=mode, name=key)
+        else:
+          self.write(owner_tag, key, value, mode)
+      if dropped:
+        Variable.objects.filter(dropped).delete()
+  
+  def mark(self, owner_tag, key, value, mode):
+    '''Record a change to be written by the flusher, waking it if enough
+    changes are waiting.'''
+    with self.lock:
+      entry = self.dirty.pop((owner_tag, key, mode), None)
+      since = time.monotonic() if entry is None else entry[1]
+      self.dirty[(owner_tag, key, mode)] = (value, since)
+      if len(self.dirty) >= self.flush_size:
+        self.waiting.notify()
+  
+  def flush(self):
+    '''Write every change waiting, in one transaction. If it fails, the
+    changes are kept to be tried again. Return the number of variables
+    written.'''
+    with self.flush_lock:
+      with self.lock:
+        batch, self.dirty = self.dirty, { }
+        self.flushing = batch
+      if not batch:
+        return 0
+      try:
+        self.write_batch({k: value for k, (value, since) in batch.items()})
+      except Exception:
+        with self.lock:
+          # Changes made while writing are newer than those in the batch.
+          batch.update(self.dirty)
+          self.dirty = batch
+          self.flushing = { }
+        raise
+      
+      lag = time.monotonic() - min(since for value, since in batch.values())
+      with self.lock:
+        self.flushing = { }
+        self.flushes += 1
+        self.written += len(batch)
+        self.last_batch = len(batch)
+        self.max_batch = max(self.max_batch, len(batch))
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+      return len(batch)
+  
+  def flushing_task(self):
+    '''Flush whenever `flush_interval` has passed or `flush_size` changes
+    are waiting, until the store is closed.'''
+    while True:
+      with self.lock:
+        if not self.closed and len(self.dirty) < self.flush_size:
+          self.waiting.wait(self.flush_interval)
+        closed = self.closed
+      try:
+        self.flush()
+      except Exception as e:
+        print(f'Failed to write cached variables: {e}')
+      if closed:
+        break
+    connection.close()
+  
+  def close(self):
+    '''Stop the flusher and write every change still waiting, after which
+    changes are written as they are made. Call once nothing else is using
+    the store.'''
+    if self.flusher is None:
+      return
+    with self.lock:
+      self.closed = True
+      self.waiting.notify()
+    self.flusher.join()
+    self.flusher = None
+    self.flush()
+  
+  def flush_stats(self):
+    '''Write-behind metrics: changes waiting, flushes done and variables
+    written by them, the size of the last and the largest batch, and the
+    lag, in seconds, from a change to the flush that wrote it, for the last
+    batch and the worst one.'''
+    with self.lock:
+      return {
+        'pending'    : len(self.dirty) + len(self.flushing),
+        'flushes'    : self.flushes,
+        'written'    : self.written,
+        'last_batch' : self.last_batch,
+        'max_batch'  : self.max_batch,
+        'last_lag'   : self.last_lag,
+        'max_lag'    : self.max_lag,
+      }
 
 
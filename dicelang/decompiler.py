@@ -227,6 +227,8 @@ class Decompiler(object):
       out = f'!>{self.decompile(tree.children[0])}'
     elif tree.data == 'stats':
       out = f'?{self.decompile(tree.children[0])}'
+    elif tree.data == 'odds':
+      out = f'?%{self.decompile(tree.children[0])}'
     elif tree.data == 'sort':
       out = f'<>{self.decompile(tree.children[0])}'
     elif tree.data == 'shuffle':
@@ -331,6 +333,8 @@ class Decompiler(object):
     
     elif tree.data == 'atom':
       out = self.decompile(tree.children[0])
+    elif tree.data == 'constant':
+      out = self.decompile(tree.children[1])
     elif tree.data == 'number_literal':
       out = tree.children[-1].value
     elif tree.data == 'string_literal':
@@ -0,0 +1,277 @@
+'''Probability distributions of the outcomes of dicelang expressions.
+
+`exact` computes the distribution of an expression analytically when it is
+built only from constants, dice and pure operations, using the semantics of
+`util.roll`: sums of dice by convolution, and kept dice by counting the ways
+each face can be rolled. Anything else -- variables, function calls, plugins,
+or a computation too large to finish quickly -- is left to `estimate`, which
+tallies the outcomes of evaluating the expression many times.
+
+Weights are kept as exact integers over a common total, so that an exact
+distribution is exact; they are only turned into floats for display.'''
+
+import math
+import itertools
+
+from collections import Counter
+
+from lark import Tree
+
+from dicelang import optimizer
+from dicelang import parsing
+from dicelang import sumtables
+from dicelang import util
+from dicelang.undefined import Undefined
+from dicelang.exceptions import OperationError
+
+# How many times an expression is evaluated when its distribution has to be
+# estimated.
+SAMPLES = 10000
+
+# A bound on the work done computing one exact distribution, counted in
+# combinations of outcomes considered. Larger problems are estimated.
+BUDGET = 2000000
+
+class NotAnalytic(Exception):
+  '''Raised while analyzing a tree that has no exact distribution, or whose
+  distribution would take too long to compute.'''
+  pass
+
+
+class Distribution(object):
+  '''The outcomes of an expression, each with an integer weight out of
+  `total`. `samples` is the number of evaluations an estimated distribution
+  was tallied from, and None for an exact one.'''
+
+  def __init__(self, weights, total, samples=None):
+    self.weights = weights
+    self.total = total
+    self.samples = samples
+
+  @classmethod
+  def point(cls, value):
+    return cls({value: 1}, 1)
+
+  @property
+  def exact(self):
+    return self.samples is None
+
+  def reduced(self):
+    '''The same distribution with its weights in lowest terms.'''
+    divisor = math.gcd(self.total, *self.weights.values())
+    if divisor > 1:
+      self.weights = {k: w // divisor for k, w in self.weights.items()}
+      self.total //= divisor
+    return self
+
+  def outcomes(self):
+    '''Outcomes in ascending order when they can be ordered, and otherwise
+    from most to least likely.'''
+    try:
+      return sorted(self.weights)
+    except TypeError:
+      return sorted(self.weights, key=self.weights.get, reverse=True)
+
+  def probabilities(self):
+    '''A dict from each outcome to its probability.'''
+    return {k: self.weights[k] / self.total for k in self.outcomes()}
+
+  def mean(self):
+    try:
+      return sum(k * w for k, w in self.weights.items()) / self.total
+    except TypeError:
+      return None
+
+  def summary(self):
+    if self.exact:
+      out = 'Exact odds'
+    else:
+      out = f'Odds estimated from {self.samples} samples'
+    mean = self.mean()
+    if isinstance(mean, (int, float)) and not isinstance(mean, bool):
+      out += f', mean {mean:.4g}'
+    return out
+
+  def table(self, width=30):
+    '''A text table of outcomes, their probabilities and a bar chart.'''
+    probabilities = self.probabilities()
+    labels = {k: repr(k) for k in probabilities}
+    label_width = max(len(label) for label in labels.values())
+    highest = max(probabilities.values())
+    lines = [ ]
+    for outcome, p in probabilities.items():
+      bar = '#' * round(width * p / highest)
+      lines.append(f'{labels[outcome]:>{label_width}} {p:8.3%} {bar}')
+    return '\n'.join(lines)
+
+
+def combine(operation, distributions):
+  '''The distribution of `operation` applied to one outcome of each of a
+  number of independent `distributions`.'''
+  size = math.prod(len(d.weights) for d in distributions)
+  if size > BUDGET:
+    raise NotAnalytic()
+  weights = Counter()
+  for pairs in itertools.product(*[d.weights.items() for d in distributions]):
+    values = [value for value, weight in pairs]
+    try:
+      outcome = operation(values)
+      hash(outcome)
+    except Exception:
+      raise NotAnalytic()
+    weights[outcome] += math.prod(weight for value, weight in pairs)
+  total = math.prod(d.total for d in distributions)
+  return Distribution(dict(weights), total).reduced()
+
+def mixture(parameters, inner):
+  '''The distribution of an outcome of `inner(value)`, where `value` is an
+  outcome of the distribution `parameters`.'''
+  parts = [(weight, inner(value)) for value, weight in parameters.weights.items()]
+  common = math.lcm(*[part.total for weight, part in parts])
+  weights = Counter()
+  for weight, part in parts:
+    scale = weight * (common // part.total)
+    for outcome, w in part.weights.items():
+      weights[outcome] += w * scale
+  return Distribution(dict(weights), parameters.total * common).reduced()
+
+def kept(dice, count, mode):
+  '''How many dice `util.roll` keeps, given the slicing it applies to the
+  sorted pool.'''
+  if mode == 'all':
+    return dice
+  if count is not None and not isinstance(count, int):
+    raise NotAnalytic()
+  return len(range(dice)[:count])
+
+def sum_of_dice(dice, sides):
+  '''Ways of rolling each total on `dice` dice, by repeated convolution with
+  a single die.'''
+  if dice * dice * sides > BUDGET:
+    raise NotAnalytic()
+  ways = [1]
+  for die in range(dice):
+    ways = sumtables.add_die(ways, sides)
+  return {total + dice: w for total, w in enumerate(ways) if w}
+
+def sum_of_kept(dice, sides, keep, mode):
+  '''Ways of rolling each total of the `keep` highest or lowest of `dice`
+  dice. Faces are visited from the best to the worst, deciding how many dice
+  show each face. Once `keep` dice have been placed, the rest can show any
+  worse face, and the sum is settled.'''
+  faces = range(sides, 0, -1) if mode == 'highest' else range(1, sides + 1)
+  worse = (lambda face: face - 1) if mode == 'highest' else (lambda face: sides - face)
+  states = {(0, 0): 1}
+  ways = Counter()
+  work = 0
+  for face in faces:
+    after = { }
+    for (placed, total), w in states.items():
+      unplaced = dice - placed
+      work += unplaced + 1
+      if work > BUDGET:
+        raise NotAnalytic()
+      for here in range(unplaced + 1):
+        n = w * math.comb(unplaced, here)
+        now_placed = placed + here
+        now_total = total + face * min(here, max(keep - placed, 0))
+        if now_placed >= keep:
+          ways[now_total] += n * worse(face) ** (dice - now_placed)
+        else:
+          key = (now_placed, now_total)
+          after[key] = after.get(key, 0) + n
+    states = after
+  return {total: w for total, w in ways.items() if w}
+
+def dice_distribution(dice, sides, count, mode):
+  '''The distribution of the sum `util.roll` gives for a scalar roll.'''
+  if type(dice) is not int or type(sides) is not int:
+    raise NotAnalytic()
+  if dice <= 0:
+    return Distribution.point(0)
+  if sides < 1:
+    raise NotAnalytic()
+  keep = kept(dice, count, mode)
+  if keep == 0:
+    return Distribution.point(0)
+  if keep >= dice:
+    ways = sum_of_dice(dice, sides)
+  else:
+    ways = sum_of_kept(dice, sides, keep, mode)
+  return Distribution(ways, sides ** dice).reduced()
+
+def dice_rule(tree):
+  '''The dice rule reached from `tree` through rules that only pass their
+  child along, if any.'''
+  while tree.data in optimizer.passthrough and len(tree.children) == 1:
+    tree = tree.children[0]
+  return tree if 'die_' in tree.data else None
+
+def analyze(tree):
+  '''The exact distribution of the value of `tree`, or raise NotAnalytic.'''
+  rule = tree.data
+  children = [c for c in tree.children if isinstance(c, Tree)]
+
+  if rule == 'constant':
+    out = Distribution.point(tree.children[0].value)
+  elif rule in optimizer.literals:
+    out = Distribution.point(getattr(util, rule)(tree.children[-1].value))
+  elif rule == 'undefined_literal':
+    out = Distribution.point(Undefined)
+  elif rule == 'math_comp':
+    out = Distribution.point(tree.children[0].value)
+  elif rule == 'start' or rule in optimizer.passthrough:
+    if len(children) != 1:
+      raise NotAnalytic()
+    out = analyze(children[0])
+  elif rule.startswith('scalar_die') or rule == 'sum_or_join' and (
+      dice_rule(children[0]) is not None):
+    # Summing a vector roll gives the same distribution as a scalar roll.
+    die = tree if rule != 'sum_or_join' else dice_rule(children[0])
+    mode = die.data.split('_')[-1]
+    operands = [c for c in die.children[::2]]
+    parameters = combine(tuple, [analyze(c) for c in operands])
+    def roll(values):
+      dice, sides = values[:2]
+      count = values[2] if len(values) > 2 else None
+      return dice_distribution(dice, sides, count, mode)
+    out = mixture(parameters, roll)
+  elif rule in optimizer.foldable:
+    def operation(values):
+      if not optimizer.affordable(rule, values):
+        raise NotAnalytic()
+      return optimizer.evaluate(rule, values)
+    out = combine(operation, [analyze(c) for c in children])
+  else:
+    raise NotAnalytic()
+  return out
+
+# Exact distributions, or None where there is none, for trees already seen.
+analyzed = parsing.TreeMemo()
+
+def exact(tree):
+  '''The exact distribution of the value of `tree`, or None if it has to be
+  estimated.'''
+  entry = analyzed.get(tree)
+  if entry is None:
+    try:
+      out = analyze(tree)
+    except (NotAnalytic, RecursionError):
+      out = None
+    entry = analyzed.put(tree, (out,))
+  return entry[0]
+
+def freeze(value):
+  '''A hashable stand-in for a sampled value, so that lists can be tallied.'''
+  if isinstance(value, list):
+    return tuple(freeze(v) for v in value)
+  try:
+    hash(value)
+  except TypeError:
+    raise OperationError(f'Cannot tally the outcome {value!r}.')
+  return value
+
+def estimate(samples):
+  '''The distribution observed in a list of sampled values.'''
+  weights = Counter(freeze(value) for value in samples)
+  return Distribution(dict(weights), len(samples), samples=len(samples))
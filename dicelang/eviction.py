@@ -0,0 +1,227 @@
+'''Eviction policies for the cache of variables in `datastore`.
+
+A policy tracks the keys of the cached entries it may evict, and chooses
+which to evict while the cache is over its budget of bytes. The cache tells
+it of every lookup, whether or not it found an entry, and of each entry
+added, read, replaced and removed. `victim` names the next entry to evict,
+which the cache then removes.'''
+
+from collections import OrderedDict
+
+
+class LRU(object):
+  '''Evicts the least recently used entry.'''
+
+  def __init__(self, max_bytes):
+    self.entries = OrderedDict()
+
+  def __len__(self):
+    return len(self.entries)
+
+  def lookup(self, key):
+    pass
+
+  def add(self, key, size, uses=1):
+    self.entries[key] = size
+
+  def hit(self, key):
+    self.entries.move_to_end(key)
+
+  def update(self, key, size):
+    self.entries[key] = size
+    self.entries.move_to_end(key)
+
+  def remove(self, key):
+    del self.entries[key]
+
+  def victim(self):
+    return next(iter(self.entries), None)
+
+
+class LFU(object):
+  '''Evicts the least frequently used entry, and of those, the one that has
+  gone longest at that frequency. Uses are counted from when the entry was
+  added, so an entry evicted and loaded again starts over.'''
+
+  def __init__(self, max_bytes):
+    self.counts = { }
+    # The keys with each count, in the order they reached it.
+    self.buckets = { }
+    self.newest = None
+
+  def __len__(self):
+    return len(self.counts)
+
+  def lookup(self, key):
+    pass
+
+  def add(self, key, size, uses=1):
+    self.counts[key] = uses
+    self.buckets.setdefault(uses, OrderedDict())[key] = None
+    self.newest = key
+
+  def hit(self, key):
+    count = self.counts[key]
+    self.unlink(key, count)
+    self.counts[key] = count + 1
+    self.buckets.setdefault(count + 1, OrderedDict())[key] = None
+
+  def update(self, key, size):
+    self.hit(key)
+
+  def unlink(self, key, count):
+    bucket = self.buckets[count]
+    del bucket[key]
+    if not bucket:
+      del self.buckets[count]
+
+  def remove(self, key):
+    self.unlink(key, self.counts.pop(key))
+
+  def victim(self):
+    # The entry just added has had no chance to be used yet, so it is only
+    # evicted if there is nothing else.
+    for count in sorted(self.buckets):
+      for key in self.buckets[count]:
+        if key != self.newest or len(self.counts) == 1:
+          return key
+    return None
+
+
+class CountMinSketch(object):
+  '''Estimates how often each key has been seen, in fixed memory. Each key
+  counts in one counter of each row, chosen by hashing it, and its estimate
+  is the least of those counters. Counters stop at 15, and all of them are
+  halved once `sample` keys have been counted, so that the estimates follow
+  what has been wanted recently.'''
+
+  MAX_COUNT = 15
+  # Odd multipliers that choose each row's counter from the key's hash.
+  SEEDS = [0x9e3779b97f4a7c15, 0xc2b2ae3d27d4eb4f, 0x165667b19e3779f9,
+    0xd6e8feb86659fd93]
+  MASK = (1 << 64) - 1
+
+  def __init__(self, width=1 << 12, sample=None):
+    '''`width`, the number of counters in each row, is rounded up to a
+    power of two.'''
+    self.width = 1 << max(width - 1, 1).bit_length()
+    self.shift = 65 - self.width.bit_length()
+    self.rows = [bytearray(self.width) for seed in self.SEEDS]
+    self.sample = sample if sample is not None else 10 * self.width
+    self.counted = 0
+
+  def indexes(self, key):
+    h = hash(key) & self.MASK
+    return [(h * seed & self.MASK) >> self.shift for seed in self.SEEDS]
+
+  def add(self, key):
+    for row, i in zip(self.rows, self.indexes(key)):
+      if row[i] < self.MAX_COUNT:
+        row[i] += 1
+    self.counted += 1
+    if self.counted >= self.sample:
+      self.rows = [bytearray(count >> 1 for count in row) for row in self.rows]
+      self.counted //= 2
+
+  def estimate(self, key):
+    return min(row[i] for row, i in zip(self.rows, self.indexes(key)))
+
+
+class Segment(OrderedDict):
+  '''Keys with their sizes, least recently used first, and their total.'''
+
+  def __init__(self):
+    super().__init__()
+    self.used = 0
+
+
+class TinyLFU(object):
+  '''W-TinyLFU. New entries enter a small LRU window, of `window` of the
+  bytes. An entry pushed out of the window joins the main space if there is
+  room. If there is not, it is admitted only if the sketch estimates that it
+  is wanted more often than the entry it would replace, the least recently
+  used entry on probation. Entries read again while on probation are
+  promoted to the protected segment, of `protected` of the main space, from
+  which the least recently used are demoted back to probation. A burst of
+  entries used once therefore passes through the window without evicting
+  the entries that are used again and again.'''
+
+  def __init__(self, max_bytes, window=0.01, protected=0.8, sketch=None):
+    self.window_limit = max(int(max_bytes * window), 1)
+    self.main_limit = max_bytes - self.window_limit
+    self.protected_limit = int(self.main_limit * protected)
+    self.sketch = sketch if sketch is not None else CountMinSketch()
+    self.window = Segment()
+    self.probation = Segment()
+    self.protected = Segment()
+
+  def __len__(self):
+    return len(self.window) + len(self.probation) + len(self.protected)
+
+  def segment(self, key):
+    for segment in (self.window, self.probation, self.protected):
+      if key in segment:
+        return segment
+    raise KeyError(key)
+
+  def move(self, key, source, target):
+    size = source.pop(key)
+    source.used -= size
+    target[key] = size
+    target.used += size
+
+  def lookup(self, key):
+    self.sketch.add(key)
+
+  def add(self, key, size, uses=1):
+    self.window[key] = size
+    self.window.used += size
+
+  def hit(self, key):
+    if key in self.probation:
+      self.move(key, self.probation, self.protected)
+      while (self.protected.used > self.protected_limit
+          and len(self.protected) > 1):
+        self.move(next(iter(self.protected)), self.protected, self.probation)
+    else:
+      self.segment(key).move_to_end(key)
+
+  def update(self, key, size):
+    segment = self.segment(key)
+    segment.used += size - segment[key]
+    segment[key] = size
+    self.hit(key)
+
+  def remove(self, key):
+    segment = self.segment(key)
+    segment.used -= segment.pop(key)
+
+  def victim(self):
+    main = self.probation.used + self.protected.used
+    while self.window.used > self.window_limit:
+      candidate, size = next(iter(self.window.items()))
+      if main + size <= self.main_limit:
+        self.move(candidate, self.window, self.probation)
+        main += size
+        continue
+      victim = next(iter(self.probation), None)
+      if victim is None:
+        victim = next(iter(self.protected), None)
+      if victim is None:
+        return candidate
+      if self.sketch.estimate(candidate) > self.sketch.estimate(victim):
+        self.move(candidate, self.window, self.probation)
+        return victim
+      return candidate
+    for segment in (self.probation, self.protected, self.window):
+      if segment:
+        return next(iter(segment))
+    return None
+
+
+# The policy class for each name a cache can be configured with.
+policies = {
+  'lru'     : LRU,
+  'lfu'     : LFU,
+  'tinylfu' : TinyLFU,
+}
@@ -9,6 +9,12 @@ class ExecutionTimeout(DicelangError):
 class LoopTimeout(ExecutionTimeout):
   pass
 
+class BudgetExceeded(ExecutionTimeout):
+  pass
+
+class ResultTooLarge(BudgetExceeded):
+  pass
+
 while_loop_msg = '\n'.join([
   '\nwhile loop iterated %s times without terminating,',
   "or your loop's condition never changed state. You may",
@@ -27,10 +33,12 @@ class DoWhileLoopTimeout(LoopTimeout):
     self.msg = do_while_loop_msg % n
 
 class ExponentiationTimeout(ExecutionTimeout):
-  pass
+  def __init__(self, msg='Base or exponent too large in magnitude!'):
+    super().__init__(msg)
 
 class DiceRollTimeout(ExecutionTimeout):
-  pass
+  def __init__(self, msg='Took too long rolling dice!'):
+    super().__init__(msg)
 
 class FunctionError(DicelangError):
   pass
@@ -44,6 +52,9 @@ class DefinitionError(FunctionError):
 class CallError(FunctionError):
   pass
 
+class CallDepthError(FunctionError):
+  pass
+
 class OperationError(DicelangError):
   pass
 
@@ -53,6 +64,9 @@ class StorageError(DicelangError):
 class PrivilegeError(StorageError):
   pass
 
+class CodecError(StorageError):
+  pass
+
 class BuiltinError(DicelangError):
   pass
 
@@ -1,12 +1,12 @@
 import copy
-import lark
 from dicelang import decompiler
-from dicelang import grammar
+from dicelang import optimizer
+from dicelang import parsing
 from dicelang.undefined import Undefined
 from dicelang.exceptions import DefinitionError, CallError
 
 class Function(object):
-  parser = lark.Lark(grammar.raw_text, start='function', parser='earley')
+  parser = parsing.Parser(start='function')
   deparser = decompiler.Decompiler()
   
   class SerializableRepr:
@@ -17,9 +17,32 @@ class Function(object):
     def __exit__(self, *args):
       Function.__repr__ = Function.repl_repr
   
+  # Compiled forms of functions keyed by flattened source text, made
+  # available while deserializing stored values. See `Precompiled`.
+  precompiled = {}
+  
+  class Precompiled:
+    '''Within this context, a Function built from source text found in
+    `table` takes its parameters, code and source from the table entry
+    rather than parsing and decompiling the text again.'''
+    def __init__(self, table):
+      self.table = table
+    def __enter__(self):
+      Function.precompiled = self.table
+    def __exit__(self, *args):
+      Function.precompiled = {}
+  
   def __init__(self, tree_or_src, param_names=None, closed_vars=None):
-    if param_names is None:
-      tree = self.parse(tree_or_src)
+    compiled = None
+    if param_names is None and isinstance(tree_or_src, str):
+      compiled = Function.precompiled.get(tree_or_src)
+    
+    if compiled is not None:
+      self.code = optimizer.fold(parsing.decode_tree(compiled['code']))
+      self.params = compiled['params']
+      self.src = compiled['src']
+    elif param_names is None:
+      tree = optimizer.fold(self.parse(tree_or_src))
       self.code = tree.children[-1]
       self.params = tree.children[0:-1]
       self.src = self.decompile(tree)
@@ -34,6 +57,19 @@ class Function(object):
     self.closed = closed_vars if closed_vars else [{}]
     self.this = Undefined
   
+  @classmethod
+  def restored(cls, code, params, src, closed_vars=None):
+    '''A function rebuilt from the parts of one that was stored, without
+    parsing or decompiling anything.'''
+    self = cls.__new__(cls)
+    self.code = code
+    self.params = params
+    self.src = src
+    self.visitor = None
+    self.closed = closed_vars if closed_vars else [{}]
+    self.this = Undefined
+    return self
+  
   def __deepcopy__(self, memodict={}):
     '''Override __deepcopy__ to prevent bugs when function objects are moved
     or deleted by users.'''
@@ -68,10 +104,21 @@ class Function(object):
     '''The representation shown to users of the language.'''
     return f'{self.src}'
   
+  def flat_source(self):
+    '''Function source with newlines replaced, for single-line storage.'''
+    return self.src.replace('\n', '\f')
+  
   def serializable_repr(self):
     '''The representation used for serializing function objects.'''
-    flat_source = self.src.replace('\n', '\f')
-    return f'Function({flat_source!r}, closed_vars={self.closed!r})'
+    return f'Function({self.flat_source()!r}, closed_vars={self.closed!r})'
+  
+  def compiled(self):
+    '''The entry for this function in a `Precompiled` table.'''
+    return {
+      'params' : self.params[:],
+      'code'   : parsing.encode_tree(self.code),
+      'src'    : self.src,
+    }
     
   __repr__ = repl_repr
   
@@ -0,0 +1,174 @@
+'''Accounting for the work done executing a command.
+
+Each command is given a Budget of units of work, and a deadline. The
+execution engines charge it for what they do: one unit for each node of the
+syntax tree evaluated, and more for the operations whose cost grows with
+their operands -- rolling dice, multiplying large integers and building
+long lists -- weighted by the functions below. The clock is only read once
+every `CHECK_EVERY` units, rather than before every node, and the time it
+gives is kept for loops to compare their own deadlines against.
+
+The walker charges each node as it visits it. The compiled engines charge
+the weight of a tree, its number of nodes, once when they enter it and again
+for every iteration of a loop in it, which comes to about the same.
+
+Some results are too large to be worth building at all. The size of an
+integer power, shift or product, and the length of a repeated list, are
+known from the operands, so `limit_bits` and `limit_length` refuse them
+before any work is done, rather than after the budget runs out.'''
+
+import math
+import os
+import time
+
+from lark import Tree
+
+from dicelang.exceptions import BudgetExceeded
+from dicelang.exceptions import ExecutionTimeout
+from dicelang.exceptions import ResultTooLarge
+
+# Units spent between reads of the clock.
+CHECK_EVERY = 1024
+
+def parse_units(text):
+  '''The budget of units given by `text`, an integer, or None for no limit
+  when it is empty, `none` or `0`.'''
+  text = text.strip()
+  if text.lower() in ('', 'none'):
+    return None
+  return int(text) or None
+
+# Units a command may spend, unless given a budget of its own. None leaves
+# only the deadline, and is given by a `DICELANG_BUDGET` of `none` or `0`.
+UNITS = parse_units(os.environ.get('DICELANG_BUDGET', str(10 ** 9)))
+
+# Elements of a list that are built for one unit.
+ELEMENTS_PER_UNIT = 16
+
+# Products of machine words that are multiplied for one unit, allowing for
+# Karatsuba multiplication of large integers.
+WORD_BITS = 64
+WORD_PRODUCTS_PER_UNIT = 64
+KARATSUBA = math.log2(3) - 1
+
+# The largest integer, in bits, and the longest list or string, that an
+# operation may build.
+MAX_BITS = int(os.environ.get('DICELANG_MAX_BITS', 1 << 20))
+MAX_LENGTH = int(os.environ.get('DICELANG_MAX_LENGTH', 1 << 24))
+
+def dice(count):
+  '''Units charged for rolling `count` dice.'''
+  return max(count, 0)
+
+def elements(count):
+  '''Units charged, beyond the instruction itself, for building a sequence
+  of `count` elements.'''
+  return max(count, 0) // ELEMENTS_PER_UNIT
+
+def product(left, right):
+  '''Units charged, beyond the instruction itself, for multiplying the
+  integers `left` and `right`. Products of small integers cost nothing
+  more.'''
+  a = left.bit_length() // WORD_BITS + 1
+  b = right.bit_length() // WORD_BITS + 1
+  if a * b < WORD_PRODUCTS_PER_UNIT:
+    return 0
+  small, large = min(a, b), max(a, b)
+  return int(large * small ** KARATSUBA) // WORD_PRODUCTS_PER_UNIT
+
+def power_bits(mantissa, exponent):
+  '''The number of bits in the integer `mantissa ** exponent`, give or take
+  one, for a positive `exponent`.'''
+  magnitude = abs(mantissa)
+  if magnitude <= 1:
+    return 1
+  if exponent > MAX_BITS:
+    return exponent
+  return math.ceil(exponent * math.log2(magnitude))
+
+def limit_bits(bits, operation):
+  '''Refuse to build an integer of `bits` bits if it is too large.'''
+  if bits > MAX_BITS:
+    e = f'{operation} would build an integer of about {bits} bits, and at '
+    e += f'most {MAX_BITS} are allowed.'
+    raise ResultTooLarge(e)
+
+def limit_length(length, operation):
+  '''Refuse to build a sequence of `length` elements if it is too long.'''
+  if length > MAX_LENGTH:
+    e = f'{operation} would build a sequence of {length} elements, and at '
+    e += f'most {MAX_LENGTH} are allowed.'
+    raise ResultTooLarge(e)
+
+def weight(tree):
+  '''The number of nodes in `tree`, each a unit for the walker to visit. A
+  folded constant is a single node.'''
+  out = 0
+  stack = [tree]
+  while stack:
+    node = stack.pop()
+    out += 1
+    if node.data != 'constant':
+      stack.extend(c for c in node.children if isinstance(c, Tree))
+  return out
+
+
+class Budget(object):
+  '''`units` of work, or None for no limit, to be spent within `seconds`.
+  `used` is the number of units spent so far, and `now` the time at which
+  the clock was last read.'''
+
+  def __init__(self, units=None, seconds=math.inf, check_every=CHECK_EVERY):
+    self.units = units
+    self.used = 0
+    self.check_every = check_every
+    self.next_check = self.after(0)
+    self.now = time.time()
+    self.must_finish_by = self.now + seconds
+    self.checks = 0
+
+  def spend(self, units=1, timeout=None):
+    '''Charge `units`, checking the budget and the clock if enough have been
+    spent since they were last checked.'''
+    self.used += units
+    if self.used >= self.next_check:
+      self.check(timeout)
+
+  def check(self, timeout=None):
+    '''Read the clock and raise if the budget or the time has run out. When
+    time has run out, `timeout` makes the exception to raise, if given.'''
+    self.checks += 1
+    self.next_check = self.after(self.used)
+    if self.units is not None and self.used > self.units:
+      e = f'Dicelang command used more than its budget of {self.units} '
+      e += 'units of work. You may have chained too many dice together, '
+      e += 'constructed an extremely large number, or just tried to do '
+      e += 'too much at once.'
+      raise BudgetExceeded(e)
+    self.now = time.time()
+    if self.now > self.must_finish_by:
+      if timeout is not None:
+        raise timeout()
+      e = 'Dicelang command took too long! You may have chained '
+      e += 'too many dice together, constructed an extremely large '
+      e += 'number, or just tried to do too much at once.'
+      raise ExecutionTimeout(e)
+
+  def after(self, used):
+    '''When to check next: after `check_every` more units, or as soon as the
+    budget is exceeded, whichever comes first.'''
+    out = used + self.check_every
+    if self.units is not None:
+      out = min(out, self.units + 1)
+    return out
+
+  def remaining(self):
+    return None if self.units is None else max(self.units - self.used, 0)
+
+  def stats(self):
+    return {
+      'units'     : self.units,
+      'used'      : self.used,
+      'remaining' : self.remaining(),
+      'checks'    : self.checks,
+    }
@@ -1,17 +1,32 @@
 #!/usr/bin/env python3
-from lark import Lark
+from dicelang import analysis
 from dicelang import visitor
-from dicelang import grammar
+from dicelang import parsing
+from dicelang import optimizer
 from dicelang import datastore
+from dicelang import governor
 from dicelang import ownership
 from dicelang import builtin
 
 class Interpreter(object):
   GLOBAL_ID = -1
-  def __init__(self):
-    self.parser = Lark(grammar.raw_text, start='start', parser='earley')
+  def __init__(self, parser=None, parse_cache_size=1024, engine=None,
+      units=governor.UNITS):
+    '''`parser` selects the parsing algorithm: "earley" for the original
+    grammar, or "lalr" for the faster, deterministic parallel grammar. It
+    defaults to the `DICELANG_PARSER` environment variable, or "earley".
+    `parse_cache_size` bounds how many parsed commands are kept for reuse;
+    zero disables the cache. Parsed commands have their constant subtrees
+    folded before they are cached. `engine` selects how parsed commands are
+    run, and `units` the budget of work each command is given, as described
+    for the Visitor.'''
+    self.parser = parsing.Parser(parser)
+    self.parse_cache = parsing.ParseCache(
+      self.parser, parse_cache_size, optimizer.fold)
     self.datastore = datastore.DataStore()
-    self.visitor = visitor.Visitor(self.datastore)
+    self.visitor = visitor.Visitor(self.datastore, engine=engine, units=units)
+    self.budget = None
+    self.stored_names = parsing.TreeMemo()
   
   def keys(self, mode, owner_id=GLOBAL_ID):
     return self.datastore.view(mode, owner_id)
@@ -19,16 +34,53 @@ class Interpreter(object):
   def builtin_keys(self):
     return list(builtin.variables.keys())
   
-  def execute(self, command, user, server):
+  def execute(self, command, user, server, budget=None):
     '''Passes the abstract syntax tree generated by the parser to the
     interpreter kernel with the user's name and the server's name for
-    variable retrieval and emplacement.'''
-    tree = self.parser.parse(command)
+    variable retrieval and emplacement.
+    
+    The command is charged to `budget`, a `governor.Budget`, or to a new
+    budget of the default size. Either way, the budget it was charged to is
+    left in `self.budget` afterwards, whether or not it succeeded, and its
+    `used` attribute gives the units of work it consumed.
+    
+    The variables the command puts and drops, and `_`, are written together
+    when it finishes. If it fails, none of them are changed.'''
+    tree = self.parse_cache.parse(command)
+    self.prefetch(tree, user, server)
     scoping_data = ownership.ScopingData(user, server) 
-    value, printout = self.visitor.walk(tree, scoping_data, True)
-    self.put_last(user, server, value)
+    with self.datastore.unit_of_work():
+      try:
+        value, printout = self.visitor.walk(tree, scoping_data, True, budget)
+      finally:
+        self.budget = self.visitor.budget
+      self.put_last(user, server, value)
     return (value, printout)
   
+  def odds(self, command, user, server):
+    '''The distribution of the outcomes of a command, exact where possible
+    and otherwise estimated by running it many times. The outcome is not
+    stored in `_`.'''
+    tree = self.parse_cache.parse(command)
+    self.prefetch(tree, user, server)
+    scoping_data = ownership.ScopingData(user, server)
+    return self.visitor.odds(tree, scoping_data)
+  
+  def prefetch(self, tree, user, server):
+    '''Load every stored variable that the command could read, and that is
+    not already cached, in one query rather than one query per variable.'''
+    names = self.stored_names.get(tree)
+    if names is None:
+      names = self.stored_names.put(tree, analysis.stored_names(tree))
+    owners = {
+      'private' : user,
+      'server'  : server,
+      'global'  : Interpreter.GLOBAL_ID,
+      'core'    : Interpreter.GLOBAL_ID,
+    }
+    keys = [(owners[mode], name, mode) for mode, name in names]
+    return self.datastore.prefetch(keys)
+  
   def put_last(self, user, server, value):
     '''Store most-recently acquired value in the special `_` variable for each
     kind of storage.'''
@@ -0,0 +1,857 @@
+import operator
+import time
+
+from numbers import Number
+
+from dicelang import analysis
+from dicelang import distribution
+from dicelang import governor
+from dicelang import parsing
+from dicelang import plugins
+from dicelang import reductions
+from dicelang import util
+
+from dicelang.compiler import Compiler
+
+from dicelang.exceptions import BreakError
+from dicelang.exceptions import CallError
+from dicelang.exceptions import CallDepthError
+from dicelang.exceptions import DoWhileLoopTimeout
+from dicelang.exceptions import OperationError
+from dicelang.exceptions import ReturnError
+from dicelang.exceptions import SkipError
+from dicelang.exceptions import WhileLoopTimeout
+
+from dicelang.function import Function
+from dicelang.alias import Alias
+from dicelang.undefined import Undefined
+
+from dicelang.identifier import Identifier
+
+# Opcodes. Every instruction is a tuple whose first element is one of these,
+# followed by its operands: register numbers, jump targets, or constants
+# bound when the instruction was assembled.
+CONST         =  0 # dest, value
+MOVE          =  1 # dest, source
+OP1           =  2 # dest, function, a
+OP2           =  3 # dest, function, a, b
+OPN           =  4 # dest, function, [sources]
+LIST          =  5 # dest, [sources]
+TUPLE         =  6 # dest, [sources]
+DICT          =  7 # dest, [(key, value)]
+JUMP          =  8 # target
+JUMP_IF_FALSE =  9 # source, target
+JUMP_IF_TRUE  = 10 # source, target
+IDENT         = 11 # dest, name, mode
+GET           = 12 # dest, name, mode
+RESOLVE       = 13 # register
+PUSH_SCOPE    = 14 #
+POP_SCOPE     = 15 #
+SET_LOCAL     = 16 # name, source
+FOR_INIT      = 17 # dest, source, target
+FOR_NEXT      = 18 # dest, iterator, target, weight
+APPEND        = 19 # list, source
+APPEND_SET    = 20 # list, source
+LOOP_INIT     = 21 # dest
+LOOP_CHECK    = 22 # deadline, results, exception, weight
+CALL          = 23 # dest, callee, [sources]
+APPLY_CALL    = 24 # dest, callee, source
+FUNCTION      = 25 # dest, code, params, names
+PRINT         = 26 # source, trailer
+RETURN        = 27 # source
+RAISE         = 28 # exception
+END           = 29 # source
+
+names = {value: name for name, value in globals().items()
+         if name.isupper() and isinstance(value, int)}
+
+
+class Label(object):
+  '''A jump target whose position is filled in once it is placed.'''
+  def __init__(self):
+    self.position = None
+
+
+class LoopContext(object):
+  '''Where `break` and `skip` jump to inside a loop, and the register of the
+  list that collects the loop's results.'''
+  def __init__(self, results, exit, next):
+    self.results = results
+    self.exit = exit
+    self.next = next
+
+
+class Code(object):
+  '''An assembled sequence of instructions, the number of registers a frame
+  executing it needs, and the units charged for entering it.'''
+  def __init__(self, instructions, size, weight):
+    self.instructions = instructions
+    self.size = size
+    self.weight = weight
+
+  def disassemble(self):
+    lines = [ ]
+    for i, instruction in enumerate(self.instructions):
+      operands = ', '.join(repr(x) for x in instruction[1:])
+      lines.append(f'{i:>4} {names[instruction[0]]:<14} {operands}')
+    return '\n'.join(lines)
+
+
+class Assembler(object):
+  '''Translates a syntax tree into register-machine instructions. Control
+  flow that the Visitor implements with exceptions is resolved here into
+  jumps: `break` and `skip` jump to the innermost loop of the same function,
+  and `return` ends the function's frame. Where the Visitor would report one
+  of those signals as illegal, the instruction raises the same error.'''
+
+  def __init__(self, visitor, in_function):
+    self.visitor = visitor
+    self.in_function = in_function
+    self.instructions = [ ]
+    self.size = 0
+
+  def assemble(self, tree):
+    loop = None
+    if self.in_function:
+      self.emit(RETURN, self.expression(tree, loop))
+    else:
+      out = None
+      for statement in tree.children:
+        out = self.expression(statement, loop)
+      self.emit(END, out)
+
+    instructions = [ ]
+    for instruction in self.instructions:
+      instructions.append(tuple(
+        x.position if isinstance(x, Label) else x for x in instruction))
+    return Code(instructions, self.size, governor.weight(tree))
+
+  def register(self):
+    self.size += 1
+    return self.size - 1
+
+  def emit(self, *instruction):
+    self.instructions.append(instruction)
+
+  def place(self, label):
+    label.position = len(self.instructions)
+
+  def expression(self, tree, loop):
+    '''Emit the instructions evaluating `tree` and return the register that
+    holds its value afterwards. `loop` is the innermost enclosing loop, or
+    None outside any loop.'''
+    while tree.data in Compiler.passthrough:
+      tree = tree.children[0]
+    rule = tree.data
+    children = tree.children
+
+    if rule in analysis.reductions and analysis.reduced_loop(children[0]):
+      return self.reduction(rule, analysis.reduced_loop(children[0]), loop)
+    if rule in Compiler.strict:
+      function = Compiler.strict[rule]
+      sources = self.operands(children, loop, analysis.readers.get(rule))
+      dest = self.register()
+      if len(sources) == 1:
+        self.emit(OP1, dest, function, sources[0])
+      else:
+        self.emit(OP2, dest, function, *sources)
+      return dest
+    if rule in Compiler.identifiers:
+      dest = self.register()
+      mode, _ = rule.split('_')
+      self.emit(IDENT, dest, children[-1].value, mode)
+      return dest
+    if rule.endswith('_subscript'):
+      return self.subscript(rule, children, loop)
+    if 'vector_die' in rule or 'scalar_die' in rule:
+      return self.dice(rule, children, loop)
+    if rule.endswith('_slice'):
+      sources = [self.expression(c, loop) for c in children]
+      dest = self.register()
+      make_slice = lambda *args: util.make_slice(rule, list(args))
+      self.emit(OPN, dest, make_slice, sources)
+      return dest
+    if rule in ('break_expr', 'skip_expr', 'return_expr'):
+      return self.signal(children, loop, bare=False)
+    if rule in ('break_bare', 'skip_bare', 'return_bare'):
+      return self.signal(children, loop, bare=True)
+
+    method = getattr(self, rule, None)
+    if method is None:
+      dest = self.register()
+      self.emit(CONST, dest, f'__UNIMPLEMENTED__: {rule}')
+      return dest
+    return method(children, loop)
+
+  def operands(self, children, loop, read=None):
+    '''Emit the instructions evaluating each of `children`, and return their
+    registers. The child at index `read`, if any, is an operand that is only
+    read, so a range literal there makes a lazy `range` instead of a list.'''
+    return [self.read(c, loop) if i == read else self.expression(c, loop)
+      for i, c in enumerate(children)]
+
+  def read(self, tree, loop):
+    node = analysis.range_literal(tree)
+    if node is None:
+      return self.expression(tree, loop)
+    closed = analysis.ranges[node.data]
+    return self.range_list(node.children, loop, closed, lazy=True)
+
+  def call(self, function, sources, resolve=False):
+    '''Emit an instruction applying a Python function to registers.'''
+    dest = self.register()
+    if len(sources) == 1:
+      self.emit(OP1, dest, function, *sources)
+    elif len(sources) == 2:
+      self.emit(OP2, dest, function, *sources)
+    else:
+      self.emit(OPN, dest, function, sources)
+    if resolve:
+      self.emit(RESOLVE, dest)
+    return dest
+
+  def block(self, children, loop):
+    self.emit(PUSH_SCOPE)
+    for child in children:
+      out = self.expression(child, loop)
+    self.emit(POP_SCOPE)
+    return out
+
+  short_body = block
+
+  def function(self, children, loop):
+    dest = self.register()
+    params = [c.value for c in children[:-1]]
+    names = analysis.free_names(children[-1], params)
+    self.emit(FUNCTION, dest, children[-1], params, names)
+    return dest
+
+  def alias(self, children, loop):
+    sources = [self.expression(c, loop) for c in children]
+    return self.call(self.visitor.make_alias, sources)
+
+  def inspection(self, children, loop):
+    def inspect(identifier):
+      obj = identifier.get()
+      return obj.aliased if isinstance(obj, Alias) else obj
+    return self.call(inspect, [self.expression(children[1], loop)])
+
+  def collect(self, results, accumulator):
+    '''Emit the instruction starting the results of a loop in the register
+    `results`: a list, or else an instance of `accumulator`.'''
+    if accumulator is None:
+      self.emit(LIST, results, [])
+    else:
+      self.emit(OPN, results, accumulator, [])
+
+  def reduction(self, rule, reduced, loop):
+    '''Emit a reduction of the loop or repetition `reduced`, whose results
+    are accumulated as they are produced instead of being collected in a
+    list first.'''
+    accumulator = reductions.accumulators[rule]
+    if reduced.data == 'for_loop':
+      results = self.for_loop(reduced.children, loop, accumulator)
+    else:
+      results = self.repetition(reduced.children, loop, accumulator)
+    return self.call(lambda results: results.value(), [results])
+
+  def for_loop(self, children, loop, accumulator=None):
+    identifier = children[0]
+    while identifier.data in Compiler.passthrough:
+      identifier = identifier.children[0]
+    name = identifier.children[-1].value
+
+    iterable = self.read(children[1], loop)
+    results, iterator = self.register(), self.register()
+    element = self.register()
+    inner = LoopContext(results, Label(), Label())
+    done = Label()
+    self.collect(results, accumulator)
+    self.emit(FOR_INIT, iterator, iterable, done)
+    self.emit(PUSH_SCOPE)
+    self.place(inner.next)
+    weight = governor.weight(children[2])
+    self.emit(FOR_NEXT, element, iterator, inner.exit, weight)
+    self.emit(SET_LOCAL, name, element)
+    self.emit(APPEND, results, self.expression(children[2], inner))
+    self.emit(JUMP, inner.next)
+    self.place(inner.exit)
+    self.emit(POP_SCOPE)
+    self.place(done)
+    return results
+
+  def while_loop(self, children, loop):
+    results, deadline = self.register(), self.register()
+    inner = LoopContext(results, Label(), Label())
+    self.emit(PUSH_SCOPE)
+    self.emit(LIST, results, [])
+    self.emit(LOOP_INIT, deadline)
+    self.place(inner.next)
+    condition = self.expression(children[0], loop)
+    self.emit(JUMP_IF_FALSE, condition, inner.exit)
+    weight = sum(governor.weight(c) for c in children)
+    self.emit(LOOP_CHECK, deadline, results, WhileLoopTimeout, weight)
+    self.emit(APPEND, results, self.expression(children[1], inner))
+    self.emit(JUMP, inner.next)
+    self.place(inner.exit)
+    self.emit(POP_SCOPE)
+    return results
+
+  def do_while_loop(self, children, loop):
+    # The first iteration runs before the Visitor starts catching signals,
+    # so a `break` or `skip` there belongs to the enclosing loop. The body
+    # is assembled twice to give each iteration the right target.
+    results, deadline = self.register(), self.register()
+    inner = LoopContext(results, Label(), Label())
+    self.emit(PUSH_SCOPE)
+    self.emit(LIST, results, [self.expression(children[0], loop)])
+    self.emit(LOOP_INIT, deadline)
+    self.place(inner.next)
+    condition = self.expression(children[1], loop)
+    self.emit(JUMP_IF_FALSE, condition, inner.exit)
+    weight = sum(governor.weight(c) for c in children)
+    self.emit(LOOP_CHECK, deadline, results, DoWhileLoopTimeout, weight)
+    self.emit(APPEND, results, self.expression(children[0], inner))
+    self.emit(JUMP, inner.next)
+    self.place(inner.exit)
+    self.emit(POP_SCOPE)
+    return results
+
+  def if_(self, children, loop):
+    dest = self.register()
+    orelse, end = Label(), Label()
+    self.emit(PUSH_SCOPE)
+    self.emit(JUMP_IF_FALSE, self.expression(children[0], loop), orelse)
+    self.emit(MOVE, dest, self.expression(children[1], loop))
+    self.emit(JUMP, end)
+    self.place(orelse)
+    if len(children) > 2:
+      self.emit(MOVE, dest, self.expression(children[2], loop))
+    else:
+      self.emit(CONST, dest, Undefined)
+    self.place(end)
+    self.emit(POP_SCOPE)
+    return dest
+
+  if_else = if_
+
+  def standard_import(self, children, loop):
+    return self.call(self.visitor.standard_import,
+      [self.expression(children[1], loop)])
+
+  def standard_getattr_import(self, children, loop):
+    sources = [self.expression(c, loop) for c in children[1:]]
+    import_ = self.visitor.standard_getattr_import
+    return self.call(lambda *operands: import_(list(operands)), sources)
+
+  def as_import(self, children, loop):
+    sources = [self.expression(c, loop) for c in children[1:]]
+    return self.call(self.visitor.as_import, sources)
+
+  def as_getattr_import(self, children, loop):
+    sources = [self.expression(c, loop) for c in children[1:]]
+    import_ = self.visitor.as_getattr_import
+    return self.call(lambda *operands: import_(list(operands)), sources)
+
+  def deletion(self, children, loop):
+    sources = [self.expression(c, loop) for c in children]
+    if len(sources) == 1:
+      return sources[0]
+    dest = self.register()
+    self.emit(TUPLE, dest, sources)
+    return dest
+
+  def identifier_deletable(self, children, loop):
+    source = self.expression(children[0], loop)
+    return self.call(lambda identifier: identifier.drop(), [source], True)
+
+  def subscript_deletable(self, children, loop):
+    sources = [self.expression(c, loop) for c in children]
+    return self.call(self.visitor.delete_subscript, sources, True)
+
+  def identifier_set(self, children, loop):
+    sources = [self.expression(c, loop) for c in children]
+    return self.call(lambda identifier, value: identifier.put(value), sources)
+
+  def subscript_set(self, children, loop):
+    sources = [self.expression(c, loop) for c in children]
+    return self.call(self.visitor.set_subscript, sources)
+
+  def subscript_chain(self, children, loop):
+    dest = self.register()
+    self.emit(LIST, dest, [self.expression(c, loop) for c in children])
+    return dest
+
+  def subscript(self, rule, children, loop):
+    if rule == 'identifier_subscript':
+      dest = self.register()
+      self.emit(CONST, dest, children[0].children[-1].value)
+      return dest
+    def key(ss):
+      if isinstance(ss, Function):
+        error = f'Functions cannot be used as keys or indices. ({ss!r})'
+        raise OperationError(error)
+      return ss
+    return self.call(key, [self.expression(children[0], loop)])
+
+  def inline_if(self, children, loop):
+    dest = self.register()
+    orelse, end = Label(), Label()
+    self.emit(JUMP_IF_FALSE, self.expression(children[1], loop), orelse)
+    self.emit(MOVE, dest, self.expression(children[0], loop))
+    self.emit(JUMP, end)
+    self.place(orelse)
+    self.emit(MOVE, dest, self.expression(children[2], loop))
+    self.place(end)
+    return dest
+
+  def inline_if_binary(self, children, loop):
+    return self.logical_or(children, loop)
+
+  def repetition(self, children, loop, accumulator=None):
+    times = self.expression(children[1], loop)
+    return self.repeat(children[0], times, loop, accumulator)
+
+  def repeat(self, body, times, loop, accumulator=None):
+    '''Emit a loop collecting the values of `body` evaluated the number of
+    times held in the register `times`, in a list or an instance of
+    `accumulator`.'''
+    results, iterator, element = [self.register() for i in range(3)]
+    next_, exit = Label(), Label()
+    self.collect(results, accumulator)
+    self.emit(OP1, iterator, lambda n: iter(range(n)), times)
+    self.place(next_)
+    self.emit(FOR_NEXT, element, iterator, exit, governor.weight(body))
+    self.emit(APPEND, results, self.expression(body, loop))
+    self.emit(JUMP, next_)
+    self.place(exit)
+    return results
+
+  def odds(self, children, loop):
+    exact = distribution.exact(children[0])
+    if exact is not None:
+      return self.call(exact.probabilities, [])
+    samples = self.load_constant(distribution.SAMPLES)
+    outcomes = self.repeat(children[0], samples, loop)
+    tally = lambda values: distribution.estimate(values).probabilities()
+    return self.call(tally, [outcomes])
+
+  def logical_or(self, children, loop, jump=JUMP_IF_TRUE):
+    dest = self.register()
+    end = Label()
+    self.emit(MOVE, dest, self.expression(children[0], loop))
+    self.emit(jump, dest, end)
+    self.emit(MOVE, dest, self.expression(children[1], loop))
+    self.place(end)
+    return dest
+
+  def logical_and(self, children, loop):
+    return self.logical_or(children, loop, jump=JUMP_IF_FALSE)
+
+  def logical_xor(self, children, loop):
+    xor = lambda left, right: (left or right) and not (left and right)
+    return self.call(xor, [self.expression(c, loop) for c in children])
+
+  def logical_not(self, children, loop):
+    return self.call(operator.not_, [self.expression(children[-1], loop)])
+
+  def comp_math(self, children, loop):
+    sources = [self.expression(c, loop) for c in children]
+    dest = self.register()
+    compare = lambda *operands: util.chained_comparison(operands)
+    self.emit(OPN, dest, compare, sources)
+    return dest
+
+  comp_obj = comp_math
+
+  def math_comp(self, children, loop):
+    dest = self.register()
+    self.emit(CONST, dest, children[0].value)
+    return dest
+
+  def obj_comp(self, children, loop):
+    dest = self.register()
+    self.emit(CONST, dest, 'is' if len(children) == 1 else 'is not')
+    return dest
+
+  def present(self, children, loop):
+    sources = self.operands(children, loop, analysis.readers['present'])
+    return self.call(lambda element, container: element in container, sources)
+
+  def absent(self, children, loop):
+    sources = self.operands(children, loop, analysis.readers['absent'])
+    return self.call(lambda element, container: element not in container,
+      sources)
+
+  def multiplication(self, children, loop):
+    visitor = self.visitor
+    sources = [self.expression(c, loop) for c in children]
+    product = lambda l, r: util.multiplication(l, r, visitor.budget)
+    return self.call(product, sources)
+
+  def exponent(self, children, loop):
+    visitor = self.visitor
+    sources = [self.expression(c, loop) for c in children]
+    power = lambda m, e: util.exponent(m, e, visitor.budget)
+    return self.call(power, sources)
+
+  def dice(self, rule, children, loop):
+    visitor = self.visitor
+    result_type, _, keep_mode = rule.split('_')
+    as_sum = result_type == 'scalar'
+    def roll(dice, sides, count=None):
+      return util.roll(
+        dice, sides, count, keep_mode, as_sum, visitor.budget)
+    sources = [self.expression(c, loop) for c in children[::2]]
+    dest = self.register()
+    self.emit(OPN, dest, roll, sources)
+    return dest
+
+  def typeof(self, children, loop):
+    return self.call(util.typeof, [self.expression(children[1], loop)])
+
+  def function_call(self, children, loop):
+    sources = [self.expression(c, loop) for c in children]
+    dest = self.register()
+    self.emit(CALL, dest, sources[0], sources[1:])
+    self.emit(RESOLVE, dest)
+    return dest
+
+  def getattr(self, children, loop):
+    name = children[1].children[-1].value
+    def getattr_(obj):
+      out = obj[name]
+      if isinstance(out, Function):
+        out.this = obj
+      return out
+    return self.call(getattr_, [self.expression(children[0], loop)], True)
+
+  def apply(self, children, loop):
+    function, iterable = [self.expression(c, loop) for c in children]
+    results, iterator, element, value = [self.register() for i in range(4)]
+    next_, exit = Label(), Label()
+    self.emit(LIST, results, [])
+    self.emit(OP1, iterator, iter, iterable)
+    self.place(next_)
+    self.emit(FOR_NEXT, element, iterator, exit, 1)
+    self.emit(APPLY_CALL, value, function, element)
+    self.emit(APPEND, results, value)
+    self.emit(JUMP, next_)
+    self.place(exit)
+    return results
+
+  def match(self, children, loop):
+    sources = [self.expression(c, loop) for c in children[0::2]]
+    return self.call(util.match, sources)
+
+  def search(self, children, loop):
+    sources = [self.expression(c, loop) for c in children[0::2]]
+    return self.call(util.search, sources)
+
+  def plugin_call(self, children, loop):
+    sources = [self.expression(c, loop) for c in children]
+    return self.call(lambda alias, arg: plugins.lookup(alias)(arg), sources)
+
+  def sliced(self, children, loop):
+    read = analysis.readers['sliced']
+    sources = self.operands(children, loop, read)
+    if analysis.range_literal(children[read]) is not None:
+      return self.call(util.sliced, sources, True)
+    return self.call(operator.getitem, sources, True)
+
+  def printline(self, children, loop, trailer='\n'):
+    source = self.expression(children[1], loop)
+    self.emit(PRINT, source, trailer)
+    return source
+
+  def printword(self, children, loop):
+    return self.printline(children, loop, trailer=' ')
+
+  def signal(self, children, loop, bare):
+    kind = children[0].value
+    dest = None if bare else self.expression(children[1], loop)
+    if kind == 'return':
+      if not self.in_function:
+        self.emit(RAISE, ReturnError)
+      elif bare:
+        dest = self.register()
+        self.emit(CONST, dest, Undefined)
+        self.emit(RETURN, dest)
+      else:
+        unset = lambda data: Undefined if data is None else data
+        self.emit(RETURN, self.call(unset, [dest]))
+    elif loop is None:
+      self.emit(RAISE, BreakError if kind == 'break' else SkipError)
+    else:
+      if not bare:
+        self.emit(APPEND_SET, loop.results, dest)
+      self.emit(JUMP, loop.exit if kind == 'break' else loop.next)
+    # Control never reaches past the jump; the register only gives the
+    # signal a value like every other expression.
+    return self.register() if dest is None else dest
+
+  def load_constant(self, value):
+    dest = self.register()
+    self.emit(CONST, dest, value)
+    return dest
+
+  def constant(self, children, loop):
+    return self.load_constant(children[0].value)
+
+  def number_literal(self, children, loop):
+    return self.load_constant(self.visitor.handle_number_literal(children))
+
+  def boolean_literal(self, children, loop):
+    return self.load_constant(self.visitor.handle_boolean_literal(children))
+
+  def string_literal(self, children, loop):
+    return self.load_constant(self.visitor.handle_string_literal(children))
+
+  def undefined_literal(self, children, loop):
+    return self.load_constant(Undefined)
+
+  def populated_list(self, children, loop):
+    dest = self.register()
+    self.emit(LIST, dest, [self.expression(c, loop) for c in children])
+    return dest
+
+  empty_list = populated_list
+
+  def range_list(self, children, loop, closed=False, lazy=False):
+    visitor = self.visitor
+    sources = [self.expression(c, loop) for c in children]
+    dest = self.register()
+    build = util.lazy_range if lazy else util.range_list
+    make_range = lambda *args: build(closed, *args, budget=visitor.budget)
+    self.emit(OPN, dest, make_range, sources)
+    return dest
+
+  range_list_stepped = range_list
+
+  def closed_list(self, children, loop):
+    return self.range_list(children, loop, closed=True)
+
+  closed_list_stepped = closed_list
+
+  def mono_tuple(self, children, loop):
+    dest = self.register()
+    self.emit(TUPLE, dest, [self.expression(c, loop) for c in children])
+    return dest
+
+  multi_tuple = empty_tuple = mono_tuple
+
+  def populated_dict(self, children, loop):
+    pairs = [ ]
+    for pair in children:
+      pairs.append(tuple(self.expression(c, loop) for c in pair.children))
+    dest = self.register()
+    self.emit(DICT, dest, pairs)
+    return dest
+
+  empty_dict = populated_dict
+
+  def identifier_get(self, children, loop):
+    identifier = children[0]
+    while identifier.data in Compiler.passthrough:
+      identifier = identifier.children[0]
+    mode, _ = identifier.data.split('_')
+    dest = self.register()
+    self.emit(GET, dest, identifier.children[-1].value, mode)
+    self.emit(RESOLVE, dest)
+    return dest
+
+# The grammar's rule names for conditionals are Python keywords.
+setattr(Assembler, 'if', Assembler.if_)
+
+
+class Machine(object):
+  '''Executes assembled code without recursing in Python. A call to a
+  dicelang function pushes a frame onto the machine's own stack and its
+  `return` pops it, so the depth of recursion in a dicelang program is
+  limited by `max_call_depth` rather than by the Python interpreter.
+
+  Code is charged to the budget as a frame enters it, and the body of a
+  loop at each iteration.'''
+
+  max_call_depth = 10000
+
+  def __init__(self, visitor):
+    self.visitor = visitor
+    self.assembled = parsing.TreeMemo()
+
+  def assemble(self, tree, in_function):
+    '''Return the code for `tree`, assembling it on first use. A tree run as
+    a function body treats `return` differently from a whole command, so the
+    two are kept apart.'''
+    code = self.assembled.get(tree, in_function)
+    if code is None:
+      assembler = Assembler(self.visitor, in_function)
+      code = self.assembled.put(tree, assembler.assemble(tree), in_function)
+    return code
+
+  def run(self, code):
+    visitor = self.visitor
+    budget = visitor.budget
+    budget.spend(code.weight)
+    frames = [ ]
+    instructions = code.instructions
+    regs = [None] * code.size
+    pc = 0
+
+    while True:
+      instruction = instructions[pc]
+      pc += 1
+      op = instruction[0]
+
+      if op == OP2:
+        _, dest, function, a, b = instruction
+        regs[dest] = function(regs[a], regs[b])
+      elif op == CONST:
+        regs[instruction[1]] = instruction[2]
+      elif op == GET:
+        _, dest, name, mode = instruction
+        identifier = Identifier(
+          name, visitor.scoping_data, mode, visitor.variable_data)
+        regs[dest] = identifier.get()
+      elif op == RESOLVE:
+        value = regs[instruction[1]]
+        if isinstance(value, Alias):
+          call = (value.aliased, (), instruction[1])
+        else:
+          continue
+      elif op == MOVE:
+        regs[instruction[1]] = regs[instruction[2]]
+      elif op == OP1:
+        _, dest, function, a = instruction
+        regs[dest] = function(regs[a])
+      elif op == JUMP:
+        pc = instruction[1]
+        continue
+      elif op == JUMP_IF_FALSE:
+        if not regs[instruction[1]]:
+          pc = instruction[2]
+        continue
+      elif op == JUMP_IF_TRUE:
+        if regs[instruction[1]]:
+          pc = instruction[2]
+        continue
+      elif op == FOR_NEXT:
+        budget.spend(instruction[4])
+        try:
+          regs[instruction[1]] = next(regs[instruction[2]])
+        except StopIteration:
+          pc = instruction[3]
+        continue
+      elif op == APPEND:
+        regs[instruction[1]].append(regs[instruction[2]])
+      elif op == IDENT:
+        _, dest, name, mode = instruction
+        regs[dest] = Identifier(
+          name, visitor.scoping_data, mode, visitor.variable_data)
+      elif op == OPN:
+        _, dest, function, sources = instruction
+        regs[dest] = function(*[regs[s] for s in sources])
+      elif op == LIST:
+        regs[instruction[1]] = [regs[s] for s in instruction[2]]
+      elif op == TUPLE:
+        regs[instruction[1]] = tuple([regs[s] for s in instruction[2]])
+      elif op == DICT:
+        out = { }
+        for k, v in instruction[2]:
+          out[regs[k]] = regs[v]
+        regs[instruction[1]] = out
+      elif op == PUSH_SCOPE:
+        visitor.scoping_data.push_scope()
+      elif op == POP_SCOPE:
+        visitor.scoping_data.pop_scope()
+      elif op == SET_LOCAL:
+        visitor.scoping_data.get_scope()[instruction[1]] = regs[instruction[2]]
+      elif op == FOR_INIT:
+        _, dest, source, target = instruction
+        iterable = regs[source]
+        if isinstance(iterable, dict):
+          iterable = list(iterable.keys())
+        start = iterable[0] if len(iterable) else None
+        if start is None:
+          pc = target
+        else:
+          regs[dest] = iter(iterable)
+      elif op == APPEND_SET:
+        value = regs[instruction[2]]
+        if value is not None:
+          regs[instruction[1]].append(value)
+      elif op == LOOP_INIT:
+        regs[instruction[1]] = time.time() + visitor.loop_timeout
+      elif op == LOOP_CHECK:
+        _, deadline, results, exception, weight = instruction
+        budget.spend(weight)
+        if budget.now > regs[deadline]:
+          raise exception(len(regs[results]))
+      elif op == CALL:
+        _, dest, callee, sources = instruction
+        function_or_other = regs[callee]
+        args = [regs[s] for s in sources]
+        if isinstance(function_or_other, Function):
+          call = (function_or_other, args, dest)
+        elif isinstance(function_or_other, Number):
+          out = tuple([function_or_other * x for x in args])
+          regs[dest] = out[0] if len(out) == 1 else out
+          continue
+        else:
+          cls_name = function_or_other.__class__.__name__
+          e = f'Cannot call object of type {cls_name} as '
+          e += 'function nor multiply it as a coefficient.'
+          raise OperationError(e)
+      elif op == APPLY_CALL:
+        _, dest, callee, source = instruction
+        function = regs[callee]
+        if isinstance(function, Function):
+          call = (function, [regs[source]], dest)
+        else:
+          regs[dest] = function(visitor, regs[source])
+          continue
+      elif op == FUNCTION:
+        _, dest, tree, params, names = instruction
+        closed = visitor.scoping_data.calling_environment(names)
+        function = Function(tree, param_names=params, closed_vars=closed)
+        function.visitor = visitor
+        regs[dest] = function
+      elif op == PRINT:
+        value = regs[instruction[1]]
+        visitor.print_queue.append(
+          visitor.scoping_data.user, str(value) + instruction[2])
+      elif op == RETURN or op == END:
+        value = regs[instruction[1]]
+        if not frames:
+          return value
+        function, scoping_data, instructions, regs, pc, dest = frames.pop()
+        scoping_data.pop_function_call()
+        function.this = Undefined
+        regs[dest] = value
+      elif op == RAISE:
+        raise instruction[1]()
+      else:
+        raise ValueError(f'Unknown opcode: {op!r}.')
+
+      if op == RESOLVE or op == CALL or op == APPLY_CALL:
+        # Enter a dicelang function, as Function.__call__ would, but in a
+        # new frame of the machine rather than a new Python call.
+        function, args, dest = call
+        n, m = len(args), len(function.params)
+        if n != m:
+          e = f'Arguments mismatch formal parameters in length. '
+          e += f'(Got {n}, expected {m}.)'
+          raise CallError(e)
+        if len(frames) >= self.max_call_depth:
+          raise CallDepthError(f'Functions nested deeper than '
+                               f'{self.max_call_depth} calls.')
+        if function.visitor is None:
+          function.visitor = visitor
+        scoping_data = function.visitor.scoping_data
+        scoping_data.push_function_call(function.marshal(args), function.closed)
+        frames.append((function, scoping_data, instructions, regs, pc, dest))
+        code = self.assemble(function.code, in_function=True)
+        budget.spend(code.weight)
+        instructions = code.instructions
+        regs = [None] * code.size
+        pc = 0
@@ -0,0 +1,220 @@
+'''Constant folding for dicelang syntax trees.
+
+`fold` runs once per tree, after parsing and before the tree is cached or
+stored in a Function. It reads every literal into a Python value, then
+evaluates the operations whose operands are all known ahead of time. Each
+computed subtree is replaced by a `constant` node that carries the value and
+keeps the subtree it was computed from, so that decompiling and storing a
+folded tree give exactly what they gave before folding.
+
+Only operations that are deterministic and free of side effects are folded.
+Dice, selection (`@`), shuffling (`><`), plugin calls and anything that
+reads a variable are always left to run time. So is any operation that
+raises, so that the error is reported when and where it always was.'''
+
+from collections.abc import Sequence
+from numbers import Number
+
+from lark import Tree
+
+from dicelang import governor
+from dicelang import util
+from dicelang.undefined import Undefined
+
+# Folded values are kept in cached trees for as long as the tree lives, so
+# results larger than this are computed at run time instead.
+MAX_BITS   = 4096
+MAX_LENGTH = 4096
+
+# How long an exponent may be worked on while folding before it is left to
+# be computed, and timed out, at run time.
+EXPONENT_SECONDS = 0.05
+
+# Rules whose value is read from the text of their token by the function of
+# the same name in `util`.
+literals = {'number_literal', 'string_literal', 'boolean_literal'}
+
+# Rules whose value is computed by the function of the same name in `util`.
+# These are looked up by name when folding, since `util` and this module
+# import one another indirectly.
+operations = {
+  'addition', 'subtraction', 'catenation', 'multiplication', 'division',
+  'remainder', 'floor_division', 'negation', 'real_part_or_nop', 'logarithm',
+  'sum_or_join', 'length', 'flatten_or_abs', 'typeof'
+}
+
+# Rules that only ever wrap a single child.
+passthrough = {
+  'body', 'conditional', 'expression', 'if_expr', 'repeat', 'bool_or',
+  'bool_xor', 'bool_and', 'bool_not', 'comp', 'arithm', 'term', 'factor',
+  'power', 'reduction', 'die', 'primary', 'keyword_expr', 'atom', 'priority',
+  'tuple_literal'
+}
+
+# Every other rule that can be folded; see `evaluate`.
+foldable = operations | {
+  'left_shift', 'right_shift', 'minimum', 'maximum', 'exponent', 'comp_math',
+  'present', 'absent', 'logical_or', 'logical_xor', 'logical_and',
+  'logical_not', 'inline_if', 'inline_if_binary', 'mono_tuple',
+  'multi_tuple', 'empty_tuple'
+}
+
+
+class Constant(object):
+  '''A value computed ahead of time. Constants compare equal when their
+  values have the same type and representation, so that trees holding a
+  folded `nan` still compare equal to themselves.'''
+
+  def __init__(self, value):
+    self.value = value
+
+  def __eq__(self, other):
+    if not isinstance(other, Constant):
+      return False
+    same_type = type(self.value) is type(other.value)
+    return same_type and repr(self.value) == repr(other.value)
+
+  def __hash__(self):
+    return hash((type(self.value), repr(self.value)))
+
+  def __repr__(self):
+    return f'Constant({self.value!r})'
+
+
+def constant(value, tree):
+  '''The node that replaces `tree` once its value is known. Constants among
+  the children of `tree` are unwrapped, so that only the outermost constant
+  of a folded subtree is kept.'''
+  for i, child in enumerate(tree.children):
+    if is_constant(child):
+      tree.children[i] = child.children[1]
+  return Tree('constant', [Constant(value), tree])
+
+def is_constant(tree):
+  return isinstance(tree, Tree) and tree.data == 'constant'
+
+def storable(value):
+  '''Only immutable values of a bounded size are folded, since a folded
+  value is shared by every execution of its tree.'''
+  if isinstance(value, tuple):
+    return len(value) <= MAX_LENGTH and all(storable(v) for v in value)
+  if isinstance(value, str):
+    return len(value) <= MAX_LENGTH
+  if isinstance(value, int):
+    return value.bit_length() <= MAX_BITS
+  return isinstance(value, (float, complex)) or value is Undefined
+
+def affordable(rule, operands):
+  '''False when computing `rule` could build a value far larger than its
+  operands. Such values would be rejected by `storable` anyway, but only
+  after the time and memory to build them had been spent.'''
+  if rule == 'multiplication':
+    left, right = operands
+    if isinstance(right, Sequence):
+      left, right = right, left
+    if isinstance(left, Sequence) and isinstance(right, Number):
+      return abs(right) * len(left) <= MAX_LENGTH
+  elif rule == 'left_shift':
+    left, right = operands
+    if isinstance(left, int) and isinstance(right, int):
+      return right <= MAX_BITS
+  elif rule == 'exponent':
+    mantissa, exponent = operands
+    if isinstance(mantissa, int) and isinstance(exponent, int) and exponent > 0:
+      return governor.power_bits(mantissa, exponent) <= MAX_BITS
+  return True
+
+def operands_of(tree):
+  '''The values of the operands of `tree`, or None if any is not constant.
+  The operators of a chained comparison count as constant operands.'''
+  values = [ ]
+  for child in tree.children:
+    if not isinstance(child, Tree):
+      continue
+    if is_constant(child):
+      values.append(child.children[0].value)
+    elif tree.data == 'comp_math' and child.data == 'math_comp':
+      values.append(child.children[0].value)
+    else:
+      return None
+  return values
+
+def evaluate(rule, operands):
+  '''Compute the value of `rule` applied to constant operands, exactly as
+  every execution engine would.'''
+  if rule in operations:
+    out = getattr(util, rule)(*operands)
+  elif rule in ('left_shift', 'right_shift'):
+    out = util.shift(*operands, left_shift=rule == 'left_shift')
+  elif rule in ('minimum', 'maximum'):
+    out = util.extremum(operands[0], rule)
+  elif rule == 'exponent':
+    budget = governor.Budget(seconds=EXPONENT_SECONDS)
+    out = util.exponent(*operands, budget)
+  elif rule == 'comp_math':
+    out = util.chained_comparison(operands)
+  elif rule == 'present':
+    element, container = operands
+    out = element in container
+  elif rule == 'absent':
+    element, container = operands
+    out = not element in container
+  elif rule == 'logical_or' or rule == 'inline_if_binary':
+    out = operands[0] or operands[1]
+  elif rule == 'logical_xor':
+    left, right = operands
+    out = (left or right) and not (left and right)
+  elif rule == 'logical_and':
+    out = operands[0] and operands[1]
+  elif rule == 'logical_not':
+    out = not operands[-1]
+  elif rule == 'inline_if':
+    body, condition, orelse = operands
+    out = body if condition else orelse
+  else:
+    out = tuple(operands)
+  return out
+
+def folded(tree):
+  '''Return the node that should take the place of `tree`, whose children
+  have already been folded.'''
+  rule = tree.data
+  if rule in literals:
+    return constant(getattr(util, rule)(tree.children[-1].value), tree)
+  if rule == 'undefined_literal':
+    return constant(Undefined, tree)
+  if rule in passthrough and len(tree.children) == 1:
+    child = tree.children[0]
+    if is_constant(child):
+      return constant(child.children[0].value, tree)
+    return tree
+  if rule not in foldable:
+    return tree
+
+  operands = operands_of(tree)
+  if operands is None or not affordable(rule, operands):
+    return tree
+  try:
+    value = evaluate(rule, operands)
+  except Exception:
+    return tree
+  return constant(value, tree) if storable(value) else tree
+
+def fold(tree):
+  '''Fold the constant subtrees of a freshly parsed `tree` in place, and
+  return the tree that replaces it. Frozen trees cannot be folded; fold
+  before freezing. The walk is iterative so that it places no limit on the
+  depth of the tree.'''
+  stack = [(tree, False)]
+  while stack:
+    node, children_folded = stack.pop()
+    if children_folded:
+      for i, child in enumerate(node.children):
+        if isinstance(child, Tree):
+          node.children[i] = folded(child)
+    elif node.data != 'constant':
+      stack.append((node, True))
+      for child in node.children:
+        if isinstance(child, Tree):
+          stack.append((child, False))
+  return folded(tree)
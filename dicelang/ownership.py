@@ -32,16 +32,21 @@ class ScopingData(object):
   def clear_closure(self):
     self.closure.clear()
   
-  def calling_environment(self):
+  def calling_environment(self, names=None):
+    '''A copy of the scopes that a function defined now closes over. When
+    `names` is given, only the variables of those names are copied, and
+    scopes left empty are dropped.'''
     frame = self.get_frame()
     if frame is NotLocal:
       try:
-        frame = [copy.deepcopy(self.get_scope())]
+        frame = [self.get_scope()]
       except IndexError:
-        frame = [{}]
-    else:
-      frame = copy.deepcopy(frame)
-    return frame
+        return [{}]
+    if names is not None:
+      frame = [{name: scope[name] for name in names if name in scope}
+        for scope in frame]
+      frame = [scope for scope in frame if scope] or [{}]
+    return copy.deepcopy(frame)
   
   def push_frame(self):
     self.frame_id += 1
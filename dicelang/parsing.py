@@ -0,0 +1,389 @@
+import os
+import copy
+import json
+import time
+import hashlib
+import threading
+import weakref
+import lark
+from collections import OrderedDict
+from lark import Tree
+from lark import Token
+from lark import ParseError
+from lark.exceptions import UnexpectedInput
+from dicelang import grammar
+
+PARSER_MODES = ['earley', 'lalr']
+
+# One entry per parser built by this process, for the startup timing report.
+build_log = [ ]
+
+def default_mode():
+  '''The parser mode used when none is given explicitly, as configured by the
+  `DICELANG_PARSER` environment variable.'''
+  return os.environ.get('DICELANG_PARSER', 'earley')
+
+def cache_directory():
+  '''Parsers are persisted under `$ATROPOS_CONFIG/parser_cache`. Without a
+  configuration directory, nothing is persisted.'''
+  config_dir_path = os.environ.get('ATROPOS_CONFIG')
+  if config_dir_path is None:
+    return None
+  return os.path.join(config_dir_path, 'parser_cache')
+
+def cache_path(name, text, options):
+  '''Name the cache file for a parser by a digest of everything that
+  determines its tables: the grammar text, the Lark options and the Lark
+  version. Any change produces a new file and forces a rebuild.'''
+  directory = cache_directory()
+  if directory is None or options.get('parser') != 'lalr':
+    return None
+  option_string = ''.join(f'{k}={options[k]!r};' for k in sorted(options))
+  key = text + option_string + lark.__version__
+  digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+  return os.path.join(directory, f'{name}-{digest}.lark')
+
+def remove_stale(path, name):
+  '''Delete cache files left behind by older versions of a parser.'''
+  directory, filename = os.path.split(path)
+  for entry in os.listdir(directory):
+    if entry.startswith(f'{name}-') and not entry.startswith(filename):
+      os.remove(os.path.join(directory, entry))
+
+def build_lark(name, text, **options):
+  '''Build a Lark parser, loading it from the on-disk cache when one exists
+  for this exact grammar. Only LALR parsers can be persisted by Lark; others
+  are built normally. Every build is timed and recorded in `build_log`.'''
+  path = cache_path(name, text, options)
+  cached = path is not None and os.path.exists(path)
+  start = time.perf_counter()
+  if path is None:
+    parser = lark.Lark(text, **options)
+  else:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+      parser = lark.Lark(text, cache=path, **options)
+    except Exception:
+      if not cached:
+        raise
+      # An unreadable cache file is rebuilt rather than trusted.
+      os.remove(path)
+      cached = False
+      parser = lark.Lark(text, cache=path, **options)
+  seconds = time.perf_counter() - start
+  
+  build_seconds = None
+  if path is not None:
+    timing_path = f'{path}.json'
+    if cached:
+      try:
+        with open(timing_path, 'r') as f:
+          build_seconds = json.load(f)['build_seconds']
+      except (OSError, ValueError, KeyError):
+        pass
+    else:
+      with open(timing_path, 'w') as f:
+        json.dump({'build_seconds': seconds}, f)
+      remove_stale(path, name)
+  
+  build_log.append({
+    'name': name,
+    'seconds': seconds,
+    'cached': cached,
+    'build_seconds': build_seconds,
+  })
+  return parser
+
+def startup_report():
+  '''Summarize how long each parser took to become ready, and how much time
+  the on-disk cache saved compared to building it from the grammar.'''
+  lines = ['Parser startup times:']
+  total, saved = 0.0, 0.0
+  for entry in build_log:
+    total += entry['seconds']
+    if entry['cached']:
+      line = f"  {entry['name']}: loaded from cache in {entry['seconds']:.3f}s"
+      if entry['build_seconds'] is not None:
+        saving = entry['build_seconds'] - entry['seconds']
+        saved += saving
+        line += f" (building took {entry['build_seconds']:.3f}s)"
+    else:
+      line = f"  {entry['name']}: built in {entry['seconds']:.3f}s"
+    lines.append(line)
+  lines.append(f'  total: {total:.3f}s, saved by cache: {saved:.3f}s')
+  return '\n'.join(lines)
+
+def grammar_version(mode):
+  '''A short digest identifying the grammar text used by a parser mode, so
+  that trees built from one grammar are never mistaken for another's.'''
+  text = grammar.lalr_text if mode == 'lalr' else grammar.raw_text
+  digest = hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+  return f'{mode}-{digest}'
+
+class LalrNormalizer(lark.Visitor):
+  '''Rewrites the few subtrees where `grammar.lalr_text` differs in shape from
+  `grammar.raw_text`, so that the Visitor sees the same trees regardless of
+  which parser produced them.'''
+
+  def primary_set(self, tree):
+    '''Rebuild `primary = expression` as `identifier subscript_chain =
+    expression`, rejecting any target that the Earley grammar would not
+    have accepted.'''
+    target, value = tree.children
+    subscripts = [ ]
+    while target.data in ('sliced', 'getattr'):
+      inner, outer = target.children
+      if target.data == 'getattr':
+        subscripts.append(Tree('identifier_subscript', [outer]))
+      elif outer.data == 'not_a_slice':
+        subscripts.append(Tree('bracket_subscript', outer.children))
+      else:
+        raise ParseError('Cannot assign to a slice.')
+      target = inner
+
+    try:
+      atom, = target.children
+      identifier_get, = atom.children
+      assert target.data == 'primary' and atom.data == 'atom'
+      assert identifier_get.data == 'identifier_get'
+    except (AttributeError, AssertionError, ValueError):
+      raise ParseError('Assignment target must be a variable or a subscript.')
+
+    chain = Tree('subscript_chain', subscripts[::-1])
+    tree.data = 'subscript_set'
+    tree.children = [identifier_get.children[0], chain, value]
+
+
+class SliceColons(object):
+  '''Postlexer for `grammar.lalr_text`. Within a subscript, the Earley parser
+  reads `::` as the two colons of a slice, so that `x[a::2]` is `x[a: :2]`,
+  wherever that makes a valid slice, and as a plugin call elsewhere. The LALR
+  lexer always reads it as a plugin call. This splits the first `::` at the
+  top level of each pair of brackets into two colons, unless a colon came
+  before it. A split which leaves the command unparsable, as in `x[a::b:c]`,
+  is undone by `Parser.parse`, which parses again with that `::` kept whole.'''
+  
+  always_accept = ()
+  openers = {'LSQB', 'LPAR', '_FUNCTION_OPEN', 'LBRACE'}
+  closers = {'RSQB', 'RPAR', 'RBRACE'}
+  
+  def __init__(self):
+    # The positions of the `::` split during the current parse, and of those
+    # to keep whole, for each thread.
+    self.local = threading.local()
+  
+  def __repr__(self):
+    # Part of the key of the parser's cache file, so it must not vary.
+    return 'SliceColons()'
+  
+  def __reduce__(self):
+    # Saved with the parser in its cache file.
+    return (SliceColons, ())
+  
+  def process(self, stream):
+    split, kept = self.local.split, self.local.kept
+    # For each enclosing bracket, whether a `::` may still be split in it.
+    splittable = [ ]
+    for token in stream:
+      kind = token.type
+      if kind in self.openers:
+        splittable.append(kind == 'LSQB')
+      elif kind in self.closers:
+        if splittable:
+          splittable.pop()
+      elif splittable and splittable[-1]:
+        if kind == 'COLON':
+          splittable[-1] = False
+        elif kind == '_DOUBLE_COLON' and token.pos_in_stream not in kept:
+          splittable[-1] = False
+          split.append(token.pos_in_stream)
+          yield Token.new_borrow_pos('COLON', ':', token)
+          token = Token.new_borrow_pos('COLON', ':', token)
+      yield token
+
+
+class FrozenChildren(list):
+  '''The children of a FrozenTree. Reads behave as for a list, and slices are
+  ordinary lists, but any attempt to modify the sequence in place raises.'''
+  
+  def _immutable(self, *args, **kwargs):
+    raise TypeError('Cached parse trees may not be modified.')
+  
+  __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+  append = extend = insert = pop = remove = clear = sort = reverse = _immutable
+  
+  def __reduce__(self):
+    return (FrozenChildren, (list(self),))
+  
+  def __deepcopy__(self, memodict={}):
+    return [copy.deepcopy(child, memodict) for child in self]
+
+
+class FrozenTree(Tree):
+  '''A parse tree that can be shared between executions of the same command.
+  Its rule name and children cannot be reassigned or modified in place.'''
+  
+  def __init__(self, data, children, meta=None):
+    super().__init__(data, FrozenChildren(children), meta)
+    object.__setattr__(self, '_frozen', True)
+  
+  def __setattr__(self, name, value):
+    if name != '_meta' and getattr(self, '_frozen', False):
+      raise TypeError('Cached parse trees may not be modified.')
+    super().__setattr__(name, value)
+
+
+def freeze(tree):
+  '''Build a FrozenTree with the same shape and tokens as `tree`.'''
+  children = [ ]
+  for child in tree.children:
+    children.append(freeze(child) if isinstance(child, Tree) else child)
+  return FrozenTree(tree.data, children, tree._meta)
+
+
+class TreeMemo(object):
+  '''Values derived from parse trees, such as compiled code, keyed by the
+  identity of the tree and an optional variant. An entry is dropped when its
+  tree is garbage collected, so that a recycled id() is never mistaken for
+  the tree that used to own it.'''
+  
+  def __init__(self):
+    self.entries = { }
+  
+  def __len__(self):
+    return len(self.entries)
+  
+  def get(self, tree, variant=None):
+    entry = self.entries.get((id(tree), variant))
+    if entry is not None and entry[0]() is tree:
+      return entry[1]
+    return None
+  
+  def put(self, tree, value, variant=None):
+    key = (id(tree), variant)
+    forget = lambda ref, key=key: self.entries.pop(key, None)
+    self.entries[key] = (weakref.ref(tree, forget), value)
+    return value
+
+
+class Parser(object):
+  '''Wraps a Lark parser for the dicelang grammar. `mode` is either "earley",
+  which uses the original grammar, or "lalr", which uses the parallel grammar
+  and is considerably faster. When omitted, `default_mode()` is used.'''
+
+  def __init__(self, mode=None, start='start'):
+    mode = default_mode() if mode is None else mode
+    if mode not in PARSER_MODES:
+      raise ValueError(f'Unknown parser mode: {mode!r}.')
+    text = grammar.lalr_text if mode == 'lalr' else grammar.raw_text
+    name = f'dicelang-{mode}-{start}'
+    if mode == 'lalr':
+      self.slices = SliceColons()
+      self.lark = build_lark(name, text, start=start, parser=mode,
+        postlex=self.slices)
+    else:
+      self.slices = None
+      self.lark = build_lark(name, text, start=start, parser=mode)
+    self.normalizer = LalrNormalizer() if mode == 'lalr' else None
+    self.mode = mode
+    self.version = grammar_version(mode)
+
+  def parse(self, text):
+    if self.slices is None:
+      tree = self.lark.parse(text)
+    else:
+      tree = self.parse_slices(text)
+    if self.normalizer is not None:
+      self.normalizer.visit(tree)
+    return tree
+
+
+  def parse_slices(self, text):
+    '''Parse with the LALR parser, keeping whole the last `::` split by
+    SliceColons before any syntax error, and trying again, until the command
+    parses or no split could have caused the error.'''
+    local = self.slices.local
+    local.kept = set()
+    while True:
+      local.split = [ ]
+      try:
+        return self.lark.parse(text)
+      except UnexpectedInput as e:
+        position = e.pos_in_stream
+        split = [p for p in local.split if position is None or p <= position]
+        if not split:
+          raise
+        local.kept.add(split[-1])
+
+def encode_tree(tree):
+  '''Convert a parse tree into nested lists suitable for JSON. A subtree is
+  `[data, [children...]]` and a token is `[type, value]`. Folded constants
+  are encoded as the subtree they were computed from.'''
+  if isinstance(tree, Tree) and tree.data == 'constant':
+    return encode_tree(tree.children[1])
+  if isinstance(tree, Tree):
+    return [tree.data, [encode_tree(child) for child in tree.children]]
+  return [tree.type, tree.value]
+
+def decode_tree(encoded):
+  '''Rebuild a parse tree from the output of `encode_tree`.'''
+  name, contents = encoded
+  if isinstance(contents, list):
+    return Tree(name, [decode_tree(child) for child in contents])
+  return lark.Token(name, contents)
+
+
+class ParseCache(object):
+  '''A least-recently-used cache of frozen parse trees keyed by grammar
+  version and the exact source text of a command. Trees handed out by the
+  cache are shared, which is safe because the Visitor only reads them.
+  `optimize`, when given, is applied to each tree once, before it is frozen
+  and cached.'''
+  
+  def __init__(self, parser, max_size=1024, optimize=None):
+    self.parser = parser
+    self.max_size = max_size
+    self.optimize = optimize
+    self.trees = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+  
+  def __len__(self):
+    return len(self.trees)
+  
+  def parse(self, text):
+    '''Return the cached tree for `text`, parsing and caching it on a miss.
+    Syntax errors propagate to the caller and are not cached.'''
+    key = (self.parser.version, text)
+    try:
+      tree = self.trees[key]
+    except KeyError:
+      self.misses += 1
+      tree = self.parser.parse(text)
+      if self.optimize is not None:
+        tree = self.optimize(tree)
+      tree = freeze(tree)
+      if self.max_size > 0:
+        self.trees[key] = tree
+        if len(self.trees) > self.max_size:
+          self.trees.popitem(last=False)
+    else:
+      self.hits += 1
+      self.trees.move_to_end(key)
+    return tree
+  
+  def clear(self):
+    self.trees.clear()
+  
+  def hit_rate(self):
+    lookups = self.hits + self.misses
+    return self.hits / lookups if lookups else 0.0
+  
+  def stats(self):
+    return {
+      'size'     : len(self.trees),
+      'max_size' : self.max_size,
+      'hits'     : self.hits,
+      'misses'   : self.misses,
+      'hit_rate' : self.hit_rate(),
+    }
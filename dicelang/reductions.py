@@ -0,0 +1,147 @@
+'''Reductions of the results of a loop, accumulated one result at a time.
+
+A reduction such as `&` or `!>` applied directly to a `for` loop or to a
+repetition does not need the list of the loop's results, only what it would
+reduce them to. The execution engines give such a loop an accumulator in
+place of its list of results. The accumulator takes each result as the loop
+appends it, keeps only what the reduction needs, and gives the value the
+reduction of the whole list would have had.
+
+An error the reduction would have raised is only raised once the loop has
+finished, as it would have been had the list been built, so that the rest
+of the loop still runs.'''
+
+from dicelang import util
+
+
+class Accumulator(object):
+  '''Stands in for the list of results of a loop. `append` is given each
+  result in turn, and `value` is the reduction of all of them. The first
+  error the reduction raises is kept, and raised by `value`.'''
+
+  def __init__(self):
+    self.error = None
+    self.empty = True
+
+  def value(self):
+    if self.error is not None:
+      raise self.error
+    return self.reduce()
+
+
+class Sum(Accumulator):
+  '''`&`: the first result, with each of the others added to it in turn.'''
+
+  def __init__(self):
+    super().__init__()
+    self.total = 0
+
+  def append(self, result):
+    if self.empty:
+      # `+=` extends a list in place, and the first may be held elsewhere.
+      self.total = result[:] if isinstance(result, list) else result
+      self.empty = False
+    elif self.error is None:
+      try:
+        self.total += result
+      except Exception as e:
+        self.error = e
+
+  def reduce(self):
+    return self.total
+
+
+class Count(Accumulator):
+  '''`#`: the number of results.'''
+
+  def __init__(self):
+    super().__init__()
+    self.count = 0
+
+  def append(self, result):
+    self.count += 1
+
+  def reduce(self):
+    return self.count
+
+
+class Minimum(Accumulator):
+  '''`!<`: the first of the least results, compared as `min` compares them.'''
+
+  def __init__(self):
+    super().__init__()
+    self.best = None
+
+  def append(self, result):
+    if self.empty:
+      self.best = result
+      self.empty = False
+    elif self.error is None:
+      try:
+        if result < self.best:
+          self.best = result
+      except Exception as e:
+        self.error = e
+
+  def reduce(self):
+    if self.empty:
+      min(())
+    return self.best
+
+
+class Maximum(Minimum):
+  '''`!>`: the first of the greatest results.'''
+
+  def append(self, result):
+    if self.empty:
+      self.best = result
+      self.empty = False
+    elif self.error is None:
+      try:
+        if result > self.best:
+          self.best = result
+      except Exception as e:
+        self.error = e
+
+  def reduce(self):
+    if self.empty:
+      max(())
+    return self.best
+
+
+class Stats(Accumulator):
+  '''`?`: integer results are tallied, so that memory grows only with the
+  number of distinct results. From the first result that is not an integer
+  on, the results are kept in a list, as they would have been.'''
+
+  def __init__(self):
+    super().__init__()
+    self.tally = { }
+    self.results = None
+
+  def append(self, result):
+    if self.results is not None:
+      self.results.append(result)
+    elif type(result) is int:
+      self.tally[result] = self.tally.get(result, 0) + 1
+    else:
+      # The order of the integers before it cannot change the summary.
+      self.results = [ ]
+      for value, count in self.tally.items():
+        self.results.extend([value] * count)
+      self.results.append(result)
+
+  def reduce(self):
+    if self.results is not None:
+      return util.stats(self.results)
+    return util.stats_of_tally(self.tally)
+
+
+# The accumulator for each reduction rule.
+accumulators = {
+  'sum_or_join' : Sum,
+  'length'      : Count,
+  'minimum'     : Minimum,
+  'maximum'     : Maximum,
+  'stats'       : Stats,
+}
@@ -0,0 +1,137 @@
+'''Cumulative distribution tables of sums of dice, for drawing the sum of a
+large pool of dice without rolling each die.
+
+The table for `dice` dice with `sides` sides counts, for each possible sum,
+the ways of rolling that sum or less out of the `sides ** dice` ways of
+rolling the pool. A uniform integer below that total falls into the table
+at a sum with exactly the probability of rolling every die and adding them
+up, so a draw costs one random number and one binary search.
+
+Counts are exact integers, and the size of a table grows with the square of
+its dice, so tables are only built for pools of up to a few hundred dice,
+always a power of two. Larger pools are drawn as a sum of draws from those.'''
+
+import bisect
+import itertools
+import random
+import sys
+
+from collections import OrderedDict
+
+from dicelang.exceptions import DiceRollTimeout
+
+# A bound on the additions done building one table, in counts times dice.
+# It also bounds the memory the table takes.
+TABLE_WORK = 1 << 22
+
+# Pools whose largest affordable table has fewer dice than this are rolled
+# die by die instead.
+MIN_BLOCK = 8
+
+# Draws taken between checks of the clock.
+DRAWS_PER_CHECK = 1024
+
+def add_die(ways, sides):
+  '''Ways of rolling each sum with one more die, given the `ways` of rolling
+  each sum so far, lowest sum first. Each count is a sliding window over the
+  running sums of the old counts.'''
+  running = [0, *itertools.accumulate(ways)]
+  before = len(ways)
+  return [running[min(i + 1, before)] - running[max(i + 1 - sides, 0)]
+    for i in range(before + sides - 1)]
+
+def block_size(dice, sides):
+  '''The number of dice in the largest table worth using for a pool: a power
+  of two that is affordable to build, and no larger than the square root of
+  the pool, so that building it costs about as much as rolling the pool.'''
+  block = 1
+  while (2 * block) ** 2 <= dice and (2 * block) ** 2 * sides <= TABLE_WORK:
+    block *= 2
+  return block
+
+def draw(cumulative, dice):
+  '''One sum drawn from the table for `dice` dice.'''
+  return dice + bisect.bisect_right(cumulative, random.randrange(cumulative[-1]))
+
+
+class SumTables(object):
+  '''A least-recently-used cache of tables keyed by `(dice, sides)`, holding
+  at most `max_bytes` of tables. A table too large for the cache is built,
+  used and dropped.'''
+
+  def __init__(self, max_bytes):
+    self.max_bytes = max_bytes
+    self.tables = OrderedDict()
+    self.bytes = 0
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self):
+    return len(self.tables)
+
+  def get(self, dice, sides, budget):
+    '''The cumulative table for a power of two `dice`, built from the table
+    for half as many dice on a miss.'''
+    key = (dice, sides)
+    try:
+      cumulative, size = self.tables[key]
+    except KeyError:
+      self.misses += 1
+    else:
+      self.hits += 1
+      self.tables.move_to_end(key)
+      return cumulative
+
+    if dice == 1:
+      ways = [1] * sides
+    else:
+      half = self.get(dice // 2, sides, budget)
+      ways = [b - a for a, b in zip([0] + half, half)]
+      for die in range(dice // 2):
+        budget.check(DiceRollTimeout)
+        ways = add_die(ways, sides)
+    cumulative = list(itertools.accumulate(ways))
+    size = sys.getsizeof(cumulative) + sum(map(sys.getsizeof, cumulative))
+    if size <= self.max_bytes:
+      self.tables[key] = (cumulative, size)
+      self.bytes += size
+      while self.bytes > self.max_bytes:
+        old, old_size = self.tables.popitem(last=False)[1]
+        self.bytes -= old_size
+    return cumulative
+
+  def roll(self, dice, sides, block, budget):
+    '''The sum of `dice` dice, drawn `block` dice at a time, and the rest
+    from the tables for the binary digits of what remains.'''
+    cumulative = self.get(block, sides, budget)
+    total = 0
+    for i in range(dice // block):
+      if i % DRAWS_PER_CHECK == 0:
+        budget.check(DiceRollTimeout)
+      total += draw(cumulative, block)
+    remainder = dice % block
+    part = 1
+    while remainder:
+      if remainder & 1:
+        total += draw(self.get(part, sides, budget), part)
+      remainder >>= 1
+      part *= 2
+    return total
+
+  def clear(self):
+    self.tables.clear()
+    self.bytes = 0
+
+  def hit_rate(self):
+    lookups = self.hits + self.misses
+    return self.hits / lookups if lookups else 0.0
+
+  def stats(self):
+    return {
+      'size'      : len(self.tables),
+      'bytes'     : self.bytes,
+      'max_bytes' : self.max_bytes,
+      'hits'      : self.hits,
+      'misses'    : self.misses,
+      'hit_rate'  : self.hit_rate(),
+    }
@@ -0,0 +1,79 @@
+import pytest
+
+from recognizer import Recognizer
+from recognizer import might_be_command
+
+error = ('error', {})
+
+class TestRecognizer:
+  @pytest.mark.parametrize('text, expected', [
+    ('+roll 3d6', ('roll_lit', {'value': ' 3d6', 'option': 'literate'})),
+    ('+atropos roll 3d6', ('roll_lit', {'value': ' 3d6', 'option': 'literate'})),
+    ('  +  atropos  roll 1d20 \n', ('roll_lit', {'value': ' 1d20', 'option': 'literate'})),
+    ('+roll3d6', ('roll_lit', {'value': '3d6', 'option': 'literate'})),
+    ('+atroposroll 3d6', ('roll_lit', {'value': ' 3d6', 'option': 'literate'})),
+    ('+roll x = 1;\n  x + 1\n', ('roll_lit', {'value': ' x = 1;\n  x + 1', 'option': 'literate'})),
+    ('+roll', ('roll_help', {})),
+    ('+roll  \n\t', ('roll_help', {})),
+    ('+old 3d6', ('roll_code', {'value': ' 3d6'})),
+    ('+atropos old 3d6', ('roll_code', {'value': ' 3d6'})),
+    ('+old3d6', ('roll_code', {'value': '3d6'})),
+    ('+old', error),
+    ('+old ', ('roll_code', {'value': ' '})),
+    ('+odds 2d6', ('roll_odds', {'value': ' 2d6'})),
+    ('+atropos odds 2d6', ('roll_odds', {'value': ' 2d6'})),
+    ('+odds2d6', ('roll_odds', {'value': '2d6'})),
+    ('+odds', ('roll_help', {})),
+    ('+odds \n', ('roll_help', {})),
+  ])
+  def test_rolls(self, text, expected):
+    assert Recognizer().recognize(text) == expected
+
+  @pytest.mark.parametrize('text, expected', [
+    ('+view', 'view_help'),
+    ('+atropos view', 'view_help'),
+    ('+view all', 'view_all'),
+    ('+view all vars', 'view_all'),
+    ('+viewallvars', 'view_all'),
+    ('+view global', 'view_public'),
+    ('+view globals', 'view_public'),
+    ('+view our vars', 'view_shared'),
+    ('+view shareds', 'view_shared'),
+    ('+view my', 'view_private'),
+    ('+atropos view privates', 'view_private'),
+    ('+view core vars', 'view_core'),
+    ('+view library', 'view_core'),
+    ('+view builtin', 'view_builtins'),
+    ('+view builtins', 'view_builtins'),
+    ('+view  my \n', 'view_private'),
+    ('+view something', 'view_help'),
+    ('+view my stuff', 'error'),
+    ('+view all vars please', 'error'),
+  ])
+  def test_views(self, text, expected):
+    assert Recognizer().recognize(text)[0] == expected
+
+  @pytest.mark.parametrize('text, expected', [
+    ('+help', ('help_help', {})),
+    ('+atropos help', ('help_help', {})),
+    ('+help  \n', ('help_help', {})),
+    ('+help dice', ('help_topic', {'value': 'dice', 'option': ''})),
+    ('+atropos help dice', ('help_topic', {'value': 'dice', 'option': ''})),
+    ('+help dice  rolls\n', ('help_topic', {'value': 'dice', 'option': 'rolls'})),
+    ('+helpdice', error),
+    ('+help dice!', error),
+  ])
+  def test_help(self, text, expected):
+    assert Recognizer().recognize(text) == expected
+
+  @pytest.mark.parametrize('text', [
+    '', '   ', 'roll 3d6', 'hello +roll 3d6', '+', '+atropos', '+ frobnicate',
+    '+atropos frobnicate', '+Roll 3d6',
+  ])
+  def test_not_commands(self, text):
+    assert Recognizer().recognize(text) == error
+
+  def test_might_be_command(self):
+    assert might_be_command(' \n+roll 3d6')
+    assert not might_be_command('roll 3d6')
+    assert not might_be_command('\u00a0+roll 3d6')
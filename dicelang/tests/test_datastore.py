@@ -0,0 +1,393 @@
+import math
+import threading
+import time
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from dicelang import analysis
+from dicelang import codec
+from dicelang import datastore
+from dicelang.alias import Alias
+from dicelang.function import Function
+from dicelang.datastore import DataStore
+from dicelang.exceptions import CodecError
+from dicelang.parsing import Parser
+from dicelang.undefined import Undefined
+from atropos_db.models import Variable
+
+user = 10
+
+class TestCompiledFunctions:
+  store = DataStore()
+  
+  def value(self):
+    inner = Function('(x) -> x * 2')
+    outer = Function('(f, v) -> begin\n  f -: v\nend', closed_vars=[{'g': inner}])
+    return {'apply': outer, 'twice': [inner], 'alias': Alias(Function('() -> 3'))}
+  
+  def reload(self, name):
+    self.store.cache.drop(user, name, 'private')
+    return self.store.get(user, name, 'private')
+  
+  def test_stored_functions_are_not_reparsed(self, monkeypatch):
+    value = self.value()
+    self.store.put(user, 'compiled_lib', value, 'private')
+    row = Variable.objects.get(owner_id=user, var_type='private', name='compiled_lib')
+    assert row.value_data and row.value_string == '' and row.ast_string == ''
+    
+    def fail(self, src):
+      raise AssertionError(f'reparsed {src!r}')
+    monkeypatch.setattr(Function, 'parse', fail)
+    loaded = self.reload('compiled_lib')
+    assert loaded['apply'] == value['apply']
+    assert loaded['apply'].src == value['apply'].src
+    assert loaded['apply'].closed[0]['g'] == value['twice'][0]
+    assert loaded['alias'].aliased == value['alias'].aliased
+    monkeypatch.undo()
+    self.store.drop(user, 'compiled_lib', 'private')
+  
+  def test_stale_grammar_falls_back_to_source(self, monkeypatch):
+    value = self.value()
+    monkeypatch.setattr(codec, 'GRAMMAR', '0/old')
+    self.store.put(user, 'stale_lib', value, 'private')
+    monkeypatch.undo()
+    parsed = [ ]
+    parse = Function.parse
+    monkeypatch.setattr(Function, 'parse',
+      lambda self, src: parsed.append(src) or parse(self, src))
+    loaded = self.reload('stale_lib')
+    assert len(set(parsed)) == 3
+    assert loaded['apply'] == value['apply']
+    assert loaded['apply'].closed[0]['g'] == value['twice'][0]
+    self.store.drop(user, 'stale_lib', 'private')
+  
+  def test_changed_grammar_falls_back_to_source(self, monkeypatch):
+    value = self.value()
+    # Half of the rules removed, and the rest numbered in another order.
+    old = codec.SYMBOLS[:len(codec.SYMBOLS) // 2:-1]
+    monkeypatch.setattr(codec, 'GRAMMAR', '0/old')
+    monkeypatch.setattr(codec, 'SYMBOLS', old)
+    monkeypatch.setattr(codec, 'SYMBOL_NUMBERS',
+      {name: i for i, name in enumerate(old)})
+    self.store.put(user, 'renumbered_lib', value, 'private')
+    monkeypatch.undo()
+    loaded = self.reload('renumbered_lib')
+    assert loaded['apply'] == value['apply']
+    assert loaded['apply'].closed[0]['g'] == value['twice'][0]
+    assert loaded['alias'].aliased == value['alias'].aliased
+    self.store.drop(user, 'renumbered_lib', 'private')
+  
+  def test_unreadable_rows_are_not_missing(self):
+    Variable.objects.create(owner_id=user, var_type='private',
+      name='damaged_value', value_data=b'\xff\x00U')
+    with pytest.raises(CodecError):
+      self.store.get(user, 'damaged_value', 'private')
+    Variable.objects.filter(owner_id=user, name='damaged_value').delete()
+  
+  def test_legacy_rows_are_converted(self):
+    value = self.value()
+    value_string, _ = datastore.legacy_strings(value)
+    Variable.objects.create(owner_id=user, var_type='private',
+      name='legacy_lib', value_string=value_string,
+      ast_string='{"version": "0/old", "functions": {}}')
+    loaded = self.store.get(user, 'legacy_lib', 'private')
+    assert loaded['apply'] == value['apply']
+    row = Variable.objects.get(owner_id=user, var_type='private', name='legacy_lib')
+    assert row.value_string == '' and row.ast_string == ''
+    assert codec.decode(row.value_data)['alias'].aliased == value['alias'].aliased
+    self.store.drop(user, 'legacy_lib', 'private')
+  
+  def test_plain_values_store_nothing(self):
+    self.store.put(user, 'plain_value', [1, 2, {'x': 'y'}], 'private')
+    row = Variable.objects.get(owner_id=user, var_type='private', name='plain_value')
+    assert row.ast_string == ''
+    assert self.reload('plain_value') == [1, 2, {'x': 'y'}]
+    self.store.drop(user, 'plain_value', 'private')
+
+
+class TestCodec:
+  values = [
+    0, 1, -1, 2 ** 63 - 1, -2 ** 63, 2 ** 63, -3 ** 200, True, False,
+    0.5, -1e300, float('inf'), float('-inf'), 3 - 4j, '', 'héllo\n\ud800',
+    [ ], [1, 'a', 2.5], list(range(-40000, 40000, 7)), [2 ** 70] * 8,
+    [0.1] * 8, [True] * 8, [1, 2.0] * 4, (1, (2,)), { },
+    {'x': [1, {'y': (2,)}], 3: Undefined, (1, 2): 'z'}, Undefined,
+  ]
+  
+  @pytest.mark.parametrize('value', values, ids=repr)
+  def test_roundtrip(self, value):
+    out = codec.decode(codec.encode(value))
+    assert out == value
+    assert type(out) is type(value)
+    if isinstance(value, list):
+      assert list(map(type, out)) == list(map(type, value))
+  
+  def test_nan(self):
+    assert math.isnan(codec.decode(codec.encode(float('nan'))))
+  
+  def test_functions(self):
+    inner = Function('(x) -> x * 2')
+    value = [Function('() -> g(1)', closed_vars=[{'g': inner}]),
+      Alias(Function('() -> 3'))]
+    out = codec.decode(codec.encode(value))
+    assert out[0] == value[0] and out[0].src == value[0].src
+    assert out[0].closed[0]['g'] == inner
+    assert isinstance(out[1], Alias) and out[1].aliased == value[1].aliased
+  
+  def test_smaller_than_repr(self):
+    value = {'f': Function('(x) -> x + 1'), 'l': list(range(1000))}
+    value_string, ast_string = datastore.legacy_strings(value)
+    assert len(codec.encode(value)) < len(value_string) + len(ast_string)
+  
+  def test_unsupported(self):
+    with pytest.raises(CodecError):
+      codec.encode([object()])
+    with pytest.raises(CodecError):
+      codec.decode(b'\x00\x00U')
+    with pytest.raises(CodecError):
+      codec.decode(codec.encode(list(range(100)))[:-1])
+
+
+class TestPrefetch:
+  store = DataStore()
+  parser = Parser('lalr')
+  
+  def test_stored_names(self):
+    tree = self.parser.parse(
+      'x = my a + our b.c + global d[0] + core e; del f; '
+      'for i in g do print(i); import h.j as k; (p) -> p + q + roll::"2d4"')
+    assert analysis.stored_names(tree) == {
+      ('private', 'a'), ('server', 'b'), ('global', 'd'), ('core', 'e'),
+      ('server', 'g'), ('server', 'i'), ('server', 'h'), ('server', 'p'),
+      ('server', 'q'),
+      ('server', 'roll')}
+  
+  def test_one_query_for_all_misses(self):
+    for name in ('prefetch_a', 'prefetch_b'):
+      self.store.put(user, name, [name], 'private')
+      self.store.cache.drop(user, name, 'private')
+    self.store.put(user, 'prefetch_c', 3, 'private')
+    keys = [(user, f'prefetch_{n}', 'private') for n in 'abcd']
+    with CaptureQueriesContext(connection) as queries:
+      assert self.store.prefetch(keys) == 2
+      assert self.store.get(user, 'prefetch_a', 'private') == ['prefetch_a']
+      assert self.store.get(user, 'prefetch_b', 'private') == ['prefetch_b']
+      assert self.store.get(user, 'prefetch_c', 'private') == 3
+    assert len(queries) == 1
+    assert self.store.prefetch(keys[:3]) == 0
+    for name in ('prefetch_a', 'prefetch_b', 'prefetch_c'):
+      self.store.drop(user, name, 'private')
+
+
+class TestMissCache:
+  def test_misses_are_remembered_until_put(self):
+    store = DataStore()
+    with CaptureQueriesContext(connection) as queries:
+      for i in range(10):
+        assert store.get(user, 'missing_a', 'private') is None
+    assert len(queries) == 1
+    stats = store.absent.stats()
+    assert stats['size'] == 1 and stats['hits'] == 9 and stats['misses'] == 1
+    store.put(user, 'missing_a', 1, 'private')
+    store.cache.drop(user, 'missing_a', 'private')
+    assert store.get(user, 'missing_a', 'private') == 1
+    store.drop(user, 'missing_a', 'private')
+    assert store.get(user, 'missing_a', 'private') is None
+  
+  def test_prefetch_remembers_misses(self):
+    store = DataStore()
+    store.prefetch([(user, 'missing_b', 'private')])
+    with CaptureQueriesContext(connection) as queries:
+      assert store.get(user, 'missing_b', 'private') is None
+      assert store.prefetch([(user, 'missing_b', 'private')]) == 0
+    assert len(queries) == 0
+  
+  def test_bounded(self):
+    misses = datastore.MissCache(max_size=2)
+    for key in 'abc':
+      misses.add(('private', user, key))
+    assert misses.known(('private', user, 'b'))
+    misses.add(('private', user, 'd'))
+    assert len(misses) == 2
+    assert not misses.known(('private', user, 'a'))
+    assert not misses.known(('private', user, 'c'))
+    assert misses.hit_rate() == pytest.approx(1 / 3)
+
+
+class TestWriteBehind:
+  def rows(self, *names):
+    return sorted(Variable.objects.filter(owner_id=user, var_type='private',
+      name__in=names).values_list('name', flat=True))
+  
+  def test_changes_are_written_together(self):
+    store = DataStore(flush_interval=60000)
+    with CaptureQueriesContext(connection) as queries:
+      for i in range(100):
+        store.put(user, 'behind_a', i, 'private')
+      store.put(user, 'behind_b', 'b', 'private')
+      assert store.get(user, 'behind_a', 'private') == 99
+    assert len(queries) == 0
+    assert self.rows('behind_a', 'behind_b') == [ ]
+    assert store.flush() == 2
+    assert self.rows('behind_a', 'behind_b') == ['behind_a', 'behind_b']
+    stats = store.flush_stats()
+    assert stats['pending'] == 0 and stats['last_batch'] == 2
+    assert stats['written'] == 2 and stats['last_lag'] > 0
+    
+    assert store.drop(user, 'behind_a', 'private') == 99
+    assert store.get(user, 'behind_a', 'private') is None
+    store.cache.drop(user, 'behind_b', 'private')
+    assert store.drop(user, 'behind_b', 'private') == 'b'
+    assert self.rows('behind_a', 'behind_b') == ['behind_a', 'behind_b']
+    store.close()
+    assert self.rows('behind_a', 'behind_b') == [ ]
+  
+  def test_dropped_before_written(self):
+    store = DataStore(flush_interval=60000)
+    store.put(user, 'behind_c', 1, 'private')
+    assert store.drop(user, 'behind_c', 'private') == 1
+    assert store.drop(user, 'behind_c', 'private') is None
+    assert store.view('private', user).count('behind_c') == 0
+    store.close()
+    assert store.flush_stats()['max_batch'] == 1
+  
+  def test_units_of_work_are_marked_when_done(self):
+    store = DataStore(flush_interval=60000)
+    with store.unit_of_work():
+      store.put(user, 'behind_d', 1, 'private')
+      assert store.get(user, 'behind_d', 'private') == 1
+      assert store.flush_stats()['pending'] == 0
+    assert store.flush_stats()['pending'] == 1
+    with pytest.raises(KeyError):
+      with store.unit_of_work():
+        store.drop(user, 'behind_d', 'private')
+        raise KeyError
+    assert store.get(user, 'behind_d', 'private') == 1
+    store.drop(user, 'behind_d', 'private')
+    store.close()
+    assert self.rows('behind_d') == [ ]
+  
+  def test_flushed_when_batch_is_full(self):
+    store = DataStore(flush_interval=60000, flush_size=10)
+    names = [f'behind_{i}' for i in range(10)]
+    for name in names:
+      store.put(user, name, name, 'private')
+    deadline = time.monotonic() + 10
+    while store.flush_stats()['flushes'] == 0 and time.monotonic() < deadline:
+      time.sleep(0.01)
+    assert self.rows(*names) == sorted(names)
+    store.close()
+    store.put(user, 'behind_0', 0, 'private')
+    assert Variable.objects.get(owner_id=user, name='behind_0').value_data
+    for name in names:
+      store.drop(user, name, 'private')
+    assert self.rows(*names) == [ ]
+
+
+class TestCache:
+  # Strings of a thousand characters, and a budget that holds three.
+  size = datastore.footprint('x' * 1000)
+  
+  def cache(self, policy, **options):
+    return datastore.Cache(max_bytes=self.size * 3, policy=policy, **options)
+  
+  def put(self, cache, *names, mode='private'):
+    for name in names:
+      cache.put(user, name, name.ljust(1000, 'x'), mode)
+  
+  def cached(self, cache, *names):
+    return [name for name in names if cache.contains(user, name, 'private')]
+  
+  def test_lru(self):
+    cache = self.cache('lru')
+    self.put(cache, 'a', 'b', 'c')
+    cache.get(user, 'a', 'private')
+    self.put(cache, 'd')
+    assert self.cached(cache, 'a', 'b', 'c', 'd') == ['a', 'c', 'd']
+  
+  def test_lfu(self):
+    cache = self.cache('lfu')
+    self.put(cache, 'a', 'b', 'c')
+    for name in 'aabcc':
+      cache.get(user, name, 'private')
+    self.put(cache, 'd', 'e')
+    assert self.cached(cache, 'a', 'b', 'c', 'd', 'e') == ['a', 'c', 'e']
+  
+  def test_tinylfu_resists_scans(self):
+    cache = datastore.Cache(max_bytes=self.size * 20, policy='tinylfu')
+    hot = [f'hot{i}' for i in range(10)]
+    for i in range(5):
+      for name in hot:
+        if cache.get(user, name, 'private') is None:
+          self.put(cache, name)
+    for i in range(200):
+      name = f'scan{i}'
+      if cache.get(user, name, 'private') is None:
+        self.put(cache, name)
+    assert self.cached(cache, *hot) == hot
+    assert cache.stats()['modes']['private']['evictions'] > 150
+  
+  def test_core_is_pinned(self):
+    cache = self.cache('lru')
+    self.put(cache, 'a', 'b', 'c', 'd', 'e', mode='core')
+    self.put(cache, 'f', 'g', 'h')
+    assert self.cached(cache, 'f', 'g', 'h') == ['f', 'g', 'h']
+    assert all(cache.contains(user, name, 'core') for name in 'abcde')
+    modes = cache.stats()['modes']
+    assert modes['core']['size'] == 5 and modes['core']['evictions'] == 0
+    assert modes['core']['bytes'] == self.size * 5
+  
+  def test_oversized_values_are_not_cached(self):
+    cache = self.cache('tinylfu')
+    self.put(cache, 'a')
+    cache.put(user, 'a', 'x' * 10000, 'private')
+    assert cache.get(user, 'a', 'private') is None
+    assert cache.stats()['evictable_bytes'] == 0
+  
+  def test_stats(self):
+    cache = self.cache('lru')
+    self.put(cache, 'a', 'b', 'c', 'd')
+    cache.get(user, 'd', 'private')
+    cache.get(user, 'a', 'private')
+    cache.drop(user, 'c', 'private')
+    private = cache.stats()['modes']['private']
+    assert private['hits'] == 1 and private['misses'] == 1
+    assert private['hit_rate'] == 0.5 and private['evictions'] == 1
+    assert private['size'] == 2 and private['bytes'] == self.size * 2
+  
+  @pytest.mark.parametrize("policy", ['lru', 'lfu', 'tinylfu'])
+  def test_threads(self, policy):
+    cache = self.cache(policy)
+    def work(offset):
+      for i in range(500):
+        name = 'abcdefgh'[(i * 7 + offset) % 8]
+        if cache.get(user, name, 'private') is None:
+          self.put(cache, name)
+        if i % 5 == 0:
+          cache.drop(user, name, 'private')
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    stats = cache.stats()
+    assert stats['evictable_bytes'] == self.size * stats['size']
+    assert stats['evictable_bytes'] <= cache.max_bytes
+    assert len(cache.policy) == stats['size']
+  
+  def test_unknown_policy(self):
+    with pytest.raises(ValueError):
+      datastore.Cache(policy='fifo')
+
+
+class TestCacheStats:
+  def test_shared_values_are_counted_once(self):
+    cache = datastore.Cache()
+    value = {'f': Function('(x) -> x + 1'), 'l': list(range(100))}
+    cache.put(user, 'shared_a', value, 'private')
+    alone = cache.stats()
+    assert alone['size'] == 1 and alone['shared_bytes'] == 0
+    cache.put(user, 'shared_b', value, 'private')
+    both = cache.stats()
+    assert both['bytes'] == alone['bytes']
+    assert both['shared_bytes'] == alone['bytes']
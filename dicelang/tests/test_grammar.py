@@ -0,0 +1,199 @@
+import os
+import pytest
+from dicelang import optimizer
+from dicelang import parsing
+from dicelang.function import Function
+from dicelang.parsing import Parser
+from dicelang.parsing import ParseCache
+
+files_to_test = ['block_comment.txt', 'comment_lines.txt']
+
+def get_commands(filename):
+  commands = [ ]
+  with open(filename, 'r') as f:
+    for line in f:
+      line = line.strip()
+      if line:
+        commands.append(line.split('===>')[0].strip())
+  return commands
+
+def get_scripts(filenames):
+  scripts = [ ]
+  for filename in filenames:
+    with open(f'data/{filename}', 'r') as f:
+      scripts.append(f.read().split('===>')[0])
+  return scripts
+
+class TestGrammar:
+  earley = Parser('earley')
+  lalr = Parser('lalr')
+  
+  @pytest.mark.parametrize("command", get_commands('data/lines.txt'))
+  def test_lines(self, command):
+    expected = TestGrammar.earley.parse(command)
+    actual = TestGrammar.lalr.parse(command)
+    assert actual == expected
+  
+  @pytest.mark.parametrize("script", get_scripts(files_to_test))
+  def test_scripts(self, script):
+    expected = TestGrammar.earley.parse(script)
+    actual = TestGrammar.lalr.parse(script)
+    assert actual == expected
+  
+  @pytest.mark.parametrize("command", [
+    'f = (a, b) -> a + b',
+    'f((x) -> x, (y))',
+    'if a then if b then c else d',
+    "our box['a'][0].q = 5",
+    'x is not my x is x',
+    'd = 3d6h2 + 4r8l1',
+    'x[1::2]',
+    'x[a::2]',
+    'x[::2]',
+    'x[a::]',
+    'x[-a + 1::b.c(2)]',
+    'x[a::b[1::2]]',
+    'x[a::b:c]',
+    'x[a:b::c]',
+    'x[(a::b)]',
+    '[a::b]',
+  ])
+  def test_ambiguities(self, command):
+    expected = TestGrammar.earley.parse(command)
+    actual = TestGrammar.lalr.parse(command)
+    assert actual == expected
+  
+  @pytest.mark.parametrize("command", ['x[1:2] = 3', 'f(x) = 2', '(x) = 1'])
+  def test_bad_assignment(self, command):
+    with pytest.raises(Exception):
+      TestGrammar.earley.parse(command)
+    with pytest.raises(Exception):
+      TestGrammar.lalr.parse(command)
+
+
+class TestParseCache:
+  parser = Parser('lalr')
+  
+  def test_hits_and_misses(self):
+    cache = ParseCache(TestParseCache.parser, max_size=4)
+    first = cache.parse('4d6h3')
+    second = cache.parse('4d6h3')
+    assert first is second
+    assert first == TestParseCache.parser.parse('4d6h3')
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.hit_rate() == 0.5
+  
+  def test_least_recently_used_is_evicted(self):
+    cache = ParseCache(TestParseCache.parser, max_size=2)
+    a = cache.parse('1')
+    cache.parse('2')
+    cache.parse('1')
+    cache.parse('3')
+    assert len(cache) == 2
+    assert cache.parse('1') is a
+    assert cache.stats()['misses'] == 3
+    cache.parse('2')
+    assert cache.stats()['misses'] == 4
+  
+  def test_disabled(self):
+    cache = ParseCache(TestParseCache.parser, max_size=0)
+    assert cache.parse('1') is not cache.parse('1')
+    assert len(cache) == 0
+  
+  def test_keyed_by_grammar_version(self):
+    earley = Parser('earley')
+    assert earley.version != TestParseCache.parser.version
+    cache = ParseCache(earley)
+    cache.parse('1')
+    cache.parser = TestParseCache.parser
+    cache.parse('1')
+    assert cache.misses == 2
+  
+  def test_cached_trees_are_frozen(self):
+    cache = ParseCache(TestParseCache.parser)
+    tree = cache.parse('x = (a) -> a + 1')
+    function = next(tree.find_data('function'))
+    with pytest.raises(TypeError):
+      function.children.append(function.children[0])
+    with pytest.raises(TypeError):
+      function.children[0] = 'b'
+    with pytest.raises(TypeError):
+      function.data = 'block'
+    assert function.children[1:] == [function.children[-1]]
+
+  def test_optimized_before_freezing(self):
+    cache = ParseCache(TestParseCache.parser, optimize=optimizer.fold)
+    tree = cache.parse('1 + 2')
+    assert isinstance(tree, parsing.FrozenTree)
+    assert tree.children[0].data == 'constant'
+
+
+class TestConstantFolding:
+  parser = Parser('lalr')
+
+  def fold(self, command):
+    return optimizer.fold(TestConstantFolding.parser.parse(command))
+
+  @pytest.mark.parametrize('command,value', [
+    ('1 + 2 * 3', 7),
+    ('-(1, 2, 3)', (3, 2, 1)),
+    ('"ab" + "cd" in "abcde"', True),
+    ('1 < 2 <= 2 and not False', True),
+    ('typeof 1.5', 'float'),
+    ('2 ** 10 - 24', 1000),
+    ('Undefined', optimizer.Undefined),
+  ])
+  def test_folded(self, command, value):
+    statement, = self.fold(command).children
+    assert statement.data == 'constant'
+    assert statement.children[0] == optimizer.Constant(value)
+
+  @pytest.mark.parametrize('command', [
+    '4d6h3 + 1', '@(1, 2, 3)', '><(1, 2, 3)', 'x + 1', 'roll::"1d4"',
+    '[1, 2] + 3', '1 + "a"', '2 ** 100000', '"a" * 1000000', '1 << 100000',
+  ])
+  def test_not_folded(self, command):
+    statement, = self.fold(command).children
+    assert statement.data != 'constant'
+
+  def test_literals_inside_dice(self):
+    tree = self.fold('4d6h3')
+    assert len(list(tree.find_data('scalar_die_highest'))) == 1
+    values = [c.children[0].value for c in tree.find_data('constant')]
+    assert values == [4, 6, 3]
+
+  def test_source_is_kept(self):
+    command = 'x = (a) -> a * (2 + 3) - "b" * 2'
+    tree = self.fold(command)
+    unfolded = TestConstantFolding.parser.parse(command)
+    assert len(list(tree.find_data('constant'))) == 2
+    assert parsing.decode_tree(parsing.encode_tree(tree)) == unfolded
+    function = Function('(a) -> a * (2 + 3) - "b" * 2')
+    assert function.src == '(a) -> a * (2 + 3) - "b" * 2'
+    assert function.code.children[0].data != 'constant'
+
+
+class TestParserBuildCache:
+  grammar = 'start: WORD\n%import common.WORD\n'
+  
+  def test_persisted_and_rebuilt_on_change(self, tmp_path, monkeypatch):
+    monkeypatch.setenv('ATROPOS_CONFIG', str(tmp_path))
+    options = {'start': 'start', 'parser': 'lalr'}
+    parsing.build_lark('word', self.grammar, **options)
+    assert parsing.build_log[-1]['cached'] is False
+    parser = parsing.build_lark('word', self.grammar, **options)
+    assert parsing.build_log[-1]['cached'] is True
+    assert parsing.build_log[-1]['build_seconds'] is not None
+    assert parser.parse('hello').children == ['hello']
+    
+    changed = self.grammar.replace('WORD', 'LETTER')
+    parsing.build_lark('word', changed, **options)
+    assert parsing.build_log[-1]['cached'] is False
+    assert len(os.listdir(tmp_path / 'parser_cache')) == 2
+    assert 'saved by cache' in parsing.startup_report()
+  
+  def test_earley_is_not_persisted(self, tmp_path, monkeypatch):
+    monkeypatch.setenv('ATROPOS_CONFIG', str(tmp_path))
+    parsing.build_lark('word', self.grammar, start='start', parser='earley')
+    assert parsing.build_log[-1]['cached'] is False
+    assert not os.path.exists(tmp_path / 'parser_cache')
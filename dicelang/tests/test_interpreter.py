@@ -1,7 +1,17 @@
 import pytest
+import random
 from dicelang.interpreter import Interpreter
+from dicelang.datastore   import DataStore
 from dicelang.function    import Function
 from dicelang.undefined   import Undefined
+from dicelang.machine     import Machine
+from dicelang.exceptions  import BudgetExceeded
+from dicelang.exceptions  import CallDepthError
+from dicelang.exceptions  import OperationError
+from dicelang.exceptions  import ResultTooLarge
+from dicelang.governor    import Budget
+from dicelang.visitor     import ENGINES
+from atropos_db.models    import Variable
 Skip = object
 files_to_test = ['block_comment.txt', 'comment_lines.txt']
 user = 10 
@@ -20,14 +30,245 @@ def get_lines(filename):
         cases.append((command, expected))
   return cases
 
-class TestInterpreter:
-  interpreter = Interpreter()
+@pytest.fixture(scope='class', params=ENGINES)
+def interpreter(request):
+  '''An interpreter for each execution engine in turn.'''
+  return Interpreter(engine=request.param)
 
+class TestInterpreter:
   @pytest.mark.parametrize("command, expected", get_lines('data/lines.txt'))
-  def test_lines(self, command, expected):
-    result = TestInterpreter.interpreter.execute(command, user, server)
+  def test_lines(self, interpreter, command, expected):
+    result = interpreter.execute(command, user, server)
     actual = result[0]
     predicate = actual == expected if expected is not Skip else True
     print(actual)
     assert predicate
 
+def get_corpus():
+  commands = [command for command, expected in get_lines('data/lines.txt')]
+  for filename in files_to_test:
+    with open(f'data/{filename}', 'r') as f:
+      commands.append(f.read())
+  return commands
+
+def run_corpus(interpreter, commands):
+  '''Execute every command in order from the same random seed, recording
+  the value and printout of each, or the class of the error it raised.'''
+  random.seed(0)
+  outcomes = [ ]
+  for command in commands:
+    try:
+      outcomes.append(repr(interpreter.execute(command, user, server)))
+    except Exception as e:
+      interpreter.get_print_queue_on_error(user)
+      outcomes.append(e.__class__.__name__)
+  return outcomes
+
+class TestEngineParity:
+  '''Differential test of the execution engines: the whole corpus is run
+  under the tree walker and then under each other engine, and every
+  command's outcome must agree, including random results and output.'''
+  commands = get_corpus()
+
+  @pytest.mark.parametrize("engine",
+    [engine for engine in ENGINES if engine != 'walker'])
+  def test_corpus(self, engine):
+    expected = run_corpus(Interpreter(engine='walker'), self.commands)
+    actual = run_corpus(Interpreter(engine=engine), self.commands)
+    mismatches = [(command, want, got) for command, want, got
+                  in zip(self.commands, expected, actual) if want != got]
+    assert mismatches == [ ]
+
+class TestMachine:
+  interpreter = Interpreter(engine='vm')
+  countdown = 'begin f = (g, n) -> 0 if n == 0 else 1 + g(g, n - 1); f(f, {}) end'
+
+  def test_deep_recursion(self):
+    command = TestMachine.countdown.format(2000)
+    assert TestMachine.interpreter.execute(command, user, server)[0] == 2000
+
+  def test_call_depth_limit(self):
+    machine = TestMachine.interpreter.visitor.machine
+    machine.max_call_depth = 100
+    command = TestMachine.countdown.format(500)
+    try:
+      with pytest.raises(CallDepthError):
+        TestMachine.interpreter.execute(command, user, server)
+    finally:
+      TestMachine.interpreter.get_print_queue_on_error(user)
+      machine.max_call_depth = Machine.max_call_depth
+
+
+class TestClosures:
+  @pytest.mark.parametrize("engine", ENGINES)
+  def test_only_free_names_are_captured(self, engine):
+    interpreter = Interpreter(engine=engine)
+    command = ('begin big = [1 to 1000]; k = 3; j = 4; '
+      '(y, j) -> y + k + j + this + (() -> big2)() end')
+    function = interpreter.execute(command, user, server)[0]
+    assert function.closed == [{'k': 3}]
+    command = 'begin f = (x) -> (y) -> x + y; f(2) end'
+    assert interpreter.execute(command, user, server)[0].closed == [{'x': 2}]
+
+
+class TestImports:
+  @pytest.mark.parametrize("engine", ENGINES)
+  def test_copies_share_until_changed(self, engine):
+    interpreter = Interpreter(engine=engine)
+    run = lambda command: interpreter.execute(command, user, server)[0]
+    try:
+      run('my import_lib = {"a": [1, [2, 3]], "f": (x) -> x + 1}')
+      run('import my import_lib as my import_copy')
+      cache = interpreter.datastore.cache
+      assert (cache.get(user, 'import_copy', 'private')
+        is cache.get(user, 'import_lib', 'private'))
+      run('my import_copy["a"][1][0] = 9')
+      run('del my import_lib["a"][0]')
+      assert run('my import_lib["a"]') == [[2, 3]]
+      assert run('my import_copy["a"]') == [1, [9, 3]]
+      assert run('my import_copy["f"](1)') == 2
+    finally:
+      run('del my import_lib')
+      run('del my import_copy')
+
+
+class TestUnitOfWork:
+  def stored(self, *names):
+    return sorted(Variable.objects.filter(owner_id=user, var_type='private',
+      name__in=names).values_list('name', flat=True))
+  
+  def test_command_is_written_at_once(self, monkeypatch):
+    interpreter = Interpreter()
+    batches = [ ]
+    write_batch = DataStore.write_batch
+    def spy(self, changes):
+      batches.append(sorted(name for owner, name, mode in changes))
+      write_batch(self, changes)
+    monkeypatch.setattr(DataStore, 'write_batch', spy)
+    interpreter.execute(
+      'my uow_a = 1; my uow_a = 2; my uow_b = 3; del my uow_a', user, server)
+    assert batches == [['_', '_', '_', 'uow_a', 'uow_b']]
+    assert self.stored('uow_a', 'uow_b') == ['uow_b']
+    interpreter.execute('del my uow_b', user, server)
+    assert self.stored('uow_a', 'uow_b') == [ ]
+  
+  def test_discarded_changes(self):
+    store = DataStore()
+    with store.unit_of_work():
+      store.put(user, 'uow_e', 1, 'private')
+      with store.unit_of_work(discard=True):
+        store.put(user, 'uow_e', 2, 'private')
+        store.put(user, 'uow_f', 3, 'private')
+        assert store.get(user, 'uow_e', 'private') == 2
+      assert store.get(user, 'uow_e', 'private') == 1
+      assert store.get(user, 'uow_f', 'private') is None
+    assert self.stored('uow_e', 'uow_f') == ['uow_e']
+    store.drop(user, 'uow_e', 'private')
+  
+  @pytest.mark.parametrize("engine", ENGINES)
+  def test_failed_command_changes_nothing(self, engine):
+    interpreter = Interpreter(engine=engine)
+    run = lambda command: interpreter.execute(command, user, server)[0]
+    try:
+      run('my uow_c = 1')
+      with pytest.raises(IndexError):
+        run('my uow_c = 2; del my uow_c; my uow_d = [1]; my uow_d[5]')
+      interpreter.get_print_queue_on_error(user)
+      assert run('my uow_c') == 1
+      assert run('my uow_d') is Undefined
+      assert self.stored('uow_c', 'uow_d') == ['uow_c']
+      interpreter.datastore.cache.drop(user, 'uow_c', 'private')
+      assert run('my uow_c') == 1
+    finally:
+      run('del my uow_c')
+
+
+class TestOdds:
+  @pytest.mark.parametrize("engine", ENGINES)
+  def test_estimated(self, engine, monkeypatch):
+    monkeypatch.setattr('dicelang.distribution.SAMPLES', 600)
+    interpreter = Interpreter(engine=engine)
+    odds, printout = interpreter.execute('?%((() -> 1d2 + 1)())', user, server)
+    assert set(odds) == {2, 3}
+    assert sum(odds.values()) == pytest.approx(1)
+    assert 0.4 < odds[2] < 0.6
+
+  def test_command(self):
+    interpreter = Interpreter()
+    dist = interpreter.odds('3d6 >= 11', user, server)
+    assert dist.exact and dist.probabilities() == {False: 0.5, True: 0.5}
+    dist = interpreter.odds('(() -> 1d4)() * 2', user, server)
+    assert not dist.exact and set(dist.weights) == {2, 4, 6, 8}
+
+  @pytest.mark.parametrize("engine", ENGINES)
+  def test_stores_nothing(self, engine, monkeypatch):
+    monkeypatch.setattr('dicelang.distribution.SAMPLES', 200)
+    interpreter = Interpreter(engine=engine)
+    run = lambda command: interpreter.execute(command, user, server)[0]
+    try:
+      run('my odds_n = 0')
+      dist = interpreter.odds(
+        'my odds_n = my odds_n + 1; my odds_m = 1d2; my odds_m + my odds_n',
+        user, server)
+      assert not dist.exact and set(dist.weights) == {2, 3}
+      assert run('my odds_n') == 0 and run('my odds_m') is Undefined
+      assert Interpreter().execute('my odds_n', user, server)[0] == 0
+      stored = Variable.objects.filter(owner_id=user, var_type='private',
+        name__startswith='odds_')
+      assert list(stored.values_list('name', flat=True)) == ['odds_n']
+    finally:
+      run('del my odds_n')
+
+class TestBudget:
+  loop = 'for i in [0 to 100] do i * 2'
+
+  @pytest.mark.parametrize("engine", ENGINES)
+  def test_units_are_reported(self, engine):
+    interpreter = Interpreter(engine=engine)
+    interpreter.execute(TestBudget.loop, user, server)
+    used = interpreter.budget.used
+    assert 2000 < used < 3000
+    assert interpreter.budget.checks == used // interpreter.budget.check_every
+    budget = Budget()
+    interpreter.execute(TestBudget.loop, user, server, budget)
+    assert interpreter.budget is budget and budget.used == used
+
+  @pytest.mark.parametrize("engine", ENGINES)
+  @pytest.mark.parametrize("command, units", [
+    ('1000d6', 1000),
+    ('[1, 2] * 8000', 1000),
+    ('[0 to 16000]', 1000),
+    ('2 ** 100000 * 3 ** 100000 > 1', 1000),
+  ])
+  def test_weighted_operations(self, engine, command, units):
+    interpreter = Interpreter(engine=engine)
+    interpreter.execute(command, user, server)
+    assert interpreter.budget.used > units
+
+  @pytest.mark.parametrize("engine", ENGINES)
+  @pytest.mark.parametrize("command, error", [
+    ('[1 to 2 by 0]', OperationError),
+    ('&[1.5 to 10 ** 8]', ResultTooLarge),
+  ])
+  def test_ranges_are_refused(self, engine, command, error):
+    interpreter = Interpreter(engine=engine)
+    with pytest.raises(error):
+      interpreter.execute(command, user, server)
+    interpreter.get_print_queue_on_error(user)
+    assert interpreter.budget.used < 100
+
+  @pytest.mark.parametrize("engine", ENGINES)
+  def test_exceeded(self, engine):
+    interpreter = Interpreter(engine=engine, units=500)
+    try:
+      with pytest.raises(BudgetExceeded):
+        interpreter.execute(TestBudget.loop, user, server)
+      interpreter.get_print_queue_on_error(user)
+      assert 500 < interpreter.budget.used < 550
+      with pytest.raises(BudgetExceeded):
+        interpreter.execute('100d6 + 1000d6', user, server)
+      interpreter.get_print_queue_on_error(user)
+      assert interpreter.budget.used < 2000
+      interpreter.execute(TestBudget.loop, user, server, Budget())
+    finally:
+      interpreter.get_print_queue_on_error(user)
@@ -0,0 +1,476 @@
+import math
+import random
+import pytest
+import statistics
+import itertools
+from collections import Counter
+from fractions import Fraction
+from dicelang import distribution
+from dicelang import governor
+from dicelang import optimizer
+from dicelang import reductions
+from dicelang import sumtables
+from dicelang import util
+from dicelang.parsing import Parser
+from dicelang.exceptions import DiceRollTimeout
+from dicelang.exceptions import OperationError
+from dicelang.exceptions import ResultTooLarge
+
+needs_numpy = pytest.mark.skipif(util.numpy is None, reason='needs NumPy')
+forever = governor.Budget()
+expired = governor.Budget(seconds=-1)
+
+def chi_square(a, b):
+  '''The two-sample chi-square statistic for the hypothesis that samples `a`
+  and `b` come from the same distribution, and its degrees of freedom.
+  Outcomes too rare to test individually are counted together.'''
+  counts_a, counts_b = Counter(a), Counter(b)
+  bins, rare = [ ], [0, 0]
+  for outcome in set(counts_a) | set(counts_b):
+    pair = [counts_a[outcome], counts_b[outcome]]
+    if sum(pair) < 20:
+      rare = [rare[0] + pair[0], rare[1] + pair[1]]
+    else:
+      bins.append(pair)
+  if sum(rare):
+    bins.append(rare)
+  n, m = len(a), len(b)
+  statistic = 0.0
+  for x, y in bins:
+    expected_x = (x + y) * n / (n + m)
+    expected_y = (x + y) * m / (n + m)
+    statistic += (x - expected_x) ** 2 / expected_x
+    statistic += (y - expected_y) ** 2 / expected_y
+  return statistic, len(bins) - 1
+
+def critical_value(df, z=3.72):
+  '''Approximate chi-square critical value at p = 0.0001 (Wilson-Hilferty).'''
+  k = 2 / (9 * df)
+  return df * (1 - k + z * math.sqrt(k)) ** 3
+
+
+@needs_numpy
+class TestVectorRoll:
+  @pytest.mark.parametrize('dice,sides,count,mode,as_sum', [
+    (3, 6, None, 'all', True),
+    (4, 6, 3, 'highest', True),
+    (5, 4, 2, 'lowest', True),
+    (10, 4, 3, 'highest', False),
+    (10, 4, 3, 'lowest', False),
+    (3, 5, None, 'all', False),
+    (200, 20, 5, 'highest', True),
+  ])
+  def test_same_distribution_as_scalar(self, dice, sides, count, mode, as_sum):
+    random.seed(1)
+    args = (dice, sides, count, mode, as_sum, forever)
+    scalar = [repr(util.scalar_roll(*args)) for i in range(10000)]
+    vector = [repr(util.vector_roll(*args)) for i in range(10000)]
+    statistic, df = chi_square(scalar, vector)
+    assert df > 0
+    assert statistic < critical_value(df)
+
+  def test_faces_are_uniform(self):
+    random.seed(2)
+    faces = util.vector_roll(60000, 6, None, 'all', False, forever)
+    assert set(faces) == {1, 2, 3, 4, 5, 6}
+    statistic, df = chi_square(faces, [1, 2, 3, 4, 5, 6] * 10000)
+    assert statistic < critical_value(df)
+
+  @pytest.mark.parametrize('count', [0, 1, 7, 10, 25, -3, -10, -30])
+  @pytest.mark.parametrize('mode', ['highest', 'lowest'])
+  def test_kept_dice_match_sorting(self, mode, count):
+    rolls = util.vector_roll(10, 6, count, mode, False, forever)
+    expected = sorted(rolls, reverse=mode == 'highest')
+    assert rolls == expected
+    assert len(rolls) == len(range(10)[:count])
+
+  def test_spans_chunks(self, monkeypatch):
+    monkeypatch.setattr(util, 'VECTOR_CHUNK_SIZE', 100)
+    rolls = util.vector_roll(1050, 1000, 30, 'highest', False, forever)
+    assert len(rolls) == 30 and rolls == sorted(rolls, reverse=True)
+    assert util.vector_roll(1050, 1, None, 'all', True, forever) == 1050
+    assert util.vector_roll(1050, 1, None, 'all', False, forever) == [1] * 1050
+
+  def test_results_are_python_ints(self):
+    assert type(util.vector_roll(5, 6, None, 'all', True, forever)) is int
+    rolls = util.vector_roll(5, 6, 2, 'lowest', False, forever)
+    assert all(type(r) is int for r in rolls)
+
+  def test_timeout(self):
+    with pytest.raises(DiceRollTimeout):
+      util.vector_roll(1000, 6, None, 'all', True, expired)
+
+  def test_used_for_large_pools(self, monkeypatch):
+    monkeypatch.setattr(util, 'vector_roll', lambda *args: 'vector')
+    monkeypatch.setattr(util, 'VECTOR_POOL_SIZE', 50)
+    assert util.roll(50, 6, None, 'all', True, forever) == 'vector'
+    assert util.roll(49, 6, None, 'all', True, forever) != 'vector'
+    with pytest.raises(ValueError):
+      util.roll(50, 0, None, 'all', True, forever)
+    with pytest.raises(TypeError):
+      util.roll(50.0, 6, None, 'all', True, forever)
+
+
+class TestSumTables:
+  @pytest.mark.parametrize('dice,sides', [(1, 6), (8, 6), (16, 3), (4, 20)])
+  def test_tables_count_every_roll(self, dice, sides):
+    cumulative = sumtables.SumTables(1 << 20).get(dice, sides, forever)
+    ways = distribution.sum_of_dice(dice, sides)
+    assert cumulative[-1] == sides ** dice
+    assert dict(zip(range(dice, dice * sides + 1), cumulative)) == {
+      total: sum(w for t, w in ways.items() if t <= total) for total in ways}
+
+  @pytest.mark.parametrize('dice,sides', [(64, 6), (100, 4), (333, 20)])
+  def test_same_distribution_as_scalar(self, dice, sides):
+    random.seed(3)
+    block = sumtables.block_size(dice, sides)
+    assert block >= sumtables.MIN_BLOCK
+    scalar = [util.scalar_roll(dice, sides, None, 'all', True, forever)
+      for i in range(5000)]
+    table = [util.table_roll(dice, sides, block, forever) for i in range(5000)]
+    statistic, df = chi_square(scalar, table)
+    assert df > 0
+    assert statistic < critical_value(df)
+
+  def test_draws_span_every_sum(self):
+    tables = sumtables.SumTables(1 << 20)
+    sums = Counter(tables.roll(9, 2, 8, forever) for i in range(5000))
+    assert set(sums) == set(range(9, 19))
+
+  def test_least_recently_used_is_evicted(self):
+    sizes = sumtables.SumTables(1 << 20)
+    sizes.get(4, 6, forever)
+    tables = sumtables.SumTables(sizes.tables[2, 6][1] + sizes.tables[4, 6][1])
+    tables.get(4, 6, forever)
+    assert list(tables.tables) == [(2, 6), (4, 6)]
+    tables.get(2, 6, forever)
+    tables.get(1, 6, forever)
+    assert list(tables.tables) == [(2, 6), (1, 6)]
+    assert tables.bytes <= tables.max_bytes
+    tables.max_bytes = 0
+    tables.clear()
+    assert tables.get(8, 6, forever)[-1] == 6 ** 8
+    assert len(tables) == 0 and tables.bytes == 0
+
+  def test_timeout(self):
+    with pytest.raises(DiceRollTimeout):
+      sumtables.SumTables(1 << 20).roll(10000, 6, 64, expired)
+
+  def test_used_for_large_sums(self, monkeypatch):
+    monkeypatch.setattr(util, 'table_roll', lambda *args: 'table')
+    assert util.roll(64, 6, None, 'all', True, forever) == 'table'
+    assert util.roll(63, 6, None, 'all', True, forever) != 'table'
+    assert util.roll(64, 6, None, 'all', False, forever) != 'table'
+    assert util.roll(64, 6, 3, 'highest', True, forever) != 'table'
+    assert util.roll(64, 10 ** 6, None, 'all', True, forever) != 'table'
+
+
+class TestLimits:
+  @pytest.mark.parametrize('mantissa,exponent', [
+    (2, 10), (3, 1), (-3, 7), (7, 100), (10, 1000), (True, 5), (0, 9),
+    (1, 10 ** 30), (-1, 10 ** 30 + 1), (2, -3), (-2, -5), (2.5, 9),
+    (-1.5, 4), (1j, 3), (1.0001, 10 ** 6),
+  ])
+  def test_power_matches_python(self, mantissa, exponent):
+    out = util.exponent(mantissa, exponent, forever)
+    expected = mantissa ** exponent
+    assert out == pytest.approx(expected) and type(out) is type(expected)
+
+  @pytest.mark.parametrize('mantissa', [2, 3, 255, -17, 10 ** 50])
+  def test_power_bits(self, mantissa):
+    for exponent in (1, 2, 63, 1000):
+      actual = (mantissa ** exponent).bit_length()
+      assert abs(governor.power_bits(mantissa, exponent) - actual) <= 1
+
+  @pytest.mark.parametrize('text, expected', [
+    ('1000', 1000), (' 25 ', 25), ('', None), ('none', None), ('None', None),
+    ('0', None),
+  ])
+  def test_parse_units(self, text, expected):
+    assert governor.parse_units(text) == expected
+
+  def test_power_is_refused_before_it_is_built(self):
+    budget = governor.Budget()
+    with pytest.raises(ResultTooLarge):
+      util.exponent(3, 10 ** 7, budget)
+    with pytest.raises(ResultTooLarge):
+      util.exponent(2, 10 ** 100, budget)
+    assert budget.used == 0
+    assert util.exponent(2, governor.MAX_BITS - 1, budget) > 0
+    assert budget.used > 0
+
+  def test_reciprocal_of_large_power_is_zero(self):
+    assert util.exponent(3, -10 ** 7, forever) == 0.0
+    assert math.copysign(1, util.exponent(-3, -10 ** 7 - 1, forever)) == -1
+    assert math.copysign(1, util.exponent(-3, -10 ** 7, forever)) == 1
+
+  def test_shift_and_repetition_are_refused(self):
+    with pytest.raises(ResultTooLarge):
+      util.shift(1, governor.MAX_BITS)
+    assert util.shift(1, governor.MAX_BITS - 1) == 1 << governor.MAX_BITS - 1
+    assert util.shift(1, 10 ** 100, left_shift=False) == 0
+    with pytest.raises(ResultTooLarge):
+      util.multiplication([1, 2], governor.MAX_LENGTH, forever)
+    with pytest.raises(ResultTooLarge):
+      util.multiplication(-governor.MAX_LENGTH, 'ab')
+    assert len(util.multiplication([1, 2], governor.MAX_LENGTH // 2)) == (
+      governor.MAX_LENGTH)
+    large = 1 << governor.MAX_BITS // 2
+    with pytest.raises(ResultTooLarge):
+      util.multiplication(large, large)
+
+
+class TestLazyRange:
+  @pytest.mark.parametrize('closed', [False, True])
+  @pytest.mark.parametrize('start,stop,step', [
+    (0, 10, 1), (10, 0, 1), (0, 10, -3), (-5, 5, 4), (3, 3, 1), (3, 3, -1),
+    (10 ** 20, 10 ** 20 + 7, 2),
+  ])
+  def test_same_elements_as_list(self, closed, start, stop, step):
+    lazy = util.lazy_range(closed, start, stop, step)
+    listed = util.range_list(closed, start, stop, step)
+    assert isinstance(lazy, range) and list(lazy) == listed
+    assert util.length(lazy) == len(listed)
+    assert util.sum_or_join(lazy) == util.sum_or_join(listed)
+    assert util.sliced(lazy, slice(1, None, 2)) == listed[1::2]
+
+  def test_only_integers_are_lazy(self):
+    assert util.lazy_range(False, 0, 1, 0.25) == [0, 0.25, 0.5, 0.75]
+    assert util.lazy_range(True, True, 3) == [True, 2, 3]
+    with pytest.raises(ResultTooLarge):
+      util.lazy_range(False, 0, 10 ** 30)
+
+  def test_zero_step_is_refused(self):
+    budget = governor.Budget()
+    for build in (util.lazy_range, util.range_list):
+      for start, stop, step in [(1, 2, 0), (3, 3, 0), (0.5, 2, 0.0)]:
+        with pytest.raises(OperationError):
+          build(True, start, stop, step, budget)
+    assert budget.used == 0
+
+  def test_float_ranges_are_limited(self):
+    budget = governor.Budget()
+    assert util.range_list(False, 0.5, 2, budget=budget) == [0.5, 1.5]
+    assert util.range_list(False, 0.5, 2.5, 10, budget) == [0.5]
+    assert util.range_list(False, 0.5, 2.5, math.nan, budget) == [0.5]
+    for stop in (10 ** 8, math.inf):
+      with pytest.raises(ResultTooLarge):
+        util.range_list(True, 1.5, stop, budget=budget)
+    assert budget.used < 10
+
+  def test_long_ranges_take_no_memory(self):
+    lazy = util.lazy_range(True, 1, 10 ** 15)
+    assert util.length(lazy) == 10 ** 15 and 10 ** 14 in lazy
+    assert util.sum_or_join(lazy) == 10 ** 15 * (10 ** 15 + 1) // 2
+    with pytest.raises(ResultTooLarge):
+      util.range_list(True, 1, 10 ** 15)
+
+
+class TestReductions:
+  @pytest.mark.parametrize('rule,reduce', [
+    ('sum_or_join', util.sum_or_join), ('length', util.length),
+    ('minimum', lambda results: util.extremum(results, 'minimum')),
+    ('maximum', lambda results: util.extremum(results, 'maximum')),
+    ('stats', util.stats),
+  ])
+  @pytest.mark.parametrize('results', [
+    [3, 1, 2, 3, 1], [2.5, 1, True, 2.5], [[1], [2, 3]], ['a', 'bc'], [7],
+  ])
+  def test_same_as_reducing_list(self, rule, reduce, results):
+    accumulator = reductions.accumulators[rule]()
+    for result in results:
+      accumulator.append(result)
+    try:
+      expected = reduce(list(results))
+    except Exception as e:
+      with pytest.raises(type(e)):
+        accumulator.value()
+    else:
+      assert accumulator.value() == expected
+
+  def test_errors_wait_for_the_loop(self):
+    accumulator = reductions.Sum()
+    for result in [1, 'a', 2]:
+      accumulator.append(result)
+    with pytest.raises(TypeError):
+      accumulator.value()
+    with pytest.raises(ValueError):
+      reductions.Maximum().value()
+
+  def test_stats_of_tally(self):
+    rng = random.Random(16)
+    for trial in range(200):
+      results = [rng.randint(-20, 20) for i in range(rng.randint(4, 30))]
+      assert util.stats_of_tally(Counter(results)) == util.stats(results)
+
+  @pytest.mark.parametrize('value', [
+    Fraction(2), Fraction(1, 3), Fraction(10 ** 40 + 1, 7), Fraction(0),
+  ])
+  def test_sqrt_of_fraction(self, value):
+    assert util.sqrt_of_fraction(value) == math.sqrt(value) or (
+      abs(util.sqrt_of_fraction(value) - math.sqrt(value)) <= math.ulp(math.sqrt(value)))
+
+
+class TestListPrimitives:
+  @pytest.mark.parametrize('turns', [0, 1, 2, 3, 7, -1])
+  def test_shift_rotates(self, turns):
+    items = [1, 2, 3]
+    left, right = items[:], items[:]
+    for i in range(turns):
+      left.insert(0, left.pop())
+      right.append(right.pop(0))
+    assert util.shift(items, turns) == left
+    assert util.shift(items, turns, left_shift=False) == right
+    assert items == [1, 2, 3]
+
+  def test_shift_by_many_turns(self):
+    assert util.shift([1, 2, 3], 10 ** 18) == [3, 1, 2]
+    assert util.shift([1, 2, 3], 10 ** 18, left_shift=False) == [2, 3, 1]
+    assert util.shift([], 5) == [ ]
+
+  def test_flatten_deep(self):
+    nested = [ ]
+    for i in range(100000):
+      nested = [i, (nested,)]
+    assert util.flatten(nested) == list(range(99999, -1, -1))
+    assert len(nested) == 2
+
+  def test_flatten_keeps_type(self):
+    assert util.flatten(([1, (2,)], [ ], 3)) == (1, 2, 3)
+    assert util.flatten('abc') == 'abc'
+
+  def test_negative_repetition(self):
+    assert util.iterable_repetition([1, 2], -2) == [2, 1, 2, 1]
+    assert util.iterable_repetition('ab', -2) == 'baba'
+    assert util.iterable_repetition((1, 2), 0) == ()
+
+
+def reference_stats(operand):
+  '''The number summary as `util.stats` computed it with one pass of the
+  `statistics` module per field.'''
+  out = { }
+  out['average'] = statistics.mean(operand)
+  out['minimum'] = min(operand)
+  out['median' ] = statistics.median(operand)
+  out['maximum'] = max(operand)
+  out['size'   ] = len(operand)
+  out['sum'    ] = sum(operand)
+  out['stddev' ] = statistics.pstdev(operand, out['average'])
+  out['q1'] = statistics.median([v for v in operand if v < out['median']])
+  out['q3'] = statistics.median([v for v in operand if v > out['median']])
+  return out
+
+
+class TestStats:
+  samples = [
+    lambda rng: [rng.randint(1, 6) for i in range(rng.randint(4, 60))],
+    lambda rng: [rng.randint(-10 ** 20, 10 ** 20) for i in range(9)],
+    lambda rng: [rng.random() * 100 - 50 for i in range(rng.randint(4, 60))],
+    lambda rng: [rng.choice([0.0, -0.0, 1, 1.0, True, 2.5]) for i in range(9)],
+    lambda rng: [rng.choice([math.nan, 1.0, 2.0, 3]) for i in range(9)],
+    lambda rng: [rng.choice([1e308, -1e308, 2.0]) for i in range(9)],
+    lambda rng: [10 ** 400, 1, 0, 2],
+  ]
+
+  @pytest.mark.parametrize('vector', [None, 1])
+  @pytest.mark.parametrize('sample', range(len(samples)))
+  def test_same_as_statistics(self, monkeypatch, vector, sample):
+    if vector:
+      monkeypatch.setattr(util, 'VECTOR_STATS_SIZE', vector)
+    rng = random.Random(sample)
+    for trial in range(50):
+      operand = self.samples[sample](rng)
+      try:
+        expected = repr(reference_stats(operand))
+      except Exception as e:
+        with pytest.raises(type(e)):
+          util.stats(operand)
+      else:
+        assert repr(util.stats(operand)) == expected
+
+  def test_without_numpy(self, monkeypatch):
+    monkeypatch.setattr(util, 'numpy', None)
+    operand = [random.randint(1, 20) for i in range(10000)]
+    assert util.stats(operand) == reference_stats(operand)
+
+
+def enumerate_odds(pools, combine=sum):
+  '''The exact odds of `combine` applied to every way of rolling each pool of
+  `(dice, sides, count, mode)`, counted by brute force.'''
+  counts = Counter()
+  faces = [ ]
+  for dice, sides, count, mode in pools:
+    faces.extend([range(1, sides + 1)] * dice)
+  for roll in itertools.product(*faces):
+    totals, start = [ ], 0
+    for dice, sides, count, mode in pools:
+      pool = sorted(roll[start:start + dice], reverse=mode == 'highest')
+      totals.append(sum(pool[:count] if mode != 'all' else pool))
+      start += dice
+    counts[combine(totals)] += 1
+  size = sum(counts.values())
+  return {outcome: Fraction(n, size) for outcome, n in counts.items()}
+
+def as_fractions(dist):
+  return {k: Fraction(w, dist.total) for k, w in dist.weights.items()}
+
+
+class TestDistribution:
+  parser = Parser('lalr')
+
+  def exact(self, command):
+    tree = optimizer.fold(TestDistribution.parser.parse(command))
+    return distribution.exact(tree)
+
+  @pytest.mark.parametrize('pool', [
+    (3, 6, None, 'all'), (4, 6, 3, 'highest'), (5, 4, 2, 'lowest'),
+    (6, 3, 4, 'highest'), (4, 4, -1, 'highest'), (3, 5, -5, 'lowest'),
+    (4, 6, 0, 'highest'), (2, 6, 9, 'lowest'),
+  ])
+  def test_dice_match_enumeration(self, pool):
+    expected = enumerate_odds([pool])
+    assert as_fractions(distribution.dice_distribution(*pool)) == expected
+
+  @pytest.mark.parametrize('command,pools,combine', [
+    ('4d6h3', [(4, 6, 3, 'highest')], sum),
+    ('&5r4l2', [(5, 4, 2, 'lowest')], sum),
+    ('3d6 >= 10', [(3, 6, None, 'all')], lambda t: t[0] >= 10),
+    ('1d8 - 2d4', [(1, 8, None, 'all'), (2, 4, None, 'all')],
+      lambda t: t[0] - t[1]),
+    ('1d6 * 1d6', [(1, 6, None, 'all')] * 2, lambda t: t[0] * t[1]),
+  ])
+  def test_expressions_match_enumeration(self, command, pools, combine):
+    assert as_fractions(self.exact(command)) == enumerate_odds(pools, combine)
+
+  def test_dice_of_dice(self):
+    expected = Counter()
+    for dice in (1, 2, 3):
+      for outcome, p in enumerate_odds([(dice, 4, None, 'all')]).items():
+        expected[outcome] += p / 3
+    assert as_fractions(self.exact('(1d3)d4')) == dict(expected)
+
+  @pytest.mark.parametrize('command', [
+    'x + 1d6', '@(1, 2, 3)', '><(1, 2, 3)', '4r6', 'f(1d6)', '1d6 + "a"',
+  ])
+  def test_not_exact(self, command):
+    assert self.exact(command) is None
+
+  def test_large_problems_are_estimated(self, monkeypatch):
+    monkeypatch.setattr(distribution, 'BUDGET', 1000)
+    with pytest.raises(distribution.NotAnalytic):
+      distribution.dice_distribution(100, 20, 50, 'highest')
+    assert self.exact('100d20h50 + 0') is None
+
+  def test_estimate(self):
+    dist = distribution.estimate([1, 2, 2, [3, 4], [3, 4]])
+    assert not dist.exact and dist.samples == 5
+    assert dist.probabilities() == {1: 0.2, 2: 0.4, (3, 4): 0.4}
+    with pytest.raises(distribution.OperationError):
+      distribution.estimate([{'a': 1}])
+
+  def test_summary_and_table(self):
+    dist = self.exact('2d6')
+    assert dist.exact and dist.total == 36
+    assert dist.summary() == 'Exact odds, mean 7'
+    lines = dist.table().splitlines()
+    assert len(lines) == 11 and lines[5].startswith(' 7  16.667% ')
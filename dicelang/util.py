@@ -1,9 +1,52 @@
-import time
+import os
+import bisect
+import copy
+import itertools
+import math
+import re
 import random
 import numbers
+import operator
+import statistics
+import sys
 
-from dicelang.function import Function
+from collections import Counter
+from collections.abc import Iterable
+from collections.abc import Sequence
+from fractions import Fraction
+
+from dicelang.float_special import inf
+from dicelang.float_special import nan
+from dicelang import function
+from dicelang import governor
+from dicelang import sumtables
 from dicelang.exceptions import DiceRollTimeout
+from dicelang.exceptions import ExponentiationTimeout
+from dicelang.exceptions import OperationError
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# Pools of at least this many dice are rolled with NumPy when it is installed.
+# Smaller pools are cheaper to roll one die at a time.
+VECTOR_POOL_SIZE = int(os.environ.get('DICELANG_VECTOR_POOL', 128))
+
+# Dice drawn by NumPy at once, between checks of the clock.
+VECTOR_CHUNK_SIZE = 1 << 20
+
+# Bounds within which sums of NumPy dice cannot overflow 64-bit integers.
+VECTOR_MAX_DICE = 1 << 30
+VECTOR_MAX_SIDES = 1 << 32
+
+# Summaries of at least this many integers are sorted with NumPy when it is
+# installed.
+VECTOR_STATS_SIZE = int(os.environ.get('DICELANG_VECTOR_STATS', 4096))
+
+# Memory given to tables for drawing the sums of large pools of dice.
+SUM_TABLE_BYTES = int(os.environ.get('DICELANG_SUM_TABLE_BYTES', 64 << 20))
+sum_tables = sumtables.SumTables(SUM_TABLE_BYTES)
 
 def is_noninteger(x):
   '''Used to detect float and complex numbers as numbers.Real will also
@@ -16,7 +59,7 @@ def is_nonkey(x):
   '''We don't allow dicts to be keyed by these non-hashable objects.
   This function is used instead to allow the Visitor to raise a more
   useful error for users than Python would raise itself.'''
-  return isinstance(x, (dict, list, Function))
+  return isinstance(x, (dict, list, function.Function))
 
 def addition(left, right):
   '''Adds special rules to auto-box scalar items when they are added to
@@ -32,6 +75,175 @@ def addition(left, right):
     out = left + right
   return out
 
+def subtraction(minuend, subtrahend):
+  '''Normal subtraction, as well as list element/dict key removal.'''
+  try:
+    result = minuend - subtrahend
+  except TypeError as e:
+    result = minuend[:]
+    try:
+      for x in subtrahend:
+        if x in minuend:
+          result.remove(x)
+    except:
+      raise OperationError(str(e))
+  return result
+
+def catenation(*numbers):
+  '''Joins two numbers via their representation of digit strings.'''
+  intstrings = map(lambda x: str(int(x)), numbers)
+  return int(''.join(intstrings))
+
+def multiplication(factor1, factor2, budget=None):
+  '''Multiplication of numerics and the repetition of ordered iterables. The
+  work is charged to `budget`, if given, before it is done.'''
+  if isinstance(factor1, Sequence) and isinstance(factor2, numbers.Number):
+    factor1, factor2 = factor2, factor1
+  if isinstance(factor1, numbers.Number) and isinstance(factor2, Sequence):
+    length = len(factor2) * abs(factor1)
+    if isinstance(length, int):
+      governor.limit_length(length, 'Repetition')
+    if budget is not None:
+      budget.spend(governor.elements(length))
+    out = iterable_repetition(factor2, factor1)
+  else:
+    if type(factor1) is int and type(factor2) is int:
+      units = governor.product(factor1, factor2)
+      if units:
+        bits = factor1.bit_length() + factor2.bit_length()
+        governor.limit_bits(bits, 'Multiplication')
+        if budget is not None:
+          budget.spend(units)
+    out = factor1 * factor2
+  return out
+
+def division(dividend, divisor):
+  '''Ordinary floating point division, giving a signed infinity for a
+  zero divisor.'''
+  if divisor == 0:
+    sign = 1 if dividend >= 0 else -1
+    sign *= 1 if divisor >= 0 else -1
+    out = sign * inf
+  else:
+    out = dividend / divisor
+  return out
+
+def remainder(dividend, divisor):
+  '''Remainder for float or int.'''
+  if divisor == 0 and isinstance(dividend, numbers.Number):
+    out = nan
+  else:
+    out = dividend % divisor
+  return out
+
+def floor_division(dividend, divisor):
+  '''Divide and always round down, returning integer.'''
+  if divisor == 0:
+    sign = 1 if dividend >= 0 else -1
+    sign *= 1 if divisor >= 0 else -1
+    out = sign * inf
+  else:
+    out = dividend // divisor
+  return out
+
+def negation(operand):
+  '''The arithmetic inverse of a numeric value, or the reverse of some
+  ordered iterable.'''
+  if isinstance(operand, Sequence):
+    out = operand[::-1]
+  else:
+    out = -operand
+  return out
+
+def real_part_or_nop(operand):
+  '''The real part of a complex number; no-op on anything else.'''
+  if isinstance(operand, numbers.Complex):
+    out = operand.real
+  else:
+    out = operand
+  return out
+
+def exponent(mantissa, exponent, budget):
+  '''Exponents are strictly numeric (for now). An integer power too large to
+  build is refused before any work is done. Otherwise, integer exponents are
+  raised by repeated squaring, charging each product to `budget`.'''
+  if is_noninteger(exponent) and isinstance(mantissa, numbers.Number):
+    out = mantissa ** exponent
+  elif (isinstance(exponent, numbers.Integral)
+      and isinstance(mantissa, numbers.Number)):
+    if exponent != 0:
+      bits = 0
+      if isinstance(mantissa, int):
+        bits = governor.power_bits(mantissa, abs(exponent))
+      if exponent < 0 and bits > governor.MAX_BITS:
+        # The reciprocal of so large a power is zero as a float.
+        out = -0.0 if mantissa < 0 and exponent % 2 else 0.0
+      else:
+        governor.limit_bits(bits, 'Exponentiation')
+        out = power(mantissa, abs(exponent), budget)
+        if exponent < 0:
+          out = 1 / out
+    else:
+      if mantissa == 0:
+        out = nan
+      else:
+        out = 1 # nonzero to the power zero is always 1
+  else:
+    raise OperationError('Operands to exponentiation (**) must be numeric!')
+  return out
+
+def power(mantissa, exponent, budget):
+  '''`mantissa` to the positive integer `exponent`, by binary exponentiation:
+  the mantissa is squared once for each binary digit of the exponent, and
+  multiplied into the result for each digit that is set.'''
+  integral = isinstance(mantissa, int)
+  out = 1
+  square = mantissa
+  while True:
+    if exponent & 1:
+      units = 1 + governor.product(out, square) if integral else 1
+      budget.spend(units, ExponentiationTimeout)
+      out = out * square
+    exponent >>= 1
+    if not exponent:
+      return out
+    units = 1 + governor.product(square, square) if integral else 1
+    budget.spend(units, ExponentiationTimeout)
+    square = square * square
+
+def logarithm(base, exponent):
+  '''Logarithm is overloaded with a format syntax in analogy with `%` being
+  overloaded with an interpolation syntax.'''
+  if isinstance(base, str):
+    out = string_format(base, exponent)
+  else:
+    out = math.log(exponent, base)
+  return out
+
+def chained_comparison(operands_and_operators):
+  '''Evaluates alternating operands and comparison operators the way Python
+  evaluates chained comparisons, for both the mathematical comparisons and
+  the identity comparisons.'''
+  out = False
+  for i in range(0, len(operands_and_operators)-2, 2):
+    left, op, right = operands_and_operators[i:i+3]
+    if not comparisons[op](left, right):
+      break
+  else:
+    out = True
+  return out
+
+comparisons = {
+  '=='     : lambda l, r: l == r,
+  '!='     : lambda l, r: l != r,
+  '>='     : lambda l, r: l >= r,
+  '<='     : lambda l, r: l <= r,
+  '>'      : lambda l, r: l  > r,
+  '<'      : lambda l, r: l  < r,
+  'is'     : lambda l, r: l is r,
+  'is not' : lambda l, r: l is not r,
+}
+
 def shift(left, right, left_shift=True):
   '''Adds special rules for 'bitwise shift' operators. When the left operand is
   a list and the right is an int, this "rotates" the list. Left shifts pop from
@@ -45,19 +257,17 @@ def shift(left, right, left_shift=True):
   Otherwise, shift normally, possibly raising an exception.'''
   out = None
   if isinstance(left, list) and isinstance(right, int):
-    copy = left[:]
+    # Whole turns of the list leave it as it was, so only what remains of
+    # them is rotated, by joining the two slices either side of the cut.
+    turns = right % len(left) if left and right > 0 else 0
     if left_shift:
-      for i in range(right):
-        p = copy.pop()
-        copy.insert(0, p)
-    else:
-      for i in range(right):
-        p = copy.pop(0)
-        copy.append(p)
-    out = copy
+      turns = -turns
+    out = left[turns:] + left[:turns]
   elif isinstance(left, float) and isinstance(right, int):
     out = round(left, right)
   else:
+    if left_shift and isinstance(left, int) and isinstance(right, int):
+      governor.limit_bits(left.bit_length() + right, 'Shifting')
     out = left << right if left_shift else left >> right
   return out
 
@@ -65,27 +275,48 @@ def iterable_repetition(iterable, repetitions):
   '''Defines the case for when an iterable is multiplied by a number.
   The normal python repetition rules apply for positive numbers, and
   for negatives, the iterable is reversed first.'''
-  times = abs(repetitions)
-  sign  = repetitions / times if times else 1
-  if sign == 1:
-    out = iterable * times
-  else:
-    out = (iterable[::-1]) * times
-  return out
+  if repetitions < 0:
+    # The operand is reversed once, before it is repeated, which copies
+    # fewer elements than reversing the repeated result.
+    iterable = iterable[::-1]
+  return iterable * abs(repetitions)
 
-def roll(dice, sides, count, mode, return_sum, must_finish_by):
+def roll(dice, sides, count, mode, return_sum, budget):
   '''Rolls `dice` dice each with `sides` sides numbered `1` through `sides`.
   When `mode` is "highest", the highest `count` dice are kept; when `mode`
   is "lowest", the lowest `count` dice are kept; oetherwise, all dice are
   kept. `return_sum` is a boolean which causes the dice to be summed if True
-  and returned as a list of individual rolls otherwise. `must_finish_by` is
-  a time in seconds since the epoch by which the die rolling loop must finish
-  executing or else time out.'''
+  and returned as a list of individual rolls otherwise. Every die is charged
+  to `budget` before any is rolled, and the clock is checked as they are.
+  
+  The sums of large pools of which every die is kept are drawn from tables
+  by `table_roll`. Other large pools are rolled by `vector_roll` when NumPy
+  is available.'''
+  integral = isinstance(dice, int) and isinstance(sides, int)
+  if integral:
+    budget.spend(governor.dice(dice), DiceRollTimeout)
+  large = integral and dice >= sumtables.MIN_BLOCK ** 2
+  if large and mode == 'all' and return_sum and sides >= 1:
+    block = sumtables.block_size(dice, sides)
+    if block >= sumtables.MIN_BLOCK:
+      return table_roll(dice, sides, block, budget)
+  vectorize = (numpy is not None and integral
+    and VECTOR_POOL_SIZE <= dice <= VECTOR_MAX_DICE
+    and 1 <= sides <= VECTOR_MAX_SIDES)
+  if vectorize:
+    return vector_roll(dice, sides, count, mode, return_sum, budget)
+  return scalar_roll(dice, sides, count, mode, return_sum, budget)
+
+def scalar_roll(dice, sides, count, mode, return_sum, budget):
+  '''Rolls dice one at a time, as described for `roll`, checking the clock
+  between batches of dice.'''
   results = []
-  for die in range(dice):
-    if time.time() > must_finish_by:
-      raise DiceRollTimeout('Took too long rolling dice!')
-    results.append(random.randint(1, sides))
+  batch = governor.CHECK_EVERY
+  for start in range(0, dice, batch):
+    if start:
+      budget.check(DiceRollTimeout)
+    results.extend([random.randint(1, sides)
+      for die in range(min(batch, dice - start))])
   
   if mode == 'lowest':
     out = sorted(results)[:count]
@@ -95,19 +326,452 @@ def roll(dice, sides, count, mode, return_sum, must_finish_by):
     out = results
   return sum(out) if return_sum else out
 
-def flatten(items, seqtypes=(list, tuple)):
-  '''Flattens an arbitrarily nested list or tuple down into a single-depth
-  vector (tuple or list, depending on input).'''
-  if isinstance(items, tuple):
-    revert_to_tuple = True
-    items = list(items)
+def table_roll(dice, sides, block, budget):
+  '''Rolls and sums `dice` dice by drawing sums of `block` dice at a time
+  from cumulative distribution tables, giving sums with the same
+  distribution as `scalar_roll`.'''
+  return sum_tables.roll(dice, sides, block, budget)
+
+def vector_roll(dice, sides, count, mode, return_sum, budget):
+  '''Rolls dice with NumPy, as described for `roll`, giving results with
+  the same distribution as `scalar_roll`. The generator is seeded from the
+  `random` module, so seeding `random` makes both reproducible.
+  
+  Dice are drawn a chunk at a time, checking the clock between chunks. When
+  only some dice are kept, just the best of them so far are carried from one
+  chunk to the next, found by partial selection rather than by sorting the
+  whole pool; only the kept dice are ever sorted.'''
+  generator = numpy.random.default_rng(random.getrandbits(128))
+  keep = mode in ('highest', 'lowest')
+  # Slicing gives `count` the same meaning it has for a sorted list.
+  kept = len(range(dice)[:count]) if keep else dice
+  
+  # For "highest", dice are negated so that the kept dice are always the
+  # smallest values, and sorting them gives descending order.
+  sign = -1 if mode == 'highest' else 1
+  best = numpy.empty(0, dtype=numpy.int64)
+  chunks = [ ]
+  total = 0
+  remaining = dice
+  while remaining > 0:
+    budget.check(DiceRollTimeout)
+    size = min(remaining, VECTOR_CHUNK_SIZE)
+    remaining -= size
+    chunk = generator.integers(1, sides, size=size, endpoint=True)
+    if keep:
+      best = numpy.concatenate((best, sign * chunk))
+      if len(best) > kept:
+        best = numpy.partition(best, kept - 1)[:kept] if kept else best[:0]
+    elif return_sum:
+      total += int(chunk.sum())
+    else:
+      chunks.append(chunk)
+  
+  if keep:
+    best = sign * numpy.sort(best)
+    out = int(best.sum()) if return_sum else best.tolist()
+  elif return_sum:
+    out = total
+  else:
+    out = numpy.concatenate(chunks).tolist()
+  return out
+
+def sum_or_join(operand):
+  '''Sum a list of numbers or concatenate a |list of strings|, or
+  |list of lists/tuples|, or |list of dicts|. For a complex number,
+  this will give the imaginary part.'''
+  if isinstance(operand, range):
+    # The sum of an arithmetic series, without visiting its elements.
+    out = len(operand) * (operand[0] + operand[-1]) // 2 if operand else 0
+  elif isinstance(operand, Iterable) and operand:
+    out = operand[0]
+    if isinstance(out, list):
+      # `+=` extends a list in place, and the first may be held elsewhere.
+      out = out[:]
+    for element in operand[1:]:
+      out += element
+  elif isinstance(operand, Iterable) and not operand:
+    out = 0
+  elif isinstance(operand, numbers.Complex):
+    out = operand.imag
+  else:
+    out = operand
+  return out
+
+def length(operand):
+  '''The length of an iterable, or the arity of a function.'''
+  if isinstance(operand, Iterable):
+    out = len(operand)
+  elif isinstance(operand, function.Function):
+    out = len(operand.params)
+  else:
+    out = 0
+  return out
+
+def selection(operand):
+  '''Select a random element from an iterable.'''
+  if isinstance(operand, numbers.Number):
+    operand = [operand]
+  elif isinstance(operand, dict):
+    operand = [[key, value] for key, value in operand.items()]
+  return random.choice(operand)
+
+def extremum(operand, extremum_type):
+  '''Find max or min, depending on `extremum_type`.'''
+  if not isinstance(operand, Iterable):
+    operand = [operand]
+  elif isinstance(operand, range) and operand:
+    # The ends of a range are its extrema.
+    operand = [operand[0], operand[-1]]
+  return min(operand) if extremum_type == 'minimum' else max(operand)
+
+def flatten_or_abs(operand):
+  '''The absolute value of a number, or the flattened form of a nested
+  sequence.'''
+  if isinstance(operand, numbers.Number):
+    out = abs(operand)
+  elif isinstance(operand, Sequence):
+    out = flatten(operand)
   else:
-    revert_to_tuple = False
+    out = operand
+  return out
+
+def stats(operand):
+  '''Generate a number summary from some iterable.'''
+  if isinstance(operand, numbers.Number):
+    operand = [operand]
+  elif isinstance(operand, dict):
+    operand = list(operand.values())
+  kinds = set(map(type, operand))
+  if len(operand) and kinds == {int}:
+    return stats_of_runs(*runs(operand))
+  vector = (numpy is not None and kinds == {float}
+    and len(operand) >= VECTOR_STATS_SIZE)
+  if vector:
+    array = numpy.array(operand, dtype=numpy.float64)
+    vector = bool(numpy.isfinite(array).all())
   
-  for i, x in enumerate(items):
-    while i < len(items) and isinstance(items[i], seqtypes):
-      items[i:i+1] = items[i]
-  return tuple(items) if revert_to_tuple else items
+  out = { }
+  if vector:
+    # `statistics.mean` rounds the exact sum once.
+    out['average'] = float(exact_sum(array) / len(operand))
+  else:
+    out['average'] = statistics.mean(operand)
+  out['minimum'] = min(operand)
+  # Sorted once, for the median and both quartiles.
+  if vector:
+    ordered = numpy.sort(array, kind='stable').tolist()
+  else:
+    ordered = sorted(operand)
+  out['median' ] = median_of_sorted(ordered)
+  out['maximum'] = max(operand)
+  out['size'   ] = len(operand)
+  out['sum'    ] = sum(operand)
+  squares = None
+  if vector:
+    squares = squared_deviations(array, 1, out['average'])
+  if squares is None:
+    out['stddev' ] = statistics.pstdev(operand, out['average'])
+  else:
+    out['stddev' ] = sqrt_of_fraction(squares / len(operand))
+  if all(map(operator.le, ordered, itertools.islice(ordered, 1, None))):
+    # The values either side of the median are either end of the sorted
+    # values, unless some of them, like NaN, cannot be ordered.
+    lower = ordered[:bisect.bisect_left(ordered, out['median'])]
+    upper = ordered[bisect.bisect_right(ordered, out['median']):]
+  else:
+    lower = sorted(value for value in operand if value < out['median'])
+    upper = sorted(value for value in operand if value > out['median'])
+  out['q1'] = median_of_sorted(lower)
+  out['q3'] = median_of_sorted(upper)
+  return out
+
+def median_of_sorted(ordered):
+  '''`statistics.median` of values that are already sorted.'''
+  size = len(ordered)
+  if size == 0:
+    return statistics.median(ordered)
+  middle = size // 2
+  if size % 2:
+    return ordered[middle]
+  return (ordered[middle - 1] + ordered[middle]) / 2
+
+def runs(integers):
+  '''The distinct values of a sequence of integers in ascending order, and
+  the number of times each occurs. NumPy sorts long sequences that fit in
+  64 bits, when it is installed.'''
+  if numpy is not None and len(integers) >= VECTOR_STATS_SIZE:
+    try:
+      array = numpy.fromiter(integers, dtype=numpy.int64, count=len(integers))
+    except OverflowError:
+      pass
+    else:
+      values, counts = numpy.unique(array, return_counts=True)
+      return values.tolist(), counts.tolist()
+  tally = Counter(integers)
+  values = sorted(tally)
+  return values, [tally[value] for value in values]
+
+def stats_of_tally(tally):
+  '''The number summary of `stats` for integers given as a dict from each
+  value to the number of times it occurs.'''
+  values = sorted(tally)
+  return stats_of_runs(values, [tally[value] for value in values])
+
+def stats_of_runs(values, counts):
+  '''The number summary of `stats` for integers given as the distinct
+  values in ascending order and the number of times each occurs. Every field
+  is computed from the distinct values alone, and is exactly what `stats`
+  gives for the same integers listed in any order.'''
+  ends = list(itertools.accumulate(counts))
+  size = ends[-1] if ends else 0
+  if not size:
+    return stats([])
+  
+  def at(i):
+    return values[bisect.bisect_right(ends, i)]
+  
+  def median_of(start, stop):
+    # As `statistics.median` takes it from the sorted data.
+    if start == stop:
+      return statistics.median([])
+    middle = (start + stop) // 2
+    if (stop - start) % 2:
+      return at(middle)
+    return (at(middle - 1) + at(middle)) / 2
+  
+  total = sum(map(operator.mul, values, counts))
+  out = { }
+  out['average'] = total // size if total % size == 0 else total / size
+  out['minimum'] = values[0]
+  out['median' ] = median_of(0, size)
+  out['maximum'] = values[-1]
+  out['size'   ] = size
+  out['sum'    ] = total
+  
+  squares = None
+  if numpy is not None and len(values) >= VECTOR_STATS_SIZE:
+    squares = squared_deviations(values, counts, out['average'])
+  if squares is None:
+    # `statistics.pstdev` sums the squared deviations, as computed with the
+    # type of the mean, exactly. Each is a ratio over a power of two, so
+    # they are summed over each denominator before any Fraction is made.
+    partials = { }
+    for value, count in zip(values, counts):
+      deviation = value - out['average']
+      square = deviation * deviation
+      if type(square) is float and not math.isfinite(square):
+        # Overflowed, so fail as `statistics.pstdev` would.
+        statistics.pstdev([value], out['average'])
+      numerator, denominator = square.as_integer_ratio()
+      partials[denominator] = partials.get(denominator, 0) + count * numerator
+    squares = sum(Fraction(n, d) for d, n in partials.items())
+  out['stddev' ] = sqrt_of_fraction(Fraction(squares) / size)
+  
+  lower = bisect.bisect_left(values, out['median'])
+  upper = bisect.bisect_right(values, out['median'])
+  out['q1'] = median_of(0, ends[lower - 1] if lower else 0)
+  out['q3'] = median_of(ends[upper - 1] if upper else 0, size)
+  return out
+
+def squared_deviations(values, counts, average):
+  '''The exact sum of the squares of the deviations of `values` from a float
+  `average`, each square computed in floating point and weighted by its
+  count, as `statistics.pstdev` sums them. Computed with NumPy, and None if
+  the average is not a float or a square is not finite.'''
+  if type(average) is not float:
+    return None
+  try:
+    deviations = numpy.asarray(values, dtype=numpy.float64) - average
+  except OverflowError:
+    return None
+  with numpy.errstate(over='ignore', invalid='ignore'):
+    squares = deviations * deviations
+  if not numpy.isfinite(squares).all():
+    return None
+  return exact_sum(squares, counts)
+
+def exact_sum(array, counts=1):
+  '''The exact sum of a NumPy array of finite floats, each weighted by its
+  count, as a Fraction. Each float is split into a 53-bit integer mantissa
+  and an exponent, and the mantissas are summed exactly over each exponent,
+  in halves small enough that the sums cannot overflow.'''
+  fractions, exponents = numpy.frexp(array)
+  mantissas = numpy.ldexp(fractions, 53).astype(numpy.int64)
+  counts = numpy.broadcast_to(
+    numpy.asarray(counts, dtype=numpy.int64), mantissas.shape)
+  distinct, group = numpy.unique(exponents, return_inverse=True)
+  sums = [ ]
+  for part in (mantissas >> 26, mantissas & ((1 << 26) - 1)):
+    partial = numpy.zeros(len(distinct), dtype=numpy.int64)
+    numpy.add.at(partial, group, part * counts)
+    sums.append(partial.tolist())
+  lowest = int(distinct[0]) if len(distinct) else 0
+  total = 0
+  for exponent, high, low in zip(distinct.tolist(), *sums):
+    total += ((high << 26) + low) << (exponent - lowest)
+  return Fraction(total) * Fraction(2) ** (lowest - 53)
+
+# Bits of a square root computed as an integer before it is rounded to a
+# float, enough for the float to be correctly rounded.
+SQRT_BITS = 2 * sys.float_info.mant_dig + 3
+
+def sqrt_of_fraction(value):
+  '''The square root of a nonnegative Fraction, correctly rounded to a float,
+  as `statistics.pstdev` rounds it. The root is computed to `SQRT_BITS` bits
+  and rounded to odd, so that the last rounding is the only one.'''
+  n, m = value.numerator, value.denominator
+  q = (n.bit_length() - m.bit_length() - SQRT_BITS) // 2
+  if q >= 0:
+    m <<= 2 * q
+  else:
+    n <<= -2 * q
+  root = math.isqrt(n // m)
+  root |= root * root * m != n
+  return (root << q) / 1 if q >= 0 else root / (1 << -q)
+
+def sort(operand):
+  '''Return a sorted copy of an iterable.'''
+  if isinstance(operand, str):
+    out = ''.join(sorted(operand))
+  elif isinstance(operand, dict):
+    out = sorted(operand.values())
+  elif isinstance(operand, Sequence):
+    out = type(operand)(sorted(operand))
+  else:
+    out = operand
+  return out
+
+def shuffle(operand):
+  '''Return a shuffled copy of an iterable.'''
+  operand = operand[:]
+  if isinstance(operand, str):
+    operand = list(operand)
+    random.shuffle(operand)
+    out = ''.join(operand)
+  elif isinstance(operand, Sequence):
+    random.shuffle(operand)
+    out = operand
+  elif isinstance(operand, dict):
+    x = operand.values()
+    random.shuffle(x)
+    out = x
+  else:
+    out = operand
+  return out
+
+def sliced(iterable, key):
+  '''Index, key or slice into `iterable`. A slice of a lazy `range` is built
+  as the list that slicing its list would give.'''
+  out = iterable[key]
+  return list(out) if isinstance(out, range) else out
+
+def copy_path(target, subscripts):
+  '''A copy of `target` that can be changed at the end of the chain of
+  `subscripts` without changing `target`, which other variables may share.
+  Only the containers along the chain are copied, each shallowly. A tuple
+  along it cannot take the copy of its element, so then `target` is copied
+  deeply instead.'''
+  out = copy.copy(target)
+  node = out
+  for key in subscripts[:-1]:
+    child = copy.copy(node[key])
+    try:
+      node[key] = child
+    except TypeError:
+      return copy.deepcopy(target)
+    node = child
+  return out
+
+def make_slice(slice_type, slice_args):
+  '''Build the index, key or slice object described by a slice rule of the
+  grammar and its evaluated arguments.'''
+  for arg in slice_args: # Raise error with non-key objects.
+    if is_nonkey(arg):
+      e = f'Objects of type {arg.__class__.__name__} cannot be used '
+      e += f'as keys or indices. ({arg!r})'
+      raise OperationError(e)
+  if slice_type == 'whole_slice':
+    args = (None,) * 3
+  elif slice_type == 'start_slice':
+    args = (slice_args[0], None, None)
+  elif slice_type == 'start_step_slice':
+    args = (slice_args[0], None, slice_args[1])
+  elif slice_type == 'start_stop_slice':
+    args = (slice_args[0], slice_args[1], None)
+  elif slice_type == 'fine_slice':
+    args = slice_args
+  elif slice_type == 'stop_slice':
+    args = (None, slice_args[0], None)
+  elif slice_type == 'stop_step_slice':
+    args = (None, slice_args[0], slice_args[1])
+  elif slice_type == 'step_slice':
+    args = (None, None, slice_args[0])
+  elif slice_type == 'not_a_slice':
+    return slice_args[0]
+  return slice(*args)
+
+def search(text, pattern):
+  '''The `seek` regular expression operator.'''
+  p = re.compile(pattern)
+  match = p.search(text)
+  if match is None:
+    start = -1
+    end   = -1
+  else:
+    start = match.start()
+    end   = match.end()
+  return {'start' : start, 'end' : end}
+
+def match(text, pattern):
+  '''The `like` regular expression operator.'''
+  p = re.compile(pattern)
+  return p.match(text) is not None
+
+def typeof(obj):
+  '''A string describing the type of an object.'''
+  if isinstance(obj, function.Function):
+    out = 'func'
+  else:
+    out = type(obj).__name__
+  return out
+
+def number_literal(text):
+  '''Constructs an int, float or complex number from the text of a numeric
+  literal, preferring the simplest type that can represent it.'''
+  for num_type in (int, float, complex):
+    try:
+      return num_type(text)
+    except (ValueError, TypeError):
+      pass
+  raise ValueError(f'{text!r} could not be parsed as a numeric!')
+
+def string_literal(text):
+  '''Constructs a string from the text of a string literal.'''
+  return eval(text)
+
+def boolean_literal(text):
+  '''Constructs a bool from the text of a boolean literal.'''
+  return eval(text)
+
+def flatten(items, seqtypes=(list, tuple)):
+  '''Flattens an arbitrarily nested list or tuple down into a single-depth
+  vector (tuple or list, depending on input). The nesting is walked with a
+  stack of the sequences being read, so each element is visited once however
+  deep it is, and `items` is left as it was.'''
+  if not isinstance(items, seqtypes):
+    return items
+  out = [ ]
+  stack = [iter(items)]
+  while stack:
+    for item in stack[-1]:
+      if isinstance(item, seqtypes):
+        stack.append(iter(item))
+        break
+      out.append(item)
+    else:
+      stack.pop()
+  return tuple(out) if isinstance(items, tuple) else out
 
 def string_format(format_string, fields):
   '''Handles string formatting for %% operator.'''
@@ -119,11 +783,47 @@ def string_format(format_string, fields):
     out = format_string.format(fields)
   return out
 
-def range_list(closed, start, stop, step=1):
+def integer_range(closed, start, stop, step=1):
+  '''The `range` of the integers that `range_list` would list, or None when
+  its bounds are not all integers or the list would never end.'''
+  if not (type(start) is int and type(stop) is int and type(step) is int):
+    return None
+  if start == stop:
+    return range(start, start + 1) if closed else range(0)
+  if step == 0:
+    return None
+  step = abs(step) if start < stop else -abs(step)
+  if closed:
+    stop += step
+  return range(start, stop, step)
+
+def lazy_range(closed, start, stop, step=1, budget=None):
+  '''The elements of `range_list` for an operator that only reads them: a
+  `range`, which takes no memory, when they are integers few enough for
+  Python to count, and otherwise the list itself.'''
+  if step == 0:
+    raise OperationError('Range step must not be zero.')
+  out = integer_range(closed, start, stop, step)
+  if out is None or abs(out.stop - out.start) > sys.maxsize:
+    out = range_list(closed, start, stop, step, budget)
+  return out
+
+def range_list(closed, start, stop, step=1, budget=None):
   '''Generates a list of integers from start to stop by step. Step is always
   corrected to the correct sign depending on whether start>stop or not. As
   such, the sign of step does not matter. Closed is a boolean variable that
-  determines whether stop should be included in the list.'''
+  determines whether stop should be included in the list. The list is
+  charged to `budget`, if given, before it is built.'''
+  if step == 0:
+    raise OperationError('Range step must not be zero.')
+  integers = integer_range(closed, start, stop, step)
+  if integers is not None:
+    length = -((integers.start - integers.stop) // integers.step)
+    governor.limit_length(length, 'Range')
+    if budget is not None:
+      budget.spend(governor.elements(length))
+    return list(integers)
+
   if start > stop:
     upward = False
     step = -abs(step)
@@ -136,6 +836,18 @@ def range_list(closed, start, stop, step=1):
   if closed:
     stop += step
   
+  count = (stop - start) / step
+  if count == math.inf:
+    length = count
+  elif count > 1:
+    length = math.ceil(count)
+  else:
+    # A step past the end, or a step of nan, lists only the first element.
+    length = 1
+  governor.limit_length(length, 'Range')
+  if budget is not None:
+    budget.spend(governor.elements(length))
+  
   out = []
   i = start
   while (upward and i < stop) or (not upward and i > stop):
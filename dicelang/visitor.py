@@ -1,5 +1,5 @@
-import copy
 import math
+import os
 import random
 import re
 import statistics
@@ -12,7 +12,13 @@ from numbers import Real
 from numbers import Complex
 from numbers import Integral
 
+from dicelang import analysis
+from dicelang import compiler
+from dicelang import distribution
+from dicelang import governor
+from dicelang import machine
 from dicelang import plugins
+from dicelang import reductions
 from dicelang import util
 
 from dicelang.float_special import inf
@@ -41,8 +47,28 @@ from dicelang.identifier import Identifier
 from dicelang.ownership import ScopingData
 from dicelang.print_queue import PrintQueue
 
+ENGINES = ['walker', 'closure', 'vm']
+
+def default_engine():
+  '''The execution engine used when none is given explicitly, as configured
+  by the `DICELANG_ENGINE` environment variable.'''
+  return os.environ.get('DICELANG_ENGINE', 'walker')
+
 class Visitor(object):
-  def __init__(self, data, timeout=12):
+  def __init__(self, data, timeout=12, engine=None, units=governor.UNITS):
+    '''`engine` selects how syntax trees are executed: "walker" dispatches on
+    each node of the tree as it is visited, "closure" first compiles the tree
+    into nested Python closures and then calls those, and "vm" assembles it
+    into instructions for a register machine that runs without recursion. It
+    defaults to the `DICELANG_ENGINE` environment variable, or "walker".
+    `units` is the budget of work given to each command, as described in
+    `governor`, or None to limit commands only by time.'''
+    engine = default_engine() if engine is None else engine
+    if engine not in ENGINES:
+      raise ValueError(f'Unknown execution engine: {engine!r}.')
+    self.engine = engine
+    self.compiler = compiler.Compiler(self)
+    self.machine = machine.Machine(self)
     self.variable_data = data
     self.scoping_data = None
     
@@ -50,8 +76,9 @@ class Visitor(object):
     # versions of Atropos.
     self.loop_timeout = timeout
     self.execution_timeout = timeout * 3
+    self.units = units
     self.depth = 0
-    self.must_finish_by = None
+    self.budget = governor.Budget()
     self.print_queue = PrintQueue()
   
   def get_print_queue_on_error(self, user):
@@ -60,15 +87,31 @@ class Visitor(object):
     self.depth = 0
     return self.print_queue.flush(user)
     
-  def walk(self, parse_tree, scoping_data, from_interpreter=False):
-    '''Start execution of a syntax tree.'''
+  def walk(self, parse_tree, scoping_data, from_interpreter=False,
+      budget=None):
+    '''Start execution of a syntax tree, compiling it first if the closure
+    or machine engine is in use. A command from the interpreter is charged
+    to `budget`, or to a new budget of the Visitor's size.'''
     if from_interpreter:
-      self.must_finish_by = self.execution_timeout + time.time()
+      self.budget = budget if budget is not None else self.new_budget()
     self.scoping_data = scoping_data
     
+    if self.engine == 'closure':
+      # Compiled code is charged for a whole tree as it enters it, which
+      # includes each function call, and for each iteration of its loops.
+      run = self.compiler.compile(parse_tree)
+    elif self.engine == 'vm':
+      # As for the walker, a tree entered below the top level is the body of
+      # a function, where `return` is allowed. The machine charges its code
+      # as it enters it.
+      code = self.machine.assemble(parse_tree, in_function=self.depth > 0)
+      run = lambda: self.machine.run(code)
+    else:
+      run = lambda: self.handle_instruction(parse_tree)
+    
     self.depth += 1
     try:
-      result = self.handle_instruction(parse_tree)
+      result = run()
     except BreakSignal: # Occurs when break is used outside a loop
       raise BreakError()
     except SkipSignal:  # Occurs when skip is used outside a loop
@@ -93,25 +136,75 @@ class Visitor(object):
       out = result
     return out
   
+  def odds(self, parse_tree, scoping_data):
+    '''The distribution of the value of a whole command. When it cannot be
+    computed exactly, the command is run many times, each as if it were
+    entered on its own, and its outcomes are tallied. Variables it stores
+    are put back as they were after every run, and are never written.'''
+    exact = distribution.exact(parse_tree)
+    if exact is not None:
+      return exact
+    self.budget = self.new_budget()
+    user, server = scoping_data.user, scoping_data.server
+    outcomes = [ ]
+    for i in range(distribution.SAMPLES):
+      with self.variable_data.unit_of_work(discard=True):
+        value, printout = self.walk(parse_tree, ScopingData(user, server))
+      outcomes.append(value)
+    return distribution.estimate(outcomes)
+  
   def process_operands(self, children):
     '''Avoid typing the following list comprehension in a majority
     of handlers.'''
     return [self.handle_instruction(c) for c in children]
   
+  def handle_read(self, tree):
+    '''Evaluate an operand that is only read, never kept or changed, where a
+    range literal can be a lazy `range` rather than a list.'''
+    node = analysis.range_literal(tree)
+    if node is None:
+      return self.handle_instruction(tree)
+    self.budget.spend()
+    operands = self.process_operands(node.children)
+    closed = analysis.ranges[node.data]
+    return util.lazy_range(closed, *operands, budget=self.budget)
+  
+  def handle_reduction(self, rule, tree, reduce):
+    '''Apply `reduce`, the function of a reduction `rule`, to the value of
+    `tree`. When `tree` is a loop or repetition, its results are given to an
+    accumulator for the reduction as they are produced, rather than being
+    collected in a list first.'''
+    loop = analysis.reduced_loop(tree)
+    if loop is None and rule in analysis.readers:
+      return reduce(self.handle_read(tree))
+    elif loop is None:
+      return reduce(self.handle_instruction(tree))
+    self.budget.spend()
+    accumulator = reductions.accumulators[rule]()
+    if loop.data == 'for_loop':
+      self.handle_for_loop(loop.children, accumulator)
+    else:
+      self.handle_repetition(loop.children, accumulator)
+    return accumulator.value()
+  
+  def new_budget(self):
+    return governor.Budget(self.units, self.execution_timeout)
+  
   def handle_instruction(self, tree):
     '''Dispatch execution recursively through the syntax tree.'''
     
-    # Each time we address a new instruction, we check to see if we've
-    # taken longer than we promised to at the start of the interpreter call.
-    # If we have, then we must bail out and report failure to the user.
-    now = time.time()
-    if now > self.must_finish_by:
-      e = 'Dicelang command took too long! You may have chained '
-      e += 'too many dice together, constructed an extremely large '
-      e += 'number, or just tried to do too much at once.'
-      raise ExecutionTimeout(e)
+    # Each instruction is a unit of work. The budget is only checked, and
+    # the clock read, once enough units have been spent since it last was.
+    budget = self.budget
+    budget.used += 1
+    if budget.used >= budget.next_check:
+      budget.check()
     
-    if tree.data == 'start':
+    # Values computed ahead of time by the optimizer come first, since
+    # after folding they are the most common kind of leaf.
+    if tree.data == 'constant':
+      out = tree.children[0].value
+    elif tree.data == 'start':
       out = [self.handle_instruction(c) for c in tree.children][-1]
     elif tree.data == 'body':
       out = self.handle_instruction(tree.children[0])
@@ -266,6 +359,8 @@ class Visitor(object):
       out = self.handle_flatten_or_abs(tree.children)
     elif tree.data == 'stats':
       out = self.handle_stats(tree.children)
+    elif tree.data == 'odds':
+      out = self.handle_odds(tree.children)
     elif tree.data == 'sort':
       out = self.handle_sort(tree.children)
     elif tree.data == 'shuffle':
@@ -376,7 +471,8 @@ class Visitor(object):
     '''Builds a function object.'''
     code = children[-1]
     params = [c.value for c in children[:-1]]
-    closed = self.scoping_data.calling_environment()
+    names = analysis.free_names(code, params)
+    closed = self.scoping_data.calling_environment(names)
     out = Function(code, param_names=params, closed_vars=closed)
     out.visitor = self
     return out
@@ -385,7 +481,10 @@ class Visitor(object):
     '''Builds a custom alias object.'''
     identifier = self.handle_instruction(children[0])
     aliased = self.handle_instruction(children[1])
-    
+    return self.make_alias(identifier, aliased)
+  
+  def make_alias(self, identifier, aliased):
+    '''Store an alias of the function `aliased` under `identifier`.'''
     if not isinstance(aliased, Function):
       e = f'Value of type {aliased.__class__.__name__} cannot be aliased.'
       e += ' Only a Function can be aliased.'
@@ -404,24 +503,24 @@ class Visitor(object):
       out = obj
     return out
   
-  def handle_for_loop(self, children):
+  def handle_for_loop(self, children, results=None):
     '''Executes a block or expression once for each element of its
     iterable. The iterator variable takes the value of each element
     in order, from first to last, changing each iteration. As the for-loop
     is an expression, its return value is a list containing the return value
     of the loop's code for each iteration,, or an empty list if the code did
-    not execute. This list can be treated as a boolean.'''
+    not execute. This list can be treated as a boolean. The results are
+    appended to `results` instead, if given.'''
     iterator = self.handle_instruction(children[0])
-    iterable = self.handle_instruction(children[1])
+    iterable = self.handle_read(children[1])
     name = iterator.name
     if isinstance(iterable, dict):
       iterable = list(iterable.keys())
     
-    start = iterable[0] if len(iterable) else None
-    if start is None:
-      results = [ ]
-    else:
+    if results is None:
       results = [ ]
+    start = iterable[0] if len(iterable) else None
+    if start is not None:
       self.scoping_data.push_scope()
       for element in iterable:
         try:
@@ -447,7 +546,7 @@ class Visitor(object):
     results = [ ]
     timeout = time.time() + self.loop_timeout
     while self.handle_instruction(children[0]):
-      if time.time() > timeout:
+      if self.budget.now > timeout:
         times = len(results)
         raise WhileLoopTimeout(times)
       try:
@@ -469,7 +568,7 @@ class Visitor(object):
     results = [self.handle_instruction(children[0])]
     timeout = time.time() + self.loop_timeout
     while self.handle_instruction(children[1]):
-      if time.time() > timeout:
+      if self.budget.now > timeout:
         times = len(results)
         raise DoWhileLoopTimeout(times)
       try:
@@ -510,9 +609,13 @@ class Visitor(object):
   
   def handle_standard_import(self, children):
     '''Copies a variable by value to a new variable with the same name in the
-    server-level namespace.'''
-    ident = self.handle_instruction(children[1])
-    value = copy.deepcopy(ident.get())
+    server-level namespace. Like every import, the copy shares storage with
+    the original until either is changed, since stored values are never
+    changed in place; see `util.copy_path`.'''
+    return self.standard_import(self.handle_instruction(children[1]))
+  
+  def standard_import(self, ident):
+    value = ident.get()
     new_name = ident.name
     mode = 'server'
     if value is not Undefined:
@@ -529,7 +632,9 @@ class Visitor(object):
     return out
       
   def handle_standard_getattr_import(self, children):
-    operands = self.process_operands(children[1:])
+    return self.standard_getattr_import(self.process_operands(children[1:]))
+  
+  def standard_getattr_import(self, operands):
     ident = operands[0]
     try:
       name = ident.name
@@ -544,7 +649,7 @@ class Visitor(object):
         self.variable_data)
       
       print(val)
-      imported.put(copy.deepcopy(val))
+      imported.put(val)
       out = True
     except (KeyError, AttributeError) as e:
       print(e)
@@ -554,6 +659,9 @@ class Visitor(object):
   def handle_as_import(self, children):
     '''Copies a variable by value to a new variable with a different name.'''
     importable, alias = [self.handle_instruction(c) for c in children[1:]]
+    return self.as_import(importable, alias)
+  
+  def as_import(self, importable, alias):
     value = importable.get()
     new_name = alias.name
     if value is not Undefined:
@@ -562,15 +670,17 @@ class Visitor(object):
         self.scoping_data,
         alias.mode,
         self.variable_data)
-      imported.put(copy.deepcopy(value))
+      imported.put(value)
       out = True
     else:
       out = False
     return out
   
   def handle_as_getattr_import(self, children):
+    return self.as_getattr_import(self.process_operands(children[1:]))
+  
+  def as_getattr_import(self, operands):
     try:
-      operands = self.process_operands(children[1:])
       idents = operands[:-1]
       new_name = operands[-1].name
       mode = operands[-1].mode
@@ -582,7 +692,7 @@ class Visitor(object):
         self.scoping_data,
         mode,
         self.variable_data)
-      imported.put(copy.deepcopy(value))
+      imported.put(value)
       out = True
     except (KeyError, AttributeError):
       out = False
@@ -611,9 +721,11 @@ class Visitor(object):
  
   def handle_subscript_deletable(self, children):
     '''Handle deletion of mixed index/key and getattr subscripts of an object.'''
-    ident, subscripts = self.process_operands(children)
+    return self.delete_subscript(*self.process_operands(children))
+  
+  def delete_subscript(self, ident, subscripts):
     chain = ''.join([f'[{s!r}]' for s in subscripts])
-    target = ident.get()
+    target = util.copy_path(ident.get(), subscripts)
     val_repr = f'target{chain}'
     with Function.SerializableRepr():
       out = eval(val_repr)
@@ -624,9 +736,11 @@ class Visitor(object):
   def handle_subscript_set(self, children):
     '''Assign a value to an arbitrarily-nested subscript of an object held by
     an identifier. This allows for mixed index/key and getattr operations.'''
-    ident, subscripts, value = self.process_operands(children)
+    return self.set_subscript(*self.process_operands(children))
+  
+  def set_subscript(self, ident, subscripts, value):
     chain = ''.join([f'[{s!r}]' for s in subscripts])
-    target = ident.get()
+    target = util.copy_path(ident.get(), subscripts)
     with Function.SerializableRepr():
       stmt = f'target{chain} = {value!r}'
       exec(stmt)
@@ -666,12 +780,14 @@ class Visitor(object):
       out = self.handle_instruction(children[1])
     return out
 
-  def handle_repetition(self, children):
+  def handle_repetition(self, children, out=None):
     '''For loop shorthand. Left side is an expression to be evaluated, right
     side is the number of times to evaluate it. Return value is a list
-    containing the result of each evaluation of the left side.'''
+    containing the result of each evaluation of the left side, or `out`
+    with the results appended, if given.'''
     times = self.handle_instruction(children[1])
-    out = [ ]
+    if out is None:
+      out = [ ]
     for time in range(times):
       out.append(self.handle_instruction(children[0]))
     return out
@@ -706,40 +822,16 @@ class Visitor(object):
   
   def handle_comp_math(self, children):
     '''Support sensible mathematical chained comparisons, like Python's.'''
-    out = False
-    operands_and_operators = self.process_operands(children)
-    operations = {
-      '==' : lambda l, r: l == r,
-      '!=' : lambda l, r: l != r,
-      '>=' : lambda l, r: l >= r,
-      '<=' : lambda l, r: l <= r,
-      '>'  : lambda l, r: l  > r,
-      '<'  : lambda l, r: l  < r
-    }
-    for i in range(0, len(operands_and_operators)-2, 2):
-      left, op, right = operands_and_operators[i:i+3]
-      if not operations[op](left, right):
-        break
-    else:
-      out = True
-    return out
+    return util.chained_comparison(self.process_operands(children))
 
   def handle_comp_obj(self, children):
     '''Similar to comp_math, but handles only identity comparison.'''
-    out = False
-    operands_and_operators = self.process_operands(children)
-    operations = {'is': lambda l, r: l is r, 'is not': lambda l, r: l is not r}
-    for i in range(0, len(operands_and_operators)-2, 2):
-      left, op, right = operands_and_operators[i:i+3]
-      if not operations[op](left, right):
-        break
-    else:
-      out = True
-    return out
+    return util.chained_comparison(self.process_operands(children))
 
   def handle_present(self, children, negate=False):
     '''Membership check of left in right.'''
-    element, container = self.process_operands(children)
+    element = self.handle_instruction(children[0])
+    container = self.handle_read(children[1])
     out = element in container
     return out if not negate else not out
 
@@ -758,263 +850,105 @@ class Visitor(object):
   
   def handle_subtraction(self, children):
     '''Normal subtraction, as well as list element/dict key removal.'''
-    minuend, subtrahend = self.process_operands(children)
-    try:
-      result = minuend - subtrahend
-    except TypeError as e:
-      result = minuend[:]
-      try:
-        for x in subtrahend:
-          if x in minuend:
-            result.remove(x)
-      except:
-        raise OperationError(str(e))
-    return result
+    return util.subtraction(*self.process_operands(children))
 
-  def handle_catenation(self, children):  
+  def handle_catenation(self, children):
     '''Joins two numbers via their representation of digit strings.'''
-    numbers = self.process_operands(children)
-    intstrings = map(lambda x: str(int(x)), numbers)
-    return int(''.join(intstrings))
+    return util.catenation(*self.process_operands(children))
 
   def handle_multiplication(self, children):
     '''Handles multiplication of numerics and the repetition of ordered
     iterables.'''
-    factor1, factor2 = self.process_operands(children)
-    if isinstance(factor1, Sequence) and isinstance(factor2, Number):
-      out = util.iterable_repetition(factor1, factor2)
-    elif isinstance(factor1, Number) and isinstance(factor2, Sequence):
-      out = util.iterable_repetition(factor2, factor1)
-    else:
-      out = factor1 * factor2
-    return out
+    left, right = self.process_operands(children)
+    return util.multiplication(left, right, self.budget)
 
   def handle_division(self, children):
     '''Ordinary floating point division.'''
-    dividend, divisor = self.process_operands(children)
-    if divisor == 0:
-      sign = 1 if dividend >= 0 else -1
-      sign *= 1 if divisor >= 0 else -1
-      out = sign * inf
-    else:
-      out = dividend / divisor
-    return out
+    return util.division(*self.process_operands(children))
   
   def handle_remainder(self, children):
     '''Remainder for float or int.'''
-    dividend, divisor = self.process_operands(children)
-    if divisor == 0 and isinstance(dividend, Number):
-      out = nan
-    else:
-      out = dividend % divisor
-    return out
+    return util.remainder(*self.process_operands(children))
   
   def handle_floor_division(self, children):
     '''Divide and always round down, returning integer.'''
-    dividend, divisor = self.process_operands(children)
-    if divisor == 0:
-      sign = 1 if dividend >= 0 else -1
-      sign *= 1 if divisor >= 0 else -1
-      out = sign * inf
-    else:
-      out = dividend // divisor
-    return out
+    return util.floor_division(*self.process_operands(children))
   
   def handle_negation(self, children):
     '''Get the arithmetic inverse of a numeric value, or the reverse of
     some ordered iterable.'''
-    operand = self.process_operands(children)[0]
-    if isinstance(operand, Sequence):
-      out = operand[::-1]
-    else:
-      out = -operand
-    return out
+    return util.negation(self.process_operands(children)[0])
   
   def handle_real_part_or_nop(self, children):
     '''Get the absolute value of a numeric while keeping the same type;
     no-op on non-numerics.'''
-    operand = self.process_operands(children)[0]
-    if isinstance(operand, Complex):
-      out = operand.real
-    else:
-      out = operand
-    return out
+    return util.real_part_or_nop(self.process_operands(children)[0])
     
   def handle_exponent(self, children):
-    '''Handle exponents, which are strictly numeric (for now). Use inelegant
-    iterated multiplication for integer powers in order to allow for timeout
-    checks for when an extremely large number is being constructed.'''
+    '''Handle exponents, which are strictly numeric (for now).'''
     mantissa, exponent = self.process_operands(children)
-    if util.is_noninteger(exponent) and isinstance(mantissa, Number):
-      out = mantissa ** exponent
-    elif isinstance(exponent, Integral) and isinstance(mantissa, Number):
-      e = ExponentiationTimeout('Base or exponent too large in magnitude!')
-      out = 1
-      if exponent != 0:
-        for x in range(abs(exponent)):
-          if time.time() > self.must_finish_by:
-            raise e
-          out = out * mantissa
-        if exponent < 0:
-          out = 1 / out
-      else:
-        if mantissa == 0:
-          out = nan
-        else:
-          out = 1 # nonzero to the power zero is always 1
-    else:
-      raise OperationError('Operands to exponentiation (**) must be numeric!')
-    return out
+    return util.exponent(mantissa, exponent, self.budget)
   
   def handle_logarithm(self, children):
     '''Logarithm is overloaded with a format syntax in analogy with `%` being
     overloaded with an interpolation syntax.'''
-    base, exponent = self.process_operands(children)
-    if isinstance(base, str):
-      out = util.string_format(base, exponent)
-    else:
-      out = math.log(exponent, base)
-    return out
+    return util.logarithm(*self.process_operands(children))
 
   def handle_sum_or_join(self, children):
     '''Sum a list of numbers or concatenate a |list of strings|, or
     |list of lists/tuples|, or |list of dicts|. For a complex number,
     this will give the imaginary part.'''
-    operand = self.process_operands(children)[0]
-    if isinstance(operand, Iterable) and operand:
-      out = operand[0]
-      for element in operand[1:]:
-        out += element
-    elif isinstance(operand, Iterable) and not operand:
-      out = 0
-    elif isinstance(operand, Complex):
-      out = operand.imag
-    else:
-      out = operand
-    return out
+    return self.handle_reduction('sum_or_join', children[0], util.sum_or_join)
 
   def handle_length(self, children):
     '''Obtain the length of an iterable, or the arity of a function.'''
-    operand = self.process_operands(children)[0]
-    if isinstance(operand, Iterable):
-      out = len(operand)
-    elif isinstance(operand, Function):
-      out = len(operand.params)
-    else:
-      out = 0
-    return out
+    return self.handle_reduction('length', children[0], util.length)
   
   def handle_selection(self, children):
     '''Select a random element from an iterable.'''
-    operand = self.process_operands(children)[0]
-    if isinstance(operand, Number):
-      operand = [operand]
-    elif isinstance(operand, dict):
-      operand = [[key, value] for key, value in operand.items()]
-    return random.choice(operand)
+    return util.selection(self.process_operands(children)[0])
 
   def handle_extrema(self, children, extremum_type):
     '''Find max or min, depending on the speciifcs of the parse tree.'''
-    operand = self.process_operands(children)[0]
-    if not isinstance(operand, Iterable):
-      operand = [operand]
-    return min(operand) if extremum_type == 'minimum' else max(operand)
+    reduce = lambda operand: util.extremum(operand, extremum_type)
+    return self.handle_reduction(extremum_type, children[0], reduce)
   
   def handle_flatten_or_abs(self, children):
     '''Iterates through an arbitrarily-nested iterable and feeds all the scalar
     values into a new list, which is returned.'''
-    operand = self.process_operands(children)[0]
-    if isinstance(operand, Number):
-      out = abs(operand)
-    elif isinstance(operand, Sequence):
-      out = util.flatten(operand)
-    else:
-      out = operand
-    return out
+    return util.flatten_or_abs(self.process_operands(children)[0])
   
   def handle_stats(self, children):
     '''Generate a number summary from some iterable.'''
-    operand = self.process_operands(children)[0]
-    out = { }
-    if isinstance(operand, Number):
-      operand = [operand]
-    elif isinstance(operand, dict):
-      operand = operand.values()
-    out['average'] = statistics.mean(operand)
-    out['minimum'] = min(operand)
-    out['median' ] = statistics.median(operand)
-    out['maximum'] = max(operand)
-    out['size'   ] = len(operand)
-    out['sum'    ] = sum(operand)
-    out['stddev' ] = statistics.pstdev(operand, out['average'])
-    lower = [value for value in operand if value < out['median']]
-    upper = [value for value in operand if value > out['median']]
-    out['q1'] = statistics.median(lower)
-    out['q3'] = statistics.median(upper)
-    return out
+    return self.handle_reduction('stats', children[0], util.stats)
+
+  def handle_odds(self, children):
+    '''The probability of each outcome of an expression: exact when it can
+    be computed, and otherwise estimated by evaluating it many times.'''
+    exact = distribution.exact(children[0])
+    if exact is not None:
+      return exact.probabilities()
+    samples = distribution.SAMPLES
+    outcomes = [self.handle_instruction(children[0]) for i in range(samples)]
+    return distribution.estimate(outcomes).probabilities()
 
   def handle_sort(self, children):
     '''Return a sorted copy of an iterable.'''
-    operand = self.process_operands(children)[0]
-    if isinstance(operand, str):
-      out = ''.join(sorted(operand))
-    elif isinstance(operand, dict):
-      out = sorted(operand.values())
-    elif isinstance(operand, Sequence):
-      out = type(operand)(sorted(operand))
-    else:
-      out = operand
-    return out
+    return util.sort(self.process_operands(children)[0])
   
   def handle_shuffle(self, children):
     '''Return a shuffled copy of an iterable.'''
-    operand = self.process_operands(children)[0][:]
-    if isinstance(operand, str):
-      operand = list(operand)
-      random.shuffle(operand)
-      out = ''.join(operand)
-    elif isinstance(operand, Sequence):
-      random.shuffle(operand)
-      out = operand
-    elif isinstance(operand, dict):
-      x = operand.values()
-      random.shuffle(x)
-      out = x
-    else:
-      out = operand
-    return out
+    return util.shuffle(self.process_operands(children)[0])
 
   def handle_slices(self, slice_type, children):
     '''Handle slicing, indexing, and dict value retrieval.'''
-    slice_args = self.process_operands(children)
-    for arg in slice_args: # Raise error with non-key objects.
-      if util.is_nonkey(arg):
-        e = f'Objects of type {arg.__class__.__name__} cannot be used '
-        e += f'as keys or indices. ({arg!r})'
-        raise OperationError(e)
-    if slice_type == 'whole_slice':
-      args = (None,) * 3
-    elif slice_type == 'start_slice':
-      args = (slice_args[0], None, None)
-    elif slice_type == 'start_step_slice':
-      args = (slice_args[0], None, slice_args[1])
-    elif slice_type == 'start_stop_slice':
-      args = (slice_args[0], slice_args[1], None)
-    elif slice_type == 'fine_slice':
-      args = slice_args
-    elif slice_type == 'stop_slice':
-      args = (None, slice_args[0], None)
-    elif slice_type == 'stop_step_slice':
-      args = (None, slice_args[0], slice_args[1])
-    elif slice_type == 'step_slice':
-      args = (None, None, slice_args[0])
-    elif slice_type == 'not_a_slice':
-      return slice_args[0]
-    return slice(*args)
+    return util.make_slice(slice_type, self.process_operands(children))
+  
   
   def handle_sliced(self, children):
-    iterable, key_index_slice = self.process_operands(children)
-    return iterable[key_index_slice]
+    iterable = self.handle_read(children[0])
+    key_index_slice = self.handle_instruction(children[1])
+    return util.sliced(iterable, key_index_slice)
 
   def handle_plugin_call(self, children):
     '''Find a plugin by the alias provided as the left operand and execute it
@@ -1031,7 +965,7 @@ class Visitor(object):
     dice, sides = operands[:2]
     count = operands[2] if len(operands) > 2 else None
     as_sum = result_type == 'scalar'
-    d = util.roll(dice, sides, count, keep_mode, as_sum, self.must_finish_by)
+    d = util.roll(dice, sides, count, keep_mode, as_sum, self.budget)
     return d
   
   def handle_apply(self, children):
@@ -1080,31 +1014,19 @@ class Visitor(object):
   def handle_search(self, children):
     '''Handle the `seek` regular expression operator.'''
     text, pattern = [self.handle_instruction(c) for c in children[0::2]]
-    p = re.compile(pattern)
-    match = p.search(text)
-    if match is None:
-      start = -1
-      end   = -1
-    else:
-      start = match.start()
-      end   = match.end()
-    return {'start' : start, 'end' : end}
+    return util.search(text, pattern)
+  
   
   def handle_match(self, children):
     '''Handle the `like` regular expression operator.'''
     text, pattern = [self.handle_instruction(c) for c in children[0::2]]
-    p = re.compile(pattern)
-    match = p.match(text)
-    return match is not None
+    return util.match(text, pattern)
+  
   
   def handle_typeof(self, children):
     '''Generates a string describing the type of an object.'''
-    obj = self.handle_instruction(children[1])
-    if isinstance(obj, Function):
-      out = 'func'
-    else:
-      out = type(obj).__name__
-    return out
+    return util.typeof(self.handle_instruction(children[1]))
+  
   
   def handle_print(self, children, trailer):
     '''Adds the value of an expression to the print queue
@@ -1125,37 +1047,15 @@ class Visitor(object):
   
   def handle_number_literal(self, children):
     '''Constructs an int or float from a numeric literal.'''
-    child = children[-1]
-    
-    def try_parse_as(num_type, value):
-      try:
-        out = num_type(value)
-      except (ValueError, TypeError):
-        out = None
-      return out
-    
-    x = try_parse_as(int, child.value)
-    f = try_parse_as(float, child.value)
-    c = try_parse_as(complex, child.value)
-    
-    if x is not None:
-      return x
-    if f is not None:
-      return f
-    
-    if c is not None:
-      out = c
-    else:
-      raise ValueError(f'{child.value!r} could not be parsed as a numeric!')
-    return out
+    return util.number_literal(children[-1].value)
   
   def handle_boolean_literal(self, children):
     '''Constructs a bool from the literal syntax.'''
-    return eval(children[-1].value)
+    return util.boolean_literal(children[-1].value)
 
   def handle_string_literal(self, children):
     '''Constructs a string from the literal syntax.'''
-    return eval(children[-1].value)
+    return util.string_literal(children[-1].value)
   
   def handle_list_literal(self, children):
     '''Constructs a list literal from the literal syntax.'''
@@ -1166,12 +1066,15 @@ class Visitor(object):
     return out
   
   def handle_list_range_literal(self, children):
-    '''Constructs a list literal on the interval [1, n).'''
-    return util.range_list(False, *self.process_operands(children))
+    '''Constructs a list literal on the interval [1, n). An operator that
+    only reads the list is given a lazy `range` instead; see `handle_read`.'''
+    operands = self.process_operands(children)
+    return util.range_list(False, *operands, budget=self.budget)
   
   def handle_closed_list_literal(self, children):
     '''Constructs a list on the interval [1, n].'''
-    return util.range_list(True, *self.process_operands(children))
+    operands = self.process_operands(children)
+    return util.range_list(True, *operands, budget=self.budget)
   
   def handle_tuple(self, children):
     '''Constructs a tuple from the literal syntax.'''
@@ -0,0 +1,134 @@
+import re
+
+# Whitespace as understood by the command syntax. This is narrower than what
+# `str.strip()` removes; vertical tabs and non-breaking spaces are content.
+WHITESPACE = ' \t\f\r\n'
+WORD = re.compile(r'\w+')
+
+def might_be_command(text):
+  '''Cheap test run on every message the bot can see. Anything that fails
+  it cannot be a command, so it is rejected without further work.'''
+  return text.lstrip(WHITESPACE).startswith('+')
+
+class CommandType:
+  error = 'error'
+  roll_code = 'roll_code'
+  roll_lit  = 'roll_lit'
+  roll_help = 'roll_help'
+  roll_odds = 'roll_odds'
+  view_all  = 'view_all'
+  view_public = 'view_public'
+  view_shared = 'view_shared'
+  view_private = 'view_private'
+  view_core = 'view_core'
+  view_help = 'view_help'
+  view_builtins = 'view_builtins'
+  help_topic = 'help_topic'
+  help_help = 'help_help'
+  
+  views = [
+    view_public, view_private,
+    view_core,   view_shared,
+    view_help,   view_all,
+    view_builtins,
+  ]
+  
+  no_args = views + [help_help] + [roll_help]
+  rolls = [roll_code, roll_lit, roll_odds]
+  helps = [help_help, help_topic]
+  
+  all_rolls = [roll_code, roll_lit, roll_odds, roll_help]
+  
+
+class Recognizer(object):
+  '''A deterministic recognizer for the command syntax:
+  
+    +[atropos] old <code>
+    +[atropos] roll [<code>]
+    +[atropos] odds [<code>]
+    +[atropos] view [all|global|our|my|core|builtin [vars]]
+    +[atropos] view [globals|shareds|privates|library|builtins|<word>]
+    +[atropos] help [<topic> [<option> ...]]
+  
+  Keywords may be separated by whitespace or run together, except that help
+  topics must be separate words. Code is passed through verbatim, less any
+  trailing whitespace.'''
+  
+  views = [
+    ('all',     CommandType.view_all),
+    ('global',  CommandType.view_public),
+    ('our',     CommandType.view_shared),
+    ('my',      CommandType.view_private),
+    ('core',    CommandType.view_core),
+    ('builtin', CommandType.view_builtins),
+  ]
+  
+  view_words = {
+    'globals'  : CommandType.view_public,
+    'shareds'  : CommandType.view_shared,
+    'privates' : CommandType.view_private,
+    'library'  : CommandType.view_core,
+    'builtins' : CommandType.view_builtins,
+  }
+  
+  error = (CommandType.error, {})
+  
+  def recognize(self, text):
+    '''Returns the command type and its keyword arguments for a message.'''
+    if not might_be_command(text):
+      return self.error
+    rest = text.lstrip(WHITESPACE)[1:].lstrip(WHITESPACE)
+    if rest.startswith('atropos'):
+      rest = rest[len('atropos'):].lstrip(WHITESPACE)
+    
+    if rest.startswith('old'):
+      out = self.roll(rest[len('old'):], CommandType.roll_code)
+    elif rest.startswith('roll'):
+      out = self.roll(rest[len('roll'):], CommandType.roll_lit)
+    elif rest.startswith('odds'):
+      out = self.roll(rest[len('odds'):], CommandType.roll_odds)
+    elif rest.startswith('view'):
+      out = self.view(rest[len('view'):].strip(WHITESPACE))
+    elif rest.startswith('help'):
+      out = self.help(rest[len('help'):])
+    else:
+      out = self.error
+    return out
+  
+  def roll(self, code, command_type):
+    value = code.rstrip(WHITESPACE)
+    if not value and command_type != CommandType.roll_code:
+      return CommandType.roll_help, {}
+    if not value:
+      # `+old` requires code; whitespace alone counts as a single character.
+      if not code:
+        return self.error
+      value = code[0]
+    out = {'value': value}
+    if command_type == CommandType.roll_lit:
+      out['option'] = 'literate'
+    return command_type, out
+  
+  def view(self, option):
+    if not option:
+      return CommandType.view_help, {}
+    if option in Recognizer.view_words:
+      return Recognizer.view_words[option], {}
+    for keyword, command_type in Recognizer.views:
+      if option.startswith(keyword):
+        if option[len(keyword):].lstrip(WHITESPACE) in ('', 'vars'):
+          return command_type, {}
+    if WORD.fullmatch(option):
+      return CommandType.view_help, {}
+    return self.error
+  
+  def help(self, arguments):
+    if not arguments.strip(WHITESPACE):
+      return CommandType.help_help, {}
+    if arguments[0] not in WHITESPACE:
+      return self.error
+    words = re.split(f'[{WHITESPACE}]+', arguments.strip(WHITESPACE))
+    if not all(WORD.fullmatch(word) for word in words):
+      return self.error
+    option = words[1] if len(words) > 1 else ''
+    return CommandType.help_topic, {'value': words[0], 'option': option}
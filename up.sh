@@ -1,6 +1,9 @@
 source ./env/bin/activate
 export ATROPOS_CONFIG="/home/$USER/.atropos-vars"
 export DICELANG_CORE_EDITORS="$ATROPOS_CONFIG/editors"
+export DICELANG_PARSER="lalr"
+export DICELANG_ENGINE="closure"
+export DICELANG_FLUSH_INTERVAL="250"
 export ATROPOS_TOKEN_FILE="$ATROPOS_CONFIG/token"
 export ATROPOS_ID_FILE="$ATROPOS_CONFIG/id"
 export DJANGO_ALLOW_ASYNC_UNSAFE="true"